@@ -1,24 +1,17 @@
 from django.contrib import admin
 from django.http import HttpResponse
 from .models import *
-from .langchain_bot import generate_faiss
+from .jobs import enqueue_indexing_job
 
 @admin.action(description='Index documents with FAISS')
 def index_faiss_action(modeladmin, request, queryset):
-    # Get the theme ID and theme name from the queryset
-    themes = queryset.values_list('theme', flat=True).distinct()
-    
-    if len(themes) == 1:
-        # Only proceed if there is a single theme for the selected documents
-        theme_id = themes[0]
-        theme_name = DocThemes.objects.get(id=theme_id).theme
-        
-        # Run the FAISS indexing for the selected theme
-        generate_faiss(theme_id, theme_name)
-        return HttpResponse('FAISS indexing completed.')
-    else:
-        # If multiple themes are selected, show a message
-        return HttpResponse('Please select documents with the same theme to run FAISS indexing.')
+    # Get the themes of the selected documents
+    theme_ids = queryset.values_list('theme', flat=True).distinct()
+
+    # Queue one indexing job per theme; the index_worker command runs them
+    jobs = [enqueue_indexing_job(theme) for theme in DocThemes.objects.filter(id__in=theme_ids)]
+    job_list = ", ".join(f"{job.id} ({job.theme.theme})" for job in jobs)
+    return HttpResponse(f'FAISS indexing queued. Jobs: {job_list}')
 
 class DocumentAdmin(admin.ModelAdmin):
     actions = [index_faiss_action]
@@ -27,4 +20,5 @@ admin.site.register(Docs, DocumentAdmin)
 admin.site.register(ChatSession)
 admin.site.register(ChatMessage)
 admin.site.register(DocThemes)
-admin.site.register(PartitonPypes)
\ No newline at end of file
+admin.site.register(PartitonPypes)
+admin.site.register(IndexingJob)
\ No newline at end of file
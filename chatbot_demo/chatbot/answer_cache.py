@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+
+from .index_cache import index_stamp
+
+
+class SemanticAnswerCache:
+    # Process-wide cache of answers to questions asked without conversation
+    # context, keyed by theme(s) and looked up by question embedding: a small
+    # exact inner-product FAISS index of normalized question vectors per theme
+    # key returns the answer of the most similar earlier question when its
+    # cosine similarity reaches the threshold. Entries expire after ttl seconds
+    # and a theme's entries are dropped once its index changes on disk.
+
+    def __init__(self, threshold=0.95, ttl=3600, max_size=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._themes = {}  # theme names -> {"stamp", "index", "entries": [(expires at, answer)]}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, doc_paths, vector):
+        # doc_paths: [(theme, index directory)] the answer was retrieved from
+        key, stamp = self._key(doc_paths)
+        query = normalized(vector)
+        with self._lock:
+            theme = self._current(key, stamp)
+            if theme is not None and theme["index"].ntotal:
+                similarities, positions = theme["index"].search(query, 1)
+                if similarities[0][0] >= self.threshold:
+                    self.hits += 1
+                    return theme["entries"][positions[0][0]][1]
+            self.misses += 1
+        return None
+
+    def put(self, doc_paths, vector, answer):
+        import faiss
+
+        key, stamp = self._key(doc_paths)
+        query = normalized(vector)
+        with self._lock:
+            theme = self._current(key, stamp)
+            if theme is None:
+                theme = self._themes[key] = {"stamp": stamp, "index": faiss.IndexFlatIP(query.shape[1]), "entries": []}
+            theme["index"].add(query)
+            theme["entries"].append((time.monotonic() + self.ttl, answer))
+            # Entries are in insertion order, so the oldest go first
+            self._drop_oldest(theme, len(theme["entries"]) - self.max_size)
+
+    def invalidate(self, index_name=None):
+        # Drop the answers retrieved from a theme (all themes without a name)
+        with self._lock:
+            for key in list(self._themes):
+                if index_name is None or index_name in key:
+                    del self._themes[key]
+                    self.invalidations += 1
+
+    def _key(self, doc_paths):
+        return tuple(name for name, _ in doc_paths), tuple(index_stamp(doc_path) for _, doc_path in doc_paths)
+
+    def _current(self, key, stamp):
+        # The theme's entries, without the expired ones; None once its index changed
+        theme = self._themes.get(key)
+        if theme is None:
+            return None
+        if theme["stamp"] != stamp:
+            del self._themes[key]
+            self.invalidations += 1
+            return None
+        # Every entry lives for the same ttl, so the expired ones are the oldest
+        now = time.monotonic()
+        expired = 0
+        while expired < len(theme["entries"]) and theme["entries"][expired][0] <= now:
+            expired += 1
+        self._drop_oldest(theme, expired)
+        return theme
+
+    def _drop_oldest(self, theme, count):
+        if count > 0:
+            # IndexFlat shifts the remaining vectors down, keeping them aligned with the entries
+            theme["index"].remove_ids(np.arange(count, dtype="int64"))
+            del theme["entries"][:count]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": sum(len(theme["entries"]) for theme in self._themes.values()),
+                "themes": len(self._themes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def normalized(vector):
+    # (1, d) float32 unit vector, so inner product is cosine similarity
+    query = np.asarray(vector, dtype="float32").reshape(1, -1).copy()
+    norm = np.linalg.norm(query)
+    if norm:
+        query /= norm
+    return query
@@ -0,0 +1,383 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import multiprocessing
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from django.conf import settings
+from pydantic import PrivateAttr
+
+# Helpers shared by the benchmark management commands. Worker functions live at
+# module level so they can be started with the "spawn" multiprocessing context.
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return float(np.percentile(values, pct))
+
+
+def process_memory():
+    # Resident (RSS), proportional (PSS) and private memory of this process in MB.
+    # PSS splits shared pages between the processes mapping them, so the sum of
+    # PSS over all workers is the real memory cost on the node.
+    memory = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                memory[key] = int(value.split()[0]) / 1024
+    return {
+        "rss_mb": memory.get("Rss", 0.0),
+        "pss_mb": memory.get("Pss", 0.0),
+        "private_mb": memory.get("Private_Clean", 0.0) + memory.get("Private_Dirty", 0.0),
+    }
+
+
+class ConcurrencyTracker:
+    # Counts calls in flight and remembers the peak
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class SlowFakeChatModel(BaseChatModel):
+    # Local stand-in for ChatOpenAI that answers after a fixed delay
+    latency: float = 1.0
+    response: str = "This is a benchmark answer."
+    _tracker: ConcurrencyTracker = PrivateAttr(default_factory=ConcurrencyTracker)
+
+    @property
+    def _llm_type(self):
+        return "slow-fake-chat"
+
+    @property
+    def tracker(self):
+        return self._tracker
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._tracker:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._tracker:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+
+class SlowFakeEmbeddings(DeterministicFakeEmbedding):
+    # Deterministic embeddings that wait like a network round trip per call
+    latency: float = 0.0
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return super().embed_query(text)
+
+
+@contextmanager
+def benchmark_database():
+    # Run against a throwaway copy of the schema instead of the project database.
+    # SQLite gets a file database so concurrent threads can share it.
+    from django.db import connection
+
+    tmp_dir = tempfile.mkdtemp()
+    if connection.vendor == "sqlite":
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(tmp_dir, "benchmark.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@contextmanager
+def database_latency(seconds):
+    # Delay every query on this thread's connection, like a remote database
+    from django.db import connection
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(delay):
+        yield
+
+
+def latency_summary(latencies, wall_s):
+    return {
+        "requests": len(latencies),
+        "wall_s": wall_s,
+        "throughput_rps": len(latencies) / wall_s if wall_s else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+    }
+
+
+def drop_file_cache(doc_path):
+    # Ask the kernel to forget cached pages of the index files so every run
+    # starts cold (advisory, no root required)
+    for file_name in os.listdir(doc_path):
+        file_path = os.path.join(doc_path, file_name)
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def build_synthetic_index(doc_path, n_vectors, dim, seed=0):
+    from langchain_community.vectorstores import FAISS
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.random((n_vectors, dim), dtype="float32")
+    text_embeddings = [(f"synthetic chunk {i}", vector) for i, vector in enumerate(vectors)]
+
+    vector_store = FAISS.from_embeddings(text_embeddings, DeterministicFakeEmbedding(size=dim))
+    vector_store.save_local(doc_path)
+    return vectors
+
+
+def index_loading_worker(doc_path, mmap, query, barrier, results):
+    from .faiss_io import read_faiss_index
+
+    start = time.perf_counter()
+    vector_store = read_faiss_index(doc_path, DeterministicFakeEmbedding(size=len(query)), mmap=mmap)
+    loaded = time.perf_counter()
+    vector_store.similarity_search_by_vector(query, k=5)
+    answered = time.perf_counter()
+
+    # Measure only once every worker holds its index, so shared pages are split
+    barrier.wait()
+    results.put({
+        "load_s": loaded - start,
+        "first_query_s": answered - start,
+        **process_memory(),
+    })
+    barrier.wait()
+
+
+def run_index_loading(doc_path, mmap, workers, query):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+
+    processes = [
+        ctx.Process(target=index_loading_worker, args=(doc_path, mmap, query, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    first_query = [sample["first_query_s"] for sample in samples]
+    return {
+        "workers": workers,
+        "load_s_p50": percentile([sample["load_s"] for sample in samples], 50),
+        "first_query_s_p50": percentile(first_query, 50),
+        "first_query_s_max": max(first_query),
+        "rss_mb_per_worker": percentile([sample["rss_mb"] for sample in samples], 50),
+        "rss_mb_total": sum(sample["rss_mb"] for sample in samples),
+        "pss_mb_total": sum(sample["pss_mb"] for sample in samples),
+        "private_mb_total": sum(sample["private_mb"] for sample in samples),
+    }
+
+
+def clustered_vectors(n_vectors, dim, n_clusters=100, seed=0):
+    # Embedding-like data: points scattered around cluster centres. Uniform
+    # random vectors have no neighbourhood structure and understate ANN recall.
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim), dtype="float32")
+    labels = rng.integers(n_clusters, size=n_vectors)
+    return centres[labels] + 0.3 * rng.standard_normal((n_vectors, dim), dtype="float32")
+
+
+def recall_at_k(found_ids, true_ids, k):
+    # Share of the exact top k neighbours that the index returned
+    hits = sum(len(set(found[:k]) & set(true[:k])) for found, true in zip(found_ids, true_ids))
+    return hits / (k * len(true_ids))
+
+
+def run_ann_benchmark(vectors, queries, true_ids, k, factory, sweep, sample_size):
+    # Build one index layout and time single-query searches for each set of
+    # search parameters in sweep (nprobe, efSearch, rerank_factor)
+    from .faiss_io import RerankedIndex, apply_search_params, build_index, index_memory_bytes, training_sample
+
+    start = time.perf_counter()
+    index = build_index(factory, training_sample(vectors, sample_size))
+    index.add(vectors)
+    build_s = time.perf_counter() - start
+    index_mb = index_memory_bytes(index) / 2**20
+
+    results = []
+    for params in sweep:
+        apply_search_params(index, params)
+        searcher = index
+        if params.get("rerank_factor"):
+            searcher = RerankedIndex(index, vectors, params["rerank_factor"])
+        latencies = []
+        found_ids = []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = searcher.search(query.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start)
+            found_ids.append(ids[0].tolist())
+        results.append({
+            "factory": factory,
+            "params": params,
+            "build_s": build_s,
+            "index_mb": index_mb,
+            f"recall_at_{k}": recall_at_k(found_ids, true_ids, k),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+        })
+    return results
+
+
+# Modules the app imports on first use only; importing the app must not load them
+LAZY_MODULES = (
+    "faiss", "openai", "langchain_openai", "langchain_community",
+    "langchain_text_splitters", "PyPDF2", "docx", "tiktoken",
+)
+
+# What a worker or manage.py command imports at startup
+STARTUP_MODULES = ("chatbot.urls", "chatbot.admin", "chatbot.langchain_bot")
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+for name in {modules!r}:
+    __import__(name)
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_startup(modules=STARTUP_MODULES):
+    # Set up Django and import the app in a fresh interpreter with -X importtime.
+    # Returns the wall time, the lazy modules that got loaded and the cumulative
+    # import time in seconds of each top-level import.
+    env = dict(os.environ)
+    env.setdefault("DJANGO_SETTINGS_MODULE", "chatbot_demo.settings")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT.format(modules=list(modules))],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    output = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>package"
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        _, cumulative_us, name = line.split("|")
+        if not name[1:].startswith(" "):
+            top_level[name.strip()] = int(cumulative_us) / 1e6
+
+    loaded = set(output["modules"])
+    return {
+        "seconds": output["seconds"],
+        "lazy_modules_loaded": [name for name in LAZY_MODULES if name in loaded],
+        "imports": top_level,
+    }
+
+
+def write_synthetic_corpus(docs_dir, n_docs, words_per_doc, vocabulary_size=20000, seed=0):
+    # Text documents of random words from a fixed vocabulary, so chunks are
+    # distinct like real prose and the dedup stage keeps them. Returns the file
+    # paths and a list of questions quoting spans of the documents.
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"term{i}" for i in range(vocabulary_size)])
+    os.makedirs(docs_dir, exist_ok=True)
+
+    paths = []
+    questions = []
+    for doc in range(n_docs):
+        words = vocabulary[rng.integers(vocabulary_size, size=words_per_doc)]
+        path = os.path.join(docs_dir, f"doc{doc}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            # Sentences of 12 words, paragraphs of 8 sentences
+            for start in range(0, words_per_doc, 96):
+                sentences = [" ".join(words[i:i + 12]) for i in range(start, min(start + 96, words_per_doc), 12)]
+                f.write(". ".join(sentences) + ".\n\n")
+        paths.append(path)
+        start = int(rng.integers(max(1, words_per_doc - 8)))
+        questions.append("What about " + " ".join(words[start:start + 8]) + "?")
+    return paths, questions
+
+
+# Metrics where a larger value is a regression; for the others a smaller one is
+LOWER_IS_BETTER = ("_s", "_ms")
+
+
+def flatten_metrics(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    # Latency (p50_s, ...) and throughput (throughput_rps, ..._per_s) metrics
+    # that are more than tolerance worse than in baseline, as
+    # (metric, baseline value, current value)
+    current = flatten_metrics(results)
+    regressions = []
+    for name, before in flatten_metrics(baseline).items():
+        after = current.get(name)
+        if after is None or not before:
+            continue
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf.startswith("p") and leaf.endswith(LOWER_IS_BETTER):
+            worse = after > before * (1 + tolerance)
+        elif leaf == "throughput_rps" or leaf.endswith("_per_s"):
+            worse = after < before * (1 - tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append((name, before, after))
+    return regressions
@@ -0,0 +1,238 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+from .dedup import BAND_BITS, BAND_MASK, SIMHASH_BANDS, hamming_distance, simhash, simhash_bands, text_hash
+
+# Chunk texts of a theme index keyed by FAISS vector id, replacing the pickled
+# docstore of index.pkl. Opening it reads nothing; a search reads only the rows
+# of the chunks it returns.
+CHUNK_STORE_FILE = "chunks.sqlite3"
+
+# Rows written per INSERT when converting a pickled docstore
+WRITE_BATCH_SIZE = 1000
+
+# Docs ids bound per query, below SQLite's limit of host parameters
+QUERY_BATCH_SIZE = 500
+
+# Columns added to chunk stores written by earlier versions
+CHUNK_COLUMNS = ("doc_id", "text_hash", "simhash")
+
+# SimHash band of a chunk, as indexed and queried
+BAND_EXPRESSION = "((simhash >> {shift}) & {mask})"
+
+
+class ChunkStore(Docstore, AddableMixin):
+    # Docstore for the langchain FAISS wrapper. Docstore ids are the vector ids
+    # as strings (see ChunkIdMap), so chunks are added with explicit ids. Each
+    # chunk records the Docs row it was split from, so the vectors of one
+    # document can be removed; chunks converted from a pickle have none.
+    # Other documents containing a copy of the chunk are listed in chunk_refs,
+    # and the chunk stays indexed until the last of them is removed.
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread; theme searches run on a thread pool
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (vector_id INTEGER PRIMARY KEY, text TEXT NOT NULL, metadata TEXT, "
+                "doc_id INTEGER, text_hash INTEGER, simhash INTEGER)"
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(chunks)")]
+            for column in CHUNK_COLUMNS:
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE chunks ADD COLUMN {column} INTEGER")
+            connection.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS chunks_text_hash ON chunks (text_hash)")
+            for band in range(SIMHASH_BANDS):
+                connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS chunks_simhash_band{band} ON chunks "
+                    f"({band_expression(band)})"
+                )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_refs (doc_id INTEGER NOT NULL, vector_id INTEGER NOT NULL, "
+                "PRIMARY KEY (doc_id, vector_id))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS chunk_refs_vector_id ON chunk_refs (vector_id)")
+            self._local.connection = connection
+        return connection
+
+    def search(self, search):
+        row = self._connection().execute(
+            "SELECT text, metadata FROM chunks WHERE vector_id = ?", (int(search),)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        text, metadata = row
+        return Document(id=str(search), page_content=text, metadata=json.loads(metadata) if metadata else {})
+
+    def add(self, texts):
+        self.put_many((int(doc_id), doc) for doc_id, doc in texts.items())
+
+    def put_many(self, items, doc_id=None):
+        # Rows past the saved index are left over from an interrupted run and
+        # are overwritten when their vector ids are reused
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunks (vector_id, text, metadata, doc_id, text_hash, simhash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(vector_id, doc.page_content, json.dumps(doc.metadata) if doc.metadata else None, doc_id,
+                  text_hash(doc.page_content), simhash(doc.page_content))
+                 for vector_id, doc in items],
+            )
+
+    def next_vector_id(self):
+        return self._connection().execute("SELECT COALESCE(MAX(vector_id) + 1, 0) FROM chunks").fetchone()[0]
+
+    def doc_ids(self):
+        # Docs rows that have chunks, or copies of chunks, in the store
+        rows = self._connection().execute(
+            "SELECT doc_id FROM chunks WHERE doc_id IS NOT NULL UNION SELECT doc_id FROM chunk_refs"
+        )
+        return [doc_id for doc_id, in rows]
+
+    def find_copies(self, exact_hash, near_hash=None, max_distance=0):
+        # Vector ids of chunks with the same normalized text, then of chunks
+        # whose SimHash is at most max_distance bits from near_hash
+        connection = self._connection()
+        for vector_id, in connection.execute("SELECT vector_id FROM chunks WHERE text_hash = ?", (exact_hash,)):
+            yield vector_id
+        if near_hash is None or not max_distance:
+            return
+        bands = simhash_bands(near_hash)
+        rows = connection.execute(
+            "SELECT vector_id, simhash FROM chunks WHERE "
+            + " OR ".join(f"{band_expression(band)} = ?" for band in range(SIMHASH_BANDS)),
+            bands,
+        )
+        for vector_id, other_hash in rows:
+            if hamming_distance(near_hash, other_hash) <= max_distance:
+                yield vector_id
+
+    def add_refs(self, doc_id, vector_ids):
+        # doc_id also contains the chunks stored under vector_ids
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO chunk_refs (doc_id, vector_id) VALUES (?, ?)",
+                [(doc_id, int(vector_id)) for vector_id in vector_ids],
+            )
+
+    def release_docs(self, doc_ids):
+        # Drop the documents' claims on their chunks. A chunk that another
+        # document also contains is handed over to it; the vector ids of the
+        # chunks no document contains any more are returned, for the caller to
+        # remove from the index and then delete_many.
+        connection = self._connection()
+        released = []
+        with connection:
+            owned = []
+            for batch in batched(doc_ids, QUERY_BATCH_SIZE):
+                placeholders = ",".join("?" * len(batch))
+                connection.execute(f"DELETE FROM chunk_refs WHERE doc_id IN ({placeholders})", batch)
+                owned.extend(connection.execute(
+                    f"SELECT vector_id FROM chunks WHERE doc_id IN ({placeholders})", batch
+                ).fetchall())
+            for vector_id, in owned:
+                ref = connection.execute(
+                    "SELECT doc_id FROM chunk_refs WHERE vector_id = ? LIMIT 1", (vector_id,)
+                ).fetchone()
+                if ref is None:
+                    released.append(vector_id)
+                    continue
+                connection.execute("UPDATE chunks SET doc_id = ? WHERE vector_id = ?", (ref[0], vector_id))
+                connection.execute(
+                    "DELETE FROM chunk_refs WHERE doc_id = ? AND vector_id = ?", (ref[0], vector_id)
+                )
+        return released
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM chunks")
+            connection.execute("DELETE FROM chunk_refs")
+
+    def delete_many(self, vector_ids):
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM chunks WHERE vector_id = ?", [(int(vector_id),) for vector_id in vector_ids])
+            connection.executemany(
+                "DELETE FROM chunk_refs WHERE vector_id = ?", [(int(vector_id),) for vector_id in vector_ids]
+            )
+
+    def vacuum(self):
+        # Give the pages of deleted chunks back to the file system
+        self._connection().execute("VACUUM")
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class ChunkIdMap(MutableMapping):
+    # index_to_docstore_id of the FAISS wrapper: vector i has docstore id str(i),
+    # so nothing is stored per chunk
+
+    def __init__(self, size):
+        self.size = size
+
+    def __getitem__(self, vector_id):
+        if not 0 <= vector_id < self.size:
+            raise KeyError(vector_id)
+        return str(vector_id)
+
+    def __setitem__(self, vector_id, doc_id):
+        if doc_id != str(vector_id):
+            raise ValueError(f"Chunk {doc_id} must be added with its vector id {vector_id} as id.")
+        self.size = max(self.size, vector_id + 1)
+
+    def __delitem__(self, vector_id):
+        raise NotImplementedError("Chunks are removed per document with ChunkStore.delete_many.")
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __len__(self):
+        return self.size
+
+
+def band_expression(band):
+    return BAND_EXPRESSION.format(shift=band * BAND_BITS, mask=BAND_MASK)
+
+
+def batched(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def chunk_store_path(doc_path):
+    return os.path.join(doc_path, CHUNK_STORE_FILE)
+
+
+def convert_pickled_docstore(path, docstore, index_to_docstore_id, vector_ids):
+    # Copy the chunks of a pickled docstore into a chunk store at path, for the
+    # given vector ids (positions, unless the index was rebuilt with ids)
+    chunk_store = ChunkStore(path)
+    try:
+        for start in range(0, len(vector_ids), WRITE_BATCH_SIZE):
+            chunk_store.put_many(
+                (int(vector_id), docstore.search(index_to_docstore_id[int(vector_id)]))
+                for vector_id in vector_ids[start:start + WRITE_BATCH_SIZE]
+            )
+    finally:
+        chunk_store.close()
@@ -0,0 +1,111 @@
+import hashlib
+import re
+
+import numpy as np
+
+# Duplicate chunk detection for theme indexes. Chunks are compared by a hash of
+# their normalized text (exact duplicates) and by a 64-bit SimHash of their
+# word pairs (near duplicates: a word or two changed, e.g. two versions of the
+# same contract clause). Near duplicates are found through SIMHASH_BANDS bands
+# of 16 bits: two hashes at most SIMHASH_BANDS - 1 bits apart share a band.
+# A near duplicate is not stored, only a reference to the older chunk, so the
+# words that differ are not in the index: a one-word edit (an amount, a date)
+# lands within 3 bits more often than not. Near-duplicate matching is therefore
+# opt-in; the default max_distance of 0 only skips exact duplicates.
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+SHINGLE_SIZE = 2
+
+WORD_PATTERN = re.compile(r"\w+")
+BIT_SHIFTS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+
+def to_int64(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def text_hash(text):
+    words = WORD_PATTERN.findall(text.lower())
+    return to_int64(hash64(" ".join(words).encode()))
+
+
+def simhash(text):
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))]
+    hashes = np.array([hash64(shingle.encode()) for shingle in shingles], dtype=np.uint64)
+    # Each bit is set when most shingle hashes have it set
+    bits = (hashes[:, None] >> BIT_SHIFTS) & np.uint64(1)
+    majority = bits.sum(axis=0) * 2 > len(hashes)
+    return to_int64(int(sum(1 << bit for bit in np.flatnonzero(majority))))
+
+
+def simhash_bands(value):
+    return [(value >> (band * BAND_BITS)) & BAND_MASK for band in range(SIMHASH_BANDS)]
+
+
+def hamming_distance(a, b):
+    return ((a ^ b) & ((1 << SIMHASH_BITS) - 1)).bit_count()
+
+
+class ChunkDeduplicator:
+    # Finds the vector id of an indexed copy of a chunk: among the chunks
+    # registered during this indexing run, then in the theme's chunk store.
+    # Vector ids in exclude are being removed and do not count as copies.
+
+    def __init__(self, chunk_store=None, max_distance=0, exclude=()):
+        self.chunk_store = chunk_store
+        self.max_distance = min(max_distance, SIMHASH_BANDS - 1)
+        self.exclude = set(exclude)
+        self.exact = {}
+        self.bands = [{} for _ in range(SIMHASH_BANDS)]
+        self.duplicates = 0
+
+    def hashes(self, text):
+        return text_hash(text), simhash(text) if self.max_distance else None
+
+    def find(self, exact_hash, near_hash):
+        vector_id = self.exact.get(exact_hash)
+        if vector_id is not None:
+            return vector_id
+
+        if near_hash is not None:
+            for band, value in zip(self.bands, simhash_bands(near_hash)):
+                for other_hash, vector_id in band.get(value, ()):
+                    if hamming_distance(near_hash, other_hash) <= self.max_distance:
+                        return vector_id
+
+        if self.chunk_store is not None:
+            for vector_id in self.chunk_store.find_copies(exact_hash, near_hash, self.max_distance):
+                if vector_id not in self.exclude:
+                    return vector_id
+        return None
+
+    def add(self, exact_hash, near_hash, vector_id):
+        self.exact[exact_hash] = vector_id
+        if near_hash is not None:
+            for band, value in zip(self.bands, simhash_bands(near_hash)):
+                band.setdefault(value, []).append((near_hash, vector_id))
+
+    def split(self, chunks, first_id):
+        # (new chunks, vector ids of the copies of the others). New chunks are
+        # registered as vectors first_id, first_id + 1, ... in order.
+        new_chunks = []
+        copy_ids = []
+        for text in chunks:
+            exact_hash, near_hash = self.hashes(text)
+            vector_id = self.find(exact_hash, near_hash)
+            if vector_id is None:
+                self.add(exact_hash, near_hash, first_id + len(new_chunks))
+                new_chunks.append(text)
+            else:
+                copy_ids.append(vector_id)
+        self.duplicates += len(copy_ids)
+        return new_chunks, copy_ids
@@ -0,0 +1,236 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .single_flight import SingleFlight
+
+# Rows fetched per SELECT, kept below SQLite's bound parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+
+def embedding_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def embedding_model_name(embeddings):
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+def normalize_question(text):
+    # Questions differing only in case or spacing share one cache entry
+    return " ".join(text.split()).casefold()
+
+
+class EmbeddingStore:
+    # Content-addressed on-disk store of embedding vectors (SQLite, float32 blobs)
+
+    def __init__(self, path):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._initialized = True
+        return connection
+
+    def get_many(self, keys):
+        found = {}
+        connection = self._connect()
+        try:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype="float32").tolist()
+        finally:
+            connection.close()
+        return found
+
+    def put_many(self, items):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, np.asarray(vector, dtype="float32").tobytes()) for key, vector in items],
+                )
+        finally:
+            connection.close()
+
+
+class CachedEmbeddings:
+    # Wraps an embeddings client so document texts already embedded with the same
+    # model are read from the store instead of being sent to the API again.
+    # Duck-typed rather than a langchain Embeddings subclass, so importing this
+    # module does not load langchain.
+
+    def __init__(self, underlying, model_name, store):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors = self.store.get_many(list(set(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        if missing:
+            new_vectors = self.underlying.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), new_vectors))
+            self.store.put_many(new_items)
+            vectors.update(new_items)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [list(vectors[key]) for key in keys]
+
+    def embed_query(self, text):
+        return self.underlying.embed_query(text)
+
+
+class QueryEmbeddingCache:
+    # Bounded LRU + TTL cache of question -> embedding vector, shared by all themes.
+    # With a Django cache alias the vectors are also stored there, so workers
+    # behind a shared backend (Redis, Memcached, database) reuse each other's work.
+
+    def __init__(self, max_size=1024, ttl=3600, cache_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Concurrent misses on one question share a single embedding call
+        self._in_flight = SingleFlight("query_embedding")
+        self.hits = 0
+        self.misses = 0
+
+    def _shared_cache(self):
+        if not self.cache_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            blob = shared_cache.get(f"query-embedding:{key}")
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype="float32").tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, vector):
+        self._remember(key, vector)
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            blob = np.asarray(vector, dtype="float32").tobytes()
+            shared_cache.set(f"query-embedding:{key}", blob, timeout=self.ttl)
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def embed_query(self, embeddings, question):
+        key = embedding_key(embedding_model_name(embeddings), normalize_question(question))
+        vector = self.get(key)
+        if vector is None:
+            vector = self._in_flight.do(key, self._embed, embeddings, question, key)
+        return vector
+
+    def _embed(self, embeddings, question, key):
+        vector = embeddings.embed_query(question)
+        self.set(key, vector)
+        return vector
+
+    async def aget(self, key):
+        # Same as get, without blocking the event loop on the shared cache
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            blob = await shared_cache.aget(f"query-embedding:{key}")
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype="float32").tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def aset(self, key, vector):
+        self._remember(key, vector)
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            blob = np.asarray(vector, dtype="float32").tobytes()
+            await shared_cache.aset(f"query-embedding:{key}", blob, timeout=self.ttl)
+
+    async def aembed_query(self, embeddings, question):
+        key = embedding_key(embedding_model_name(embeddings), normalize_question(question))
+        vector = await self.aget(key)
+        if vector is None:
+            vector = await self._in_flight.ado(key, self._aembed, embeddings, question, key)
+        return vector
+
+    async def _aembed(self, embeddings, question, key):
+        vector = await embeddings.aembed_query(question)
+        await self.aset(key, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,33 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ChatMessage
+
+# Newline-delimited JSON export of chat history. Rows are read through a
+# server-side cursor (PostgreSQL) or chunked fetches (SQLite) and written one
+# line at a time, so memory stays flat whatever the number of rows.
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_queryset(user_id=None, session_id=None, since=None, until=None):
+    messages = ChatMessage.objects.all()
+    if user_id:
+        messages = messages.filter(session__user_id=user_id)
+    if session_id:
+        messages = messages.filter(session_id=session_id)
+    if since:
+        messages = messages.filter(created_at__gte=since)
+    if until:
+        messages = messages.filter(created_at__lt=until)
+
+    return messages.order_by('created_at', 'id').values(
+        'id', 'session_id', 'session__user_id', 'created_at', 'message', 'response'
+    )
+
+
+def iter_ndjson(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    for row in queryset.iterator(chunk_size=chunk_size):
+        row['user_id'] = row.pop('session__user_id')
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
@@ -0,0 +1,74 @@
+import mimetypes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Text extraction for indexing. This module does not touch Django, so it can be
+# imported by the spawned worker processes of extract_documents. The PDF and
+# DOCX parsers are imported when the first such document is extracted.
+
+def extract_documents(items, workers=1):
+    # Yield (key, text) for each (key, file_path) item as soon as it is parsed.
+    # With more than one worker the CPU-bound parsing runs in a process pool.
+    # text is None for documents that could not be processed.
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for key, file_path in items:
+            yield key, robust_extract_text(file_path)
+        return
+
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers, len(items)),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    try:
+        futures = {executor.submit(robust_extract_text, file_path): (key, file_path) for key, file_path in items}
+        for future in as_completed(futures):
+            key, file_path = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                # The worker process itself failed (e.g. it was killed)
+                print(f"Unexpected error while extracting text from {file_path}: {str(e)}")
+                text = None
+            yield key, text
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def robust_extract_text(file_path):
+    try:
+        return extract_text(file_path)
+    except ValueError as e:
+        print(f"Error while extracting text from {file_path}: {str(e)}")
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+    # None marks a document that could not be processed, so it is not indexed
+    return None
+
+def extract_text(file_path):
+    mime_type, _ = mimetypes.guess_type(file_path)
+    
+    if mime_type == 'application/pdf':
+        # Extract text from PDF
+        return extract_text_from_pdf(file_path)
+    elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':  # .docx MIME type
+        # Extract text from DOCX
+        return extract_text_from_docx(file_path)
+    elif mime_type and mime_type.startswith('text'):  # Plain text files
+        # Extract text from plain text file
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    else:
+        raise ValueError(f"Unsupported file type: {mime_type}")
+
+def extract_text_from_pdf(file_path):
+    from PyPDF2 import PdfReader
+
+    with open(file_path, 'rb') as f:
+        reader = PdfReader(f)
+        return ''.join(page.extract_text() for page in reader.pages)
+
+def extract_text_from_docx(file_path):
+    from docx import Document as DocxDocument
+
+    doc = DocxDocument(file_path)
+    return ''.join(para.text for para in doc.paragraphs)
@@ -0,0 +1,480 @@
+import json
+import math
+import os
+import pickle
+import uuid
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from .chunk_store import ChunkIdMap, ChunkStore, chunk_store_path, convert_pickled_docstore
+
+# Read-only copy of index.faiss laid out so FAISS can memory-map it
+MMAP_INDEX_FILE = "index.mmap.faiss"
+MMAP_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+# Vectors copied per batch when converting a flat index
+CONVERT_BATCH_SIZE = 65536
+
+# Factory string and search parameters of the index stored next to it
+INDEX_PARAMS_FILE = "index_params.json"
+
+# FAISS warns below 39 training vectors per IVF list (or PQ centroid)
+MIN_TRAINING_PER_LIST = 39
+
+# Exact float32 vectors kept next to a compressed index, in id order, for re-ranking
+EXACT_VECTORS_FILE = "index.vectors.f32"
+
+# Vector storage of each theme compression setting
+STORAGE_FACTORIES = {"": "Flat", "sq8": "SQ8", "fp16": "SQfp16", "pq": "PQ"}
+
+# Ids of removed vectors that an HNSW index still holds, since HNSW cannot
+# delete in place; searches skip them until the index is compacted
+TOMBSTONES_FILE = "index.tombstones.npy"
+
+
+def read_faiss_index(doc_path, embeddings, mmap=False):
+    # Same result as FAISS.load_local, optionally serving the vectors from a
+    # memory-mapped file so every process on the node shares the page cache
+    mmap_path = ensure_mmap_index(doc_path) if mmap else None
+    if mmap_path:
+        index = faiss.read_index(mmap_path, MMAP_IO_FLAGS)
+    else:
+        index = faiss.read_index(os.path.join(doc_path, "index.faiss"))
+    params = read_index_params(doc_path)
+    apply_search_params(index, params)
+    docstore, index_to_docstore_id = read_docstore(doc_path)
+
+    tombstones = read_tombstones(doc_path)
+    if len(tombstones):
+        index = TombstonedIndex(index, tombstones)
+
+    if params.get("rerank_factor"):
+        # Every vector id is below the id bound of the docstore
+        exact_vectors = read_exact_vectors(doc_path, len(index_to_docstore_id), index.d)
+        if exact_vectors is None:
+            print(f"Serving {doc_path} without re-ranking: {EXACT_VECTORS_FILE} is missing or incomplete")
+        else:
+            index = RerankedIndex(index, exact_vectors, params["rerank_factor"])
+
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def read_docstore(doc_path):
+    # (docstore, index_to_docstore_id) from the chunk store, or from the pickle
+    # of an index not converted yet
+    if os.path.exists(chunk_store_path(doc_path)):
+        chunk_store = ChunkStore(chunk_store_path(doc_path))
+        return chunk_store, ChunkIdMap(chunk_store.next_vector_id())
+
+    with open(os.path.join(doc_path, "index.pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def convert_docstore(doc_path, keep_pickle=False):
+    # Copy the chunks of index.pkl into the chunk store. Returns the number of
+    # chunks converted.
+    ids = vector_ids(faiss.read_index(os.path.join(doc_path, "index.faiss")))
+    pickle_path = os.path.join(doc_path, "index.pkl")
+    with open(pickle_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    # Written under a temporary name, so readers keep using index.pkl until it is complete
+    tmp_path = f"{chunk_store_path(doc_path)}.{os.getpid()}.tmp"
+    convert_pickled_docstore(tmp_path, docstore, index_to_docstore_id, ids)
+    os.replace(tmp_path, chunk_store_path(doc_path))
+
+    if not keep_pickle:
+        os.remove(pickle_path)
+    return len(ids)
+
+
+def has_pickled_docstore(doc_path):
+    return not os.path.exists(chunk_store_path(doc_path)) and os.path.exists(os.path.join(doc_path, "index.pkl"))
+
+
+def new_docstore(doc_path):
+    # Chunks already in the store are left over from a run that never saved its index
+    chunk_store = ChunkStore(chunk_store_path(doc_path))
+    chunk_store.clear()
+    return chunk_store, ChunkIdMap(0)
+
+
+def load_vector_store(doc_path, embeddings):
+    # Index and docstore for appending chunks while indexing
+    index = faiss.read_index(os.path.join(doc_path, "index.faiss"))
+    return FAISS(embeddings, index, *read_docstore(doc_path))
+
+
+def next_vector_id(vector_store, tombstones=()):
+    # Id of the next chunk added to the index. Ids are positions in an index
+    # without ids of its own; otherwise they are never given twice while a
+    # chunk or a tombstone still uses them.
+    if not has_vector_ids(vector_store.index):
+        return vector_store.index.ntotal
+    if isinstance(vector_store.docstore, ChunkStore):
+        next_id = vector_store.docstore.next_vector_id()
+    else:
+        # A pickled docstore maps every vector id it holds
+        next_id = max(vector_store.index_to_docstore_id, default=-1) + 1
+    if len(tombstones):
+        next_id = max(next_id, int(max(tombstones)) + 1)
+    return next_id
+
+
+def add_chunks(vector_store, text_embeddings, first_id, doc_id=None):
+    # Add chunks as vectors first_id, first_id + 1, ..., recording in the chunk
+    # store the Docs row they come from
+    ids = np.arange(first_id, first_id + len(text_embeddings), dtype="int64")
+    vectors = np.asarray([vector for _, vector in text_embeddings], dtype="float32")
+    if not isinstance(vector_store.docstore, ChunkStore):
+        # A pickled docstore is converted by convert_docstore; until then it maps
+        # positions, or the vector ids of an index rebuilt with ids
+        if not has_vector_ids(vector_store.index):
+            vector_store.add_embeddings(text_embeddings)
+            return
+        docstore_ids = [str(uuid.uuid4()) for _ in text_embeddings]
+        vector_store.docstore.add(
+            {docstore_id: Document(page_content=text) for docstore_id, (text, _) in zip(docstore_ids, text_embeddings)}
+        )
+        vector_store.index.add_with_ids(vectors, ids)
+        vector_store.index_to_docstore_id.update(zip(ids.tolist(), docstore_ids))
+        return
+
+    vector_store.docstore.put_many(
+        ((int(vector_id), Document(page_content=text)) for vector_id, (text, _) in zip(ids, text_embeddings)),
+        doc_id=doc_id,
+    )
+    if has_vector_ids(vector_store.index):
+        vector_store.index.add_with_ids(vectors, ids)
+    else:
+        vector_store.index.add(vectors)
+    id_map = vector_store.index_to_docstore_id
+    id_map.size = max(id_map.size, int(ids[-1]) + 1)
+
+
+def has_vector_ids(index):
+    # Whether vectors are stored under ids of their own, so some of them can be
+    # removed without renumbering the others. IVF lists hold ids; other index
+    # types need an id map (one around IVF would break on removals).
+    return isinstance(index, faiss.IndexIDMap) or faiss.try_extract_index_ivf(index) is not None
+
+
+def with_vector_ids(index):
+    # Empty index of the same type whose vectors are added under explicit ids
+    if faiss.try_extract_index_ivf(index) is not None:
+        return index
+    return faiss.IndexIDMap2(index)
+
+
+def base_index(index):
+    # Index holding the vectors, inside its id map if it has one
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def vector_ids(index):
+    # Ids of all vectors of index: the id map, the ids in the IVF lists, or positions
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        invlists = ivf.invlists
+        return np.concatenate([np.zeros(0, dtype="int64")] + [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(ivf.nlist) if invlists.list_size(list_no)
+        ])
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def can_remove_vectors(index):
+    # HNSW indexes remove vectors through tombstones, and indexes with ids in place
+    return isinstance(base_index(index), faiss.IndexHNSW) or has_vector_ids(index)
+
+
+def remove_vectors(index, ids, tombstones):
+    # Remove the vectors with the given ids from index. An HNSW index keeps them
+    # and they are added to tombstones instead. Returns the tombstones.
+    ids = np.asarray(ids, dtype="int64")
+    if isinstance(base_index(index), faiss.IndexHNSW):
+        return np.union1d(tombstones, ids).astype("int64")
+    index.remove_ids(faiss.IDSelectorBatch(ids))
+    return tombstones
+
+
+def read_tombstones(doc_path):
+    try:
+        return np.load(os.path.join(doc_path, TOMBSTONES_FILE))
+    except FileNotFoundError:
+        return np.zeros(0, dtype="int64")
+
+
+def write_tombstones(doc_path, tombstones):
+    path = os.path.join(doc_path, TOMBSTONES_FILE)
+    if not len(tombstones):
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(tombstones, dtype="int64"))
+    os.replace(tmp_path, path)
+
+
+def save_vector_store(vector_store, doc_path):
+    if not isinstance(vector_store.docstore, ChunkStore):
+        vector_store.save_local(doc_path)
+        return
+
+    # Chunks are already in the store; only the index file is replaced
+    index_path = os.path.join(doc_path, "index.faiss")
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    faiss.write_index(vector_store.index, tmp_path)
+    os.replace(tmp_path, index_path)
+
+
+def ensure_mmap_index(doc_path):
+    # Return the path of a memory-mappable index file, (re)building it when
+    # index.faiss is newer than the existing copy. None if the index type
+    # cannot be memory-mapped.
+    index_path = os.path.join(doc_path, "index.faiss")
+    mmap_path = os.path.join(doc_path, MMAP_INDEX_FILE)
+
+    if os.path.exists(mmap_path) and os.path.getmtime(mmap_path) >= os.path.getmtime(index_path):
+        return mmap_path
+
+    return mmap_path if write_mmap_index(doc_path) else None
+
+
+def write_mmap_index(doc_path):
+    index = faiss.read_index(os.path.join(doc_path, "index.faiss"))
+    try:
+        mmap_index = to_mmap_layout(index)
+    except ValueError as e:
+        print(f"Serving {doc_path} from memory: {e}")
+        return False
+
+    # Write next to the target and swap it in, so workers that already mapped
+    # the previous version keep reading a consistent file
+    mmap_path = os.path.join(doc_path, MMAP_INDEX_FILE)
+    tmp_path = f"{mmap_path}.{os.getpid()}.tmp"
+    faiss.write_index(mmap_index, tmp_path)
+    os.replace(tmp_path, mmap_path)
+    return True
+
+
+def to_mmap_layout(index):
+    # Only IVF inverted lists can be memory-mapped by FAISS. An exact flat index
+    # is stored as a single-list IVF: with nlist=1 and nprobe=1 every query still
+    # scans all vectors, so results are identical, and vectors keep their ids.
+    if faiss.try_extract_index_ivf(index) is not None:
+        return index
+    ids = vector_ids(index)
+    index = base_index(index)
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError(f"Index type {type(index).__name__} cannot be served memory-mapped.")
+
+    quantizer = faiss.IndexFlat(index.d, index.metric_type)
+    quantizer.add(np.zeros((1, index.d), dtype="float32"))
+    ivf_index = faiss.IndexIVFFlat(quantizer, index.d, 1, index.metric_type)
+    ivf_index.is_trained = True
+
+    for start in range(0, index.ntotal, CONVERT_BATCH_SIZE):
+        count = min(CONVERT_BATCH_SIZE, index.ntotal - start)
+        ivf_index.add_with_ids(index.reconstruct_n(start, count), ids[start:start + count])
+
+    return ivf_index
+
+
+def index_factory_string(index_type, n_vectors, nlist=None, hnsw_m=32, n_training=None, storage="Flat"):
+    # FAISS index_factory description for a theme index of about n_vectors,
+    # trained on n_training of them
+    if index_type == "ivf":
+        if not nlist:
+            nlist = int(4 * n_vectors ** 0.5)
+        # Keep enough training vectors per list for k-means
+        nlist = max(1, min(nlist, (n_training or n_vectors) // MIN_TRAINING_PER_LIST))
+        return f"IVF{nlist},{storage}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},{storage}"
+    return storage
+
+
+def storage_factory(compression, dim, pq_m=None, n_training=None):
+    # Vector codes: Flat (float32), SQfp16 (2 bytes per dimension), SQ8 (1 byte)
+    # or PQ (pq_m bytes per vector, by default dim / 16)
+    if compression != "pq":
+        return STORAGE_FACTORIES[compression]
+    m = pq_m or max(1, dim // 16)
+    while dim % m:
+        m -= 1
+    # Fewer bits per code for small themes, so every centroid gets training vectors
+    nbits = 8
+    if n_training:
+        nbits = max(1, min(8, int(math.log2(max(1, n_training // MIN_TRAINING_PER_LIST)))))
+    return f"PQ{m}x{nbits}"
+
+
+def factory_matches(factory, index_type, compression):
+    # Whether an index built from factory has the given layout and compression
+    layout, _, storage = factory.rpartition(",")
+    if layout.startswith("IVF"):
+        layout_type = "ivf"
+    elif layout.startswith("HNSW"):
+        layout_type = "hnsw"
+    else:
+        layout_type = "flat"
+    storage_compression = "pq" if storage.startswith("PQ") else {
+        code: name for name, code in STORAGE_FACTORIES.items()
+    }.get(storage)
+    return (layout_type, storage_compression) == (index_type, compression)
+
+
+def build_index(factory, training_vectors):
+    # Empty index ready to add vectors to, trained first when the type needs it
+    training_vectors = np.asarray(training_vectors, dtype="float32")
+    index = faiss.index_factory(training_vectors.shape[1], factory)
+    if not index.is_trained:
+        index.train(training_vectors)
+    return index
+
+
+def rebuild_index(index, factory, sample_size, exact_vectors=None, exclude=()):
+    # Copy of index with another layout, without the vectors whose ids are in
+    # exclude; the others keep their ids, so the docstore mapping of the FAISS
+    # wrapper stays valid. Vectors are read from exact_vectors when given, since
+    # a compressed index only reconstructs approximations of them.
+    ids = vector_ids(index)
+    if len(exclude):
+        ids = ids[~np.isin(ids, exclude)]
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and exact_vectors is None:
+        # IVF vectors are looked up by id through a hash table
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    def read_vectors(batch_ids):
+        if exact_vectors is not None:
+            return np.asarray(exact_vectors[batch_ids])
+        return index.reconstruct_batch(batch_ids)
+
+    new_index = build_index(factory, read_vectors(np.asarray(training_sample(ids, sample_size))))
+    new_index = with_vector_ids(new_index)
+
+    for start in range(0, len(ids), CONVERT_BATCH_SIZE):
+        batch_ids = ids[start:start + CONVERT_BATCH_SIZE]
+        new_index.add_with_ids(read_vectors(batch_ids), batch_ids)
+    return new_index
+
+
+def training_sample(vectors, sample_size, seed=0):
+    if len(vectors) <= sample_size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return [vectors[i] for i in sorted(rng.choice(len(vectors), sample_size, replace=False))]
+
+
+def apply_search_params(index, params):
+    # Query-time knobs; they are not part of the serialized index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and params.get("nprobe"):
+        ivf.nprobe = params["nprobe"]
+    hnsw = base_index(index)
+    if isinstance(hnsw, faiss.IndexHNSW) and params.get("efSearch"):
+        hnsw.hnsw.efSearch = params["efSearch"]
+
+
+def read_index_params(doc_path):
+    try:
+        with open(os.path.join(doc_path, INDEX_PARAMS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_index_params(doc_path, params):
+    params_path = os.path.join(doc_path, INDEX_PARAMS_FILE)
+    tmp_path = f"{params_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(params, f)
+    os.replace(tmp_path, params_path)
+
+
+def index_memory_bytes(index):
+    # Size of the serialized index, close to what it takes in memory once loaded
+    return faiss.serialize_index(index).nbytes
+
+
+def append_exact_vectors(doc_path, start, vectors):
+    # Write vectors as rows start, start + 1, ... of the exact vectors file.
+    # Rows past start are left over from a run whose index was never saved.
+    vectors = np.asarray(vectors, dtype="float32")
+    path = os.path.join(doc_path, EXACT_VECTORS_FILE)
+    with open(path, "ab"):
+        pass
+    with open(path, "r+b") as f:
+        f.truncate(start * vectors.shape[1] * 4)
+        f.seek(0, os.SEEK_END)
+        f.write(vectors.tobytes())
+
+
+def read_exact_vectors(doc_path, ntotal, dim):
+    # Memory-mapped exact vectors of ids below ntotal, or None when the file
+    # does not cover them; only the rows touched by re-ranking are read
+    path = os.path.join(doc_path, EXACT_VECTORS_FILE)
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+    if ntotal == 0 or size < ntotal * dim * 4:
+        return None
+    return np.memmap(path, dtype="float32", mode="r", shape=(ntotal, dim))
+
+
+class RerankedIndex:
+    # Searches a compressed index for k * k_factor candidates and orders them
+    # by exact L2 distance against the float32 vectors kept on disk. Used in
+    # place of the FAISS index by the langchain wrapper, which only calls search.
+
+    def __init__(self, index, exact_vectors, k_factor):
+        self.index = index
+        self.exact_vectors = exact_vectors
+        self.k_factor = k_factor
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, queries, k):
+        _, candidates = self.index.search(queries, k * self.k_factor)
+
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        ids = np.full((len(queries), k), -1, dtype="int64")
+        for row, (query, candidate_ids) in enumerate(zip(queries, candidates)):
+            # Sorted ids read the memory-mapped rows in file order
+            candidate_ids = np.sort(candidate_ids[candidate_ids >= 0])
+            exact = ((np.asarray(self.exact_vectors[candidate_ids]) - query) ** 2).sum(axis=1)
+            best = np.argsort(exact)[:k]
+            distances[row, :len(best)] = exact[best]
+            ids[row, :len(best)] = candidate_ids[best]
+        return distances, ids
+
+
+class TombstonedIndex:
+    # Searches an HNSW index without the vectors whose ids are tombstoned. Used
+    # in place of the FAISS index by the langchain wrapper, like RerankedIndex.
+
+    def __init__(self, index, tombstones):
+        self.index = index
+        # The selectors are referenced by the search parameters, not owned by them
+        self.removed = faiss.IDSelectorBatch(np.asarray(tombstones, dtype="int64"))
+        self.selector = faiss.IDSelectorNot(self.removed)
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, queries, k):
+        # Search parameters replace the index's own efSearch, so it is passed on
+        params = faiss.SearchParametersHNSW(sel=self.selector, efSearch=base_index(self.index).hnsw.efSearch)
+        return self.index.search(queries, k, params=params)
@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Files whose modification stamp identifies one on-disk version of a theme index
+INDEX_STAMP_FILES = ("index.faiss", "index.pkl", "index_params.json", "index.tombstones.npy")
+
+
+def index_stamp(doc_path):
+    # (mtime, size) of every index file; any rewrite of the index changes the stamp
+    stamp = []
+    for file_name in INDEX_STAMP_FILES:
+        file_path = os.path.join(doc_path, file_name)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            stamp.append(None)
+            continue
+        stamp.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+class FaissIndexCache:
+    # Process-wide LRU cache of loaded FAISS vector stores keyed by theme name.
+    # Entries are revalidated against the on-disk stamp on every lookup, so an
+    # index rewritten by generate_faiss (in this or any other process) is reloaded.
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, index_name, doc_path, loader):
+        stamp = index_stamp(doc_path)
+
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is not None:
+                if entry[0] == stamp:
+                    self._entries.move_to_end(index_name)
+                    self.hits += 1
+                    return entry[1]
+                # The index changed on disk since it was loaded
+                del self._entries[index_name]
+                self.invalidations += 1
+            self.misses += 1
+
+        # Load outside the lock so other themes are not blocked by a slow read
+        vector_store = loader(doc_path)
+
+        with self._lock:
+            self._entries[index_name] = (stamp, vector_store)
+            self._entries.move_to_end(index_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return vector_store
+
+    def invalidate(self, index_name=None):
+        with self._lock:
+            if index_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(index_name, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
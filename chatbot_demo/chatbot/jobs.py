@@ -0,0 +1,153 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from chatbot_demo.settings import INDEXING_HEARTBEAT_INTERVAL
+from .models import DocThemes, IndexingJob
+
+# Background indexing. The admin action, the API and index_faiss only enqueue
+# IndexingJob rows; the index_worker management command claims and runs them. A
+# RUNNING job is the lock on its theme: a job is only claimed while no other job
+# of the same theme is running, so two workers never write the same index
+# directory at once. Commands that rewrite an index outside of a job
+# (rebuild_faiss_index, convert_docstore) hold the same lock with hold_theme.
+
+
+class ThemeBusy(RuntimeError):
+    pass
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_indexing_job(theme):
+    # Reuse a job that is still waiting for the same theme instead of queueing twice
+    job = IndexingJob.objects.filter(theme=theme, status=IndexingJob.QUEUED, worker__isnull=True).first()
+    if job is None:
+        job = IndexingJob.objects.create(theme=theme)
+    return job
+
+
+def claim_next_job(worker_name):
+    # Jobs created with a worker name are reserved for that worker (see claim_theme)
+    queued = IndexingJob.objects.filter(status=IndexingJob.QUEUED, worker__isnull=True).order_by('created_at', 'id')
+    for job_id, theme_id in queued.values_list('id', 'theme_id'):
+        if claim_job(job_id, theme_id, worker_name):
+            return IndexingJob.objects.select_related('theme').get(id=job_id)
+    return None
+
+
+def claim_job(job_id, theme_id, worker_name):
+    theme_running = IndexingJob.objects.filter(theme=OuterRef('theme'), status=IndexingJob.RUNNING)
+    now = timezone.now()
+    with transaction.atomic():
+        # Serialize claims for the theme on databases with row locks (PostgreSQL);
+        # on SQLite the single UPDATE below is already atomic
+        list(DocThemes.objects.select_for_update().filter(id=theme_id))
+        claimed = (
+            IndexingJob.objects
+            .filter(id=job_id, status=IndexingJob.QUEUED)
+            .filter(~Exists(theme_running))
+            .update(status=IndexingJob.RUNNING, worker=worker_name, started_at=now, heartbeat_at=now)
+        )
+    return claimed == 1
+
+
+def claim_theme(theme, worker_name):
+    # RUNNING job of theme for worker_name, without going through the queue;
+    # None while another job of the theme is running
+    job = IndexingJob.objects.create(theme=theme, worker=worker_name)
+    if not claim_job(job.id, theme.id, worker_name):
+        job.delete()
+        return None
+    return IndexingJob.objects.select_related('theme').get(id=job.id)
+
+
+@contextmanager
+def hold_theme(theme, worker_name, heartbeat_interval=INDEXING_HEARTBEAT_INTERVAL):
+    # Hold the theme lock while the block rewrites its index directory; the job
+    # records the outcome like an indexing run
+    job = claim_theme(theme, worker_name)
+    if job is None:
+        raise ThemeBusy(f"Theme {theme.theme} is being indexed; try again once its job has finished.")
+
+    running = IndexingJob.objects.filter(id=job.id, status=IndexingJob.RUNNING)
+    try:
+        with heartbeat(job.id, heartbeat_interval):
+            yield job
+    except BaseException as e:
+        running.update(status=IndexingJob.FAILED, error=str(e) or type(e).__name__, finished_at=timezone.now())
+        raise
+    running.update(status=IndexingJob.DONE, finished_at=timezone.now())
+
+
+def run_indexing_job(job, workers=1, heartbeat_interval=INDEXING_HEARTBEAT_INTERVAL):
+    # generate_faiss pulls in the LLM stack, so only import it when a job runs
+    from .langchain_bot import generate_faiss
+
+    # Once fail_stale_jobs has released the job, another worker may be
+    # indexing the theme: stop at the next document and write nothing
+    running = IndexingJob.objects.filter(id=job.id, status=IndexingJob.RUNNING)
+
+    def progress(docs_done, docs_total):
+        if not running.update(docs_done=docs_done, docs_total=docs_total, heartbeat_at=timezone.now()):
+            raise RuntimeError(f"Indexing job {job.id} is no longer running.")
+
+    try:
+        with heartbeat(job.id, heartbeat_interval):
+            file_names = generate_faiss(
+                job.theme_id, job.theme.theme, workers=workers, progress=progress, may_persist=running.exists
+            )
+    except Exception as e:
+        print(f"Indexing job {job.id} failed: {e}")
+        running.update(status=IndexingJob.FAILED, error=str(e), finished_at=timezone.now())
+    else:
+        running.update(status=IndexingJob.DONE, file_names=file_names, finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
+
+
+@contextmanager
+def heartbeat(job_id, interval):
+    # Touch the job's heartbeat every interval seconds from a side thread, so a
+    # large document or a slow embedding call does not look like a dead worker
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                try:
+                    touch_heartbeat(job_id)
+                except Exception as e:
+                    print(f"Heartbeat of indexing job {job_id} failed: {e}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"indexing-job-{job_id}-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def touch_heartbeat(job_id):
+    return IndexingJob.objects.filter(id=job_id, status=IndexingJob.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def fail_stale_jobs(stale_after):
+    # A worker that died mid-job stops sending heartbeats; release its theme
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return IndexingJob.objects.filter(status=IndexingJob.RUNNING, heartbeat_at__lt=cutoff).update(
+        status=IndexingJob.FAILED,
+        error="The worker stopped responding.",
+        finished_at=timezone.now(),
+    )
@@ -1,51 +1,106 @@
+import asyncio
+import hashlib
+import heapq
 import os
-import pickle
-import mimetypes
-import faiss
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
 
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.prompts import ChatPromptTemplate
-from langchain_community.vectorstores import FAISS
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import Subquery
 from chatbot_demo.settings import *
 from .models import Docs, DocThemes, ChatSession, ChatMessage
-from openai import OpenAIError
+from .index_cache import FaissIndexCache
+from .answer_cache import SemanticAnswerCache
+from .embedding_cache import CachedEmbeddings, EmbeddingStore, QueryEmbeddingCache, embedding_model_name, normalize_question
+from .extractors import extract_documents
+from .memory import count_tokens, format_turn, select_context
+from .metrics import LLM_TOKENS, stage
+from .single_flight import SingleFlight
 
+# The OpenAI clients, langchain, FAISS and the document parsers are imported on
+# first use, so importing this module (views, admin, every manage.py command)
+# stays cheap. Use get_embeddings(), get_llm() and get_text_splitter(); tests
+# and benchmarks replace embeddings and llm with fakes.
+embeddings = None
+llm = None
+recursive_text_splitter = None
+chains = {}
+init_lock = threading.Lock()
+search_pool = ThreadPoolExecutor(max_workers=FAISS_SEARCH_THREADS, thread_name_prefix="faiss-search")
+retrieval_pool = ThreadPoolExecutor(max_workers=CHAT_RETRIEVAL_THREADS, thread_name_prefix="chat-retrieval")
+summary_pool = ThreadPoolExecutor(max_workers=CHAT_SUMMARY_THREADS, thread_name_prefix="chat-summary")
 
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
+index_cache = FaissIndexCache(max_size=FAISS_INDEX_CACHE_SIZE)
+embedding_store = EmbeddingStore(EMBEDDING_CACHE_PATH)
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=QUERY_EMBEDDING_CACHE_SIZE,
+    ttl=QUERY_EMBEDDING_CACHE_TTL,
+    cache_alias=QUERY_EMBEDDING_CACHE_ALIAS,
+)
+answer_flights = SingleFlight("answer")
+answer_cache = SemanticAnswerCache(
+    threshold=SEMANTIC_ANSWER_CACHE_THRESHOLD,
+    ttl=SEMANTIC_ANSWER_CACHE_TTL,
+    max_size=SEMANTIC_ANSWER_CACHE_SIZE,
+)
 
-recursive_text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", openai_api_key=OPENAI_API_KEY)
+def get_embeddings():
+    global embeddings
+    if embeddings is None:
+        with init_lock:
+            if embeddings is None:
+                from langchain_openai import OpenAIEmbeddings
+                embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
+    return embeddings
+
+def get_llm():
+    global llm
+    if llm is None:
+        with init_lock:
+            if llm is None:
+                from langchain_openai import ChatOpenAI
+                llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", openai_api_key=OPENAI_API_KEY)
+    return llm
+
+def get_text_splitter():
+    global recursive_text_splitter
+    if recursive_text_splitter is None:
+        with init_lock:
+            if recursive_text_splitter is None:
+                from langchain_text_splitters import RecursiveCharacterTextSplitter
+                recursive_text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    return recursive_text_splitter
+
+def get_chain(name, build):
+    # Prompt chains are built once per LLM client and reused by every request
+    model = get_llm()
+    cached = chains.get(name)
+    if cached is None or cached[0] is not model:
+        cached = (model, build(model))
+        chains[name] = cached
+    return cached[1]
 
 # Main logic
 def get_answer_from_index_with_memory(question, index_name, session_id, max_context_messages=10):
     try:
-        # Retrieve the chat session
-        session = ChatSession.objects.get(id=session_id)
-        
-        # Retrieve only the most recent 'max_context_messages' from the session
-        recent_messages = ChatMessage.objects.filter(session=session).order_by('-created_at')[:max_context_messages]
-        
-        # Reverse the order to maintain the correct conversation flow
-        recent_messages = reversed(recent_messages)
-        
-        # Compile recent conversation history
-        context_messages = list(recent_messages)
-        
-        # Step 1: Query the FAISS index to retrieve relevant document chunks
-        retrieved_docs = query_faiss_index(question, index_name)
+        session, context_messages, overflow, (retrieved_docs, question_vector, answer) = prepare_answer_context(
+            question, index_name, session_id, max_context_messages
+        )
         
-        # Step 2: Generate an answer based on the retrieved chunks and past conversation context
-        answer = generate_answer(question, retrieved_docs, context_messages)
+        # Step 2: Generate an answer based on the retrieved chunks and past conversation context,
+        # unless a question like this one was answered on these themes without context
+        if answer is None:
+            answer = generate_answer(question, retrieved_docs, context_messages, session.summary)
+            if question_vector is not None:
+                answer_cache.put(index_paths(index_name), question_vector, answer)
         
         # Save the new user question and answer to the database
-        ChatMessage.objects.create(session=session, message=question, response=answer)
+        with stage("save"):
+            ChatMessage.objects.create(session=session, message=question, response=answer)
+        fold_later(session, overflow)
         
         return answer
     except ChatSession.DoesNotExist:
@@ -55,30 +110,392 @@ def get_answer_from_index_with_memory(question, index_name, session_id, max_cont
         print(f"An error occurred while generating the answer: {e}")
         return "I am unable to answer that question at the moment."    
 
-# Function to load FAISS index and perform a search
-def query_faiss_index(query, index_name):
-    doc_path = os.path.join(FAISS_INDEX_FILE, index_name)
-    
-    if not os.path.exists(os.path.join(doc_path, "index.faiss")):
-        raise ValueError(f"FAISS index for {index_name} does not exist.")
+def stream_answer_from_index_with_memory(question, index_name, session_id, max_context_messages=10):
+    # Session lookup and retrieval run eagerly, so their errors (including
+    # ChatSession.DoesNotExist) are raised here, before any token is sent
+    session, context_messages, overflow, (retrieved_docs, question_vector, answer) = prepare_answer_context(
+        question, index_name, session_id, max_context_messages
+    )
+    if answer is not None:
+        # A cached answer is sent as a single token
+        tokens = iter([answer])
+    else:
+        tokens = generate_answer_stream(question, retrieved_docs, context_messages, session.summary)
+        if question_vector is not None:
+            tokens = cache_streamed_answer(tokens, index_name, question_vector)
+    return stream_and_save_answer(session, question, tokens, overflow)
 
-    # Load the existing FAISS index
-    faiss_index = FAISS.load_local(doc_path, embeddings, allow_dangerous_deserialization=True)
-    
-    # Perform a similarity search
-    retrieved_docs = faiss_index.similarity_search(query, k=5)  # Retrieve top 5 relevant chunks
+def stream_and_save_answer(session, question, tokens, overflow):
+    answer_parts = []
+    try:
+        for token in tokens:
+            answer_parts.append(token)
+            yield token
+    finally:
+        # Persist the message when the stream finishes, fails or the client disconnects
+        with stage("save"):
+            ChatMessage.objects.create(session=session, message=question, response="".join(answer_parts))
+        fold_later(session, overflow)
+
+def prepare_answer_context(question, index_name, session_id, max_context_messages=10):
+    # Returns the session, the turns to send, the older turns to fold into the
+    # summary once answered and retrieve()'s (retrieved docs, question vector,
+    # cached answer).
+    # Step 1: Query the FAISS index to retrieve relevant document chunks. The
+    # embedding call and the search run in a worker thread (in a copy of the
+    # request context, for its timings) while this thread reads the history,
+    # so the request waits for the slower of the two rather than both
+    cache_eligible = Future()
+    retrieval = retrieval_pool.submit(copy_context().run, retrieve, question, index_name, cache_eligible)
+    try:
+        with stage("history"):
+            # Retrieve the chat session
+            session = ChatSession.objects.get(id=session_id)
+
+            # Retrieve the most recent turns not yet folded into the session summary
+            recent_messages = list(unsummarized_messages(session_id, max_context_messages))
+    except Exception:
+        cache_eligible.set_result(False)
+        retrieval.cancel()
+        raise
+    cache_eligible.set_result(not recent_messages and not session.summary)
+
+    # Keep the turns that fit in the token budget, in conversation order
+    context_messages, overflow = select_context(
+        recent_messages, session.summary, max_context_messages, CHAT_HISTORY_TOKEN_BUDGET
+    )
+
+    return session, context_messages, overflow, retrieval.result()
+
+def retrieve(question, index_name, cache_eligible):
+    # (retrieved docs, question vector, cached answer). A question asked without
+    # conversation context (cache_eligible, resolved once the history is read)
+    # is looked up in the semantic answer cache before the themes are searched,
+    # and a hit skips the search. The vector is only returned for such a
+    # question, to cache its answer.
+    if not SEMANTIC_ANSWER_CACHE:
+        return query_faiss_index(question, index_name), None, None
+    doc_paths = theme_index_paths(index_name)
+    query_vector = embed_question(question)
+    if not cache_eligible.result():
+        return search_themes(doc_paths, query_vector), None, None
+    with stage("answer_cache"):
+        answer = answer_cache.get(doc_paths, query_vector)
+    if answer is not None:
+        return [], query_vector, answer
+    return search_themes(doc_paths, query_vector), query_vector, None
+
+async def aget_answer_from_index_with_memory(question, index_name, session_id, max_context_messages=10):
+    # Async counterpart of get_answer_from_index_with_memory for ASGI views: the
+    # event loop is free while waiting on the database, embeddings and the LLM
+    try:
+        session, context_messages, overflow, (retrieved_docs, question_vector, answer) = await aprepare_answer_context(
+            question, index_name, session_id, max_context_messages
+        )
+
+        if answer is None:
+            answer = await agenerate_answer(question, retrieved_docs, context_messages, session.summary)
+            if question_vector is not None:
+                answer_cache.put(index_paths(index_name), question_vector, answer)
+
+        with stage("save"):
+            await ChatMessage.objects.acreate(session=session, message=question, response=answer)
+        fold_later(session, overflow)
+
+        return answer
+    except ChatSession.DoesNotExist:
+        print(f"Session with ID {session_id} not found.")
+        return "Session not found."
+    except Exception as e:
+        print(f"An error occurred while generating the answer: {e}")
+        return "I am unable to answer that question at the moment."
+
+async def aprepare_answer_context(question, index_name, session_id, max_context_messages=10):
+    # The history and the retrieved chunks are fetched concurrently; errors are
+    # raised in that order, so a missing session wins over a missing index
+    cache_eligible = asyncio.get_running_loop().create_future()
+    results = await asyncio.gather(
+        aload_history(session_id, max_context_messages, cache_eligible),
+        aretrieve(question, index_name, cache_eligible),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    (session, recent_messages), retrieval = results
+
+    context_messages, overflow = select_context(
+        recent_messages, session.summary, max_context_messages, CHAT_HISTORY_TOKEN_BUDGET
+    )
+
+    return session, context_messages, overflow, retrieval
+
+async def aload_history(session_id, max_context_messages, cache_eligible):
+    # The session and its recent turns, read concurrently
+    results = await asyncio.gather(
+        aget_session(session_id),
+        arecent_messages(session_id, max_context_messages),
+        return_exceptions=True,
+    )
+    failed = [result for result in results if isinstance(result, Exception)]
+    session, recent_messages = results
+    cache_eligible.set_result(not failed and not recent_messages and not session.summary)
+    if failed:
+        raise failed[0]
+    return session, recent_messages
+
+async def aget_session(session_id):
+    with stage("history"):
+        return await ChatSession.objects.aget(id=session_id)
+
+async def arecent_messages(session_id, max_context_messages):
+    with stage("history"):
+        return [message async for message in unsummarized_messages(session_id, max_context_messages)]
+
+async def aretrieve(question, index_name, cache_eligible):
+    # Async counterpart of retrieve
+    if not SEMANTIC_ANSWER_CACHE:
+        return await aquery_faiss_index(question, index_name), None, None
+    doc_paths = theme_index_paths(index_name)
+    query_vector = await aembed_question(question)
+    if not await cache_eligible:
+        return await asearch_themes(doc_paths, query_vector), None, None
+    with stage("answer_cache"):
+        answer = answer_cache.get(doc_paths, query_vector)
+    if answer is not None:
+        return [], query_vector, answer
+    return await asearch_themes(doc_paths, query_vector), query_vector, None
+
+def cache_streamed_answer(tokens, index_name, vector):
+    # Pass the tokens through and cache the answer once it is complete; an
+    # answer cut short by an error or a disconnect is not cached
+    answer_parts = []
+    for token in tokens:
+        answer_parts.append(token)
+        yield token
+    answer_cache.put(index_paths(index_name), vector, "".join(answer_parts))
+
+def unsummarized_messages(session_id, max_context_messages):
+    # Newest first; the extra batch is what gets folded once it no longer fits.
+    # Older unsummarized turns beyond this window are never sent to the LLM
+    # again, so they are skipped rather than summarized. The summary position
+    # is read in a subquery, so this does not wait for the session lookup.
+    # Ordered by id, the summary watermark (and insertion order), which the
+    # (session, id) index serves without sorting the unsummarized turns.
+    limit = max_context_messages + SUMMARY_FOLD_BATCH
+    summary_until = ChatSession.objects.filter(id=session_id).values('summary_until')[:1]
+    return ChatMessage.objects.filter(
+        session_id=session_id, id__gt=Subquery(summary_until)
+    ).order_by('-id')[:limit]
+
+def fold_later(session, overflow):
+    # Fold a full batch of overflow into the summary once the answer is saved
+    # (or streamed), off the request path. Until the fold lands, the next
+    # questions see these turns as overflow again, and save_summary drops a
+    # fold that another request already made.
+    if len(overflow) >= SUMMARY_FOLD_BATCH:
+        summary_pool.submit(fold_in_background, session, overflow)
+
+def fold_in_background(session, overflow):
+    try:
+        fold_into_summary(session, overflow)
+    finally:
+        # Pool threads are outside the request cycle that closes connections
+        close_old_connections()
+
+def fold_into_summary(session, overflow):
+    # Extend the summary with the turns that fell out of the budget; the
+    # summary is updated incrementally, never rebuilt from the whole history
+    inputs = summary_inputs(session.summary, overflow)
+    try:
+        with stage("summary"):
+            summary = get_chain("summary", build_summary_chain).invoke(inputs)
+    except Exception as e:
+        # The turns stay unsummarized and are folded on a later question
+        print(f"An error occurred while summarizing the conversation: {e}")
+        return
+    record_llm_tokens("summary", inputs, summary)
+    save_summary(session, summary, overflow[-1].id)
+
+def save_summary(session, summary, summary_until):
+    # Only apply the fold if no concurrent request folded these turns already
+    updated = ChatSession.objects.filter(id=session.id, summary_until=session.summary_until).update(
+        summary=summary, summary_until=summary_until
+    )
+    if updated:
+        session.summary = summary
+        session.summary_until = summary_until
+
+def summary_inputs(summary, messages):
+    return {
+        "summary": summary or "(empty)",
+        "new_lines": "\n".join([format_turn(msg) for msg in messages]),
+    }
+
+def build_summary_chain(model):
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    template = ChatPromptTemplate.from_template(
+        template=(
+            "Progressively summarize the conversation between a user and an AI assistant, "
+            "adding the new lines to the current summary. Keep names, facts and open questions; "
+            "reply with the new summary only.\n"
+            "Current summary:\n{summary}\n\n"
+            "New lines of conversation:\n{new_lines}\n\n"
+            "New summary:"
+        )
+    )
+
+    return template | model | StrOutputParser()
+
+# Function to load FAISS index and perform a search. index_name is a theme name
+# or a list of them; several themes are searched concurrently and their chunks
+# merged into one top k.
+def query_faiss_index(query, index_name, k=5):
+    doc_paths = theme_index_paths(index_name)
+    return search_themes(doc_paths, embed_question(query), k)
+
+def embed_question(query):
+    # Embed the question once (cached across requests) for every theme
+    with stage("embed"):
+        return query_embedding_cache.embed_query(get_embeddings(), query)
+
+def search_themes(doc_paths, query_vector, k=5):
+    if len(doc_paths) == 1:
+        name, doc_path = doc_paths[0]
+        return [doc for doc, _ in search_theme_index(name, doc_path, query_vector, k)]
+
+    # FAISS releases the GIL while searching, so the themes are searched in parallel;
+    # each search runs in a copy of the request context to report its timings
+    futures = [
+        search_pool.submit(copy_context().run, search_theme_index, name, doc_path, query_vector, k)
+        for name, doc_path in doc_paths
+    ]
+    return merge_by_score([future.result() for future in futures], k)
+
+async def aquery_faiss_index(query, index_name, k=5):
+    doc_paths = theme_index_paths(index_name)
+    return await asearch_themes(doc_paths, await aembed_question(query), k)
+
+async def aembed_question(query):
+    with stage("embed"):
+        return await query_embedding_cache.aembed_query(get_embeddings(), query)
+
+async def asearch_themes(doc_paths, query_vector, k=5):
+    # A cache miss reads the index from disk, so the searches run in worker threads
+    search = sync_to_async(search_theme_index, thread_sensitive=False)
+    results = await asyncio.gather(*[search(name, doc_path, query_vector, k) for name, doc_path in doc_paths])
+    return merge_by_score(results, k)
+
+def theme_index_paths(index_name):
+    # [(theme, index directory)], checking every index exists before searching any
+    doc_paths = index_paths(index_name)
+    for name, doc_path in doc_paths:
+        if not os.path.exists(os.path.join(doc_path, "index.faiss")):
+            raise ValueError(f"FAISS index for {name} does not exist.")
+    return doc_paths
+
+def index_paths(index_name):
+    index_names = [index_name] if isinstance(index_name, str) else list(dict.fromkeys(index_name))
+    return [(name, os.path.join(FAISS_INDEX_FILE, name)) for name in index_names]
+
+def search_theme_index(index_name, doc_path, query_vector, k):
+    # Get the FAISS index from the process cache, loading it from disk on a miss
+    faiss_index = index_cache.get(index_name, doc_path, load_faiss_index)
+    with stage("search"):
+        return faiss_index.similarity_search_with_score_by_vector(query_vector, k=k)
+
+def merge_by_score(results, k):
+    # Global top k over (doc, L2 distance) lists; every theme is embedded with
+    # the same model, so distances are comparable across themes
+    scored = [doc_score for theme_results in results for doc_score in theme_results]
+    return [doc for doc, _ in heapq.nsmallest(k, scored, key=lambda doc_score: doc_score[1])]
+
+def load_faiss_index(doc_path):
+    from .faiss_io import read_faiss_index
+
+    with stage("index_load"):
+        return read_faiss_index(doc_path, get_embeddings(), mmap=FAISS_INDEX_MMAP)
+
+def generate_answer(question, retrieved_docs, context_messages, summary=""):
+    sequence = get_chain("answer", build_answer_chain)
+    inputs = answer_inputs(question, retrieved_docs, context_messages, summary)
     
-    return retrieved_docs
+    # Generate an answer using the sequence, sharing the completion with
+    # identical questions already waiting on the LLM
+    with stage("llm"):
+        if not CHAT_COALESCE_ANSWERS:
+            return invoke_answer(sequence, inputs)
+        return answer_flights.do(answer_key(sequence, inputs), invoke_answer, sequence, inputs)
+
+async def agenerate_answer(question, retrieved_docs, context_messages, summary=""):
+    sequence = get_chain("answer", build_answer_chain)
+    inputs = answer_inputs(question, retrieved_docs, context_messages, summary)
+    with stage("llm"):
+        if not CHAT_COALESCE_ANSWERS:
+            return await ainvoke_answer(sequence, inputs)
+        return await answer_flights.ado(answer_key(sequence, inputs), ainvoke_answer, sequence, inputs)
+
+def invoke_answer(sequence, inputs):
+    answer = sequence.invoke(inputs)
+    record_llm_tokens("answer", inputs, answer)
+    return answer
+
+async def ainvoke_answer(sequence, inputs):
+    answer = await sequence.ainvoke(inputs)
+    record_llm_tokens("answer", inputs, answer)
+    return answer
+
+def answer_key(sequence, inputs):
+    # Same chain, normalized question and prompt context. The retrieved chunks
+    # stand for the theme: themes returning the same chunks get the same prompt.
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (normalize_question(inputs["question"]), inputs["message_context"], inputs["doc_context"]):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return (id(sequence), digest.hexdigest())
+
+def generate_answer_stream(question, retrieved_docs, context_messages, summary=""):
+    sequence = get_chain("answer", build_answer_chain)
+    inputs = answer_inputs(question, retrieved_docs, context_messages, summary)
+    answer_parts = []
+
+    # Yield the answer piece by piece as the LLM produces it
+    try:
+        with stage("llm"):
+            for token in sequence.stream(inputs):
+                answer_parts.append(token)
+                yield token
+    finally:
+        record_llm_tokens("answer", inputs, "".join(answer_parts))
 
-def generate_answer(question, retrieved_docs, context_messages):
+def record_llm_tokens(chain, inputs, output):
+    # Tokens of the prompt variables (the template text itself is not counted) and of the reply
+    LLM_TOKENS.inc(count_tokens("\n".join(inputs.values())), chain=chain, kind="input")
+    LLM_TOKENS.inc(count_tokens(output), chain=chain, kind="output")
+
+def answer_inputs(question, retrieved_docs, context_messages, summary=""):
     # Combine the content of the retrieved docs
     doc_context = "\n\n".join([doc.page_content for doc in retrieved_docs])
     
     # Build context from past user messages
-    message_context = "\n".join([
-        f"User: {msg.message}\nAI: {msg.response}" for msg in context_messages
-    ])
-    
+    message_context = "\n".join([format_turn(msg) for msg in context_messages])
+
+    # Older turns are only present through the rolling summary
+    if summary:
+        message_context = f"Summary of the earlier conversation: {summary}\n{message_context}"
+
+    return {
+        "message_context": message_context,
+        "doc_context": doc_context,
+        "question": question
+    }
+
+def build_answer_chain(model):
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
     # Prepare a prompt to pass to the LLM
     # The context now includes both the retrieved documents and past conversation history
     template = ChatPromptTemplate.from_template(
@@ -91,34 +508,31 @@ def generate_answer(question, retrieved_docs, context_messages):
         )
     )
     
-    sequence = template | llm | StrOutputParser()
-    
-    # Generate an answer using the sequence
-    answer = sequence.invoke({
-        "message_context": message_context,
-        "doc_context": doc_context,
-        "question": question
-    })
-    
-    return answer
+    return template | model | StrOutputParser()
 
 # Generate FAISS index and save it to file
-def generate_faiss_with_retry(index_id, index_name):
+def generate_faiss_with_retry(index_id, index_name, workers=INDEXING_EXTRACT_WORKERS):
+    from openai import OpenAIError
+
     try:
-        return generate_faiss(index_id, index_name)
+        return generate_faiss(index_id, index_name, workers=workers)
     except OpenAIError as api_error:
         print(f"Error interacting with OpenAI: {api_error}")
         time.sleep(2)  # Optional: Add delay before retrying
-        return generate_faiss(index_id, index_name)  # Retry once more
+        return generate_faiss(index_id, index_name, workers=workers)  # Retry once more
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return []
     
-def generate_faiss(index_id,index_name):
+def generate_faiss(index_id,index_name, workers=INDEXING_EXTRACT_WORKERS, progress=None, may_persist=None):
+    from .chunk_store import ChunkStore
+    from .dedup import ChunkDeduplicator
+    from .faiss_io import (
+        add_chunks, append_exact_vectors, can_remove_vectors, factory_matches, load_vector_store, next_vector_id,
+        read_index_params, read_tombstones, remove_vectors, save_vector_store, write_index_params,
+        write_mmap_index, write_tombstones
+    )
     
-    # Theme index filter
-    doc_theme = DocThemes.objects.filter(id=index_id).first()
-
     # Check if the theme exists by ID or name, and create a new one if not found
     doc_theme = DocThemes.objects.filter(id=index_id).first()
     if not doc_theme:
@@ -140,85 +554,184 @@ def generate_faiss(index_id,index_name):
     doc_path = os.path.join(FAISS_INDEX_FILE, index_name)
     os.makedirs(doc_path, exist_ok=True)
 
-    docs = Docs.objects.filter(theme__id=index_id, faiss_loaded=False)
+    # Chunks already embedded with this model are read from the local cache
+    base_embeddings = get_embeddings()
+    indexing_embeddings = cached_embeddings(base_embeddings)
+
+    docs = {doc.id: doc for doc in Docs.objects.filter(theme__id=index_id, faiss_loaded=False)}
     file_names = []  # To keep track of newly added file names
+    loaded_doc_ids = []  # Docs whose chunks are in the in-memory index
+    pending = []  # (doc id, first vector id, chunk embeddings) held back until a new index can be trained
+    next_id = 0  # Vector id of the next chunk
+    removed_ids = []  # Vector ids of chunks removed from the in-memory index
+    copies = []  # (doc id, vector ids of indexed chunks the document also contains)
+    # Compressed themes that re-rank keep their exact vectors on disk
+    keep_exact_vectors = bool(doc_theme.compression and doc_theme.rerank_factor)
 
-    all_documents = []
-    for doc in docs:
-        file_path = os.path.join(BASE_DIR, doc.file.name)  # Get the actual file path
-        content = robust_extract_text(file_path)  # Extract text based on file type
-        
-        # Add the file name to the list
-        file_names.append(doc.file.name)
-        
-        # Create document chunks
-        book_documents = recursive_text_splitter.create_documents([content])
-            
-        # Clean and prepare documents
-        book_documents = [
-            Document(page_content=text.page_content.replace("\n", " ").replace(".", "").replace("-", ""))
-            for text in book_documents
-        ]
-        all_documents.extend(book_documents)
-
-        if all_documents:
-            # Load existing FAISS index and merge new content
-            if os.path.exists(os.path.join(doc_path, "index.faiss")):
-                old_docsearch = FAISS.load_local(doc_path, embeddings, allow_dangerous_deserialization=True)
-                new_docsearch = FAISS.from_documents(all_documents, embeddings)
-                new_docsearch.merge_from(old_docsearch)
-            else:
-                new_docsearch = FAISS.from_documents(all_documents, embeddings)
-
-            # Save the updated index
-            new_docsearch.save_local(doc_path)
-
-            # Mark the processed documents as loaded in the database
-            Docs.objects.filter(id__in=[doc.id for doc in docs]).update(faiss_loaded=True)
+    # Load the existing FAISS index once; new vectors are appended to it in place
+    vector_store = None
+    index_params = read_index_params(doc_path)
+    tombstones = read_tombstones(doc_path)
+    if os.path.exists(os.path.join(doc_path, "index.faiss")):
+        vector_store = load_vector_store(doc_path, base_embeddings)
+        factory = index_params.get("factory", "Flat")
+        if not factory_matches(factory, doc_theme.index_type, doc_theme.compression):
+            print(f"Index {index_name} is {factory}; run rebuild_faiss_index to apply the theme's index settings")
 
-    return file_names
+        # Chunks of documents deleted since, or waiting to be indexed again, are removed
+        if isinstance(vector_store.docstore, ChunkStore):
+            indexed_doc_ids = set(Docs.objects.filter(theme__id=index_id, faiss_loaded=True).values_list("id", flat=True))
+            stale_doc_ids = [doc_id for doc_id in vector_store.docstore.doc_ids() if doc_id not in indexed_doc_ids]
+            if stale_doc_ids and not can_remove_vectors(vector_store.index):
+                print(f"Index {index_name} cannot remove vectors; run rebuild_faiss_index to drop stale documents")
+            elif stale_doc_ids:
+                removed_ids = vector_store.docstore.release_docs(stale_doc_ids)
+                tombstones = remove_vectors(vector_store.index, removed_ids, tombstones)
+                print(f"Removed the chunks of {len(stale_doc_ids)} documents from {index_name}")
+        next_id = next_vector_id(vector_store, tombstones)
+
+    # Duplicate chunks are looked up in this run's chunks and, once the theme
+    # has one, in its chunk store. A pickled docstore cannot record copies.
+    dedup = None
+    if CHUNK_DEDUP and (vector_store is None or isinstance(vector_store.docstore, ChunkStore)):
+        chunk_store = vector_store.docstore if vector_store is not None else None
+        dedup = ChunkDeduplicator(chunk_store, CHUNK_SIMHASH_DISTANCE, exclude=removed_ids)
+
+    # Extract text based on file type, in parallel when workers > 1; documents
+    # are chunked and embedded in the order their parsing completes
+    extracted = extract_documents(
+        [(doc.id, os.path.join(BASE_DIR, doc.file.name)) for doc in docs.values()], workers=workers
+    )
 
-def robust_extract_text(file_path):
     try:
-        return extract_text(file_path)
-    except ValueError as e:
-        print(f"Error while extracting text from {file_path}: {str(e)}")
-        return "Failed to process document."
-    except OpenAIError as api_error:
-        print(f"OpenAI API Error: {api_error}")
-        # Optional: You can set a retry or fallback action here
-        return "There was an issue with the language model. Please try again later."
-    except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        return "An unexpected error occurred. Please check the system logs."
+        for handled, (doc_id, content) in enumerate(extracted, start=1):
+            doc = docs[doc_id]
+            # A document that failed to extract stays pending and is retried on the next run
+            if content is not None:
+                # Embed only the chunks of this document, exactly once
+                chunks = split_into_chunks(content)
+                if dedup is not None:
+                    chunks, copy_ids = dedup.split(chunks, next_id)
+                    if copy_ids:
+                        copies.append((doc.id, copy_ids))
+                if chunks:
+                    text_embeddings = list(zip(chunks, indexing_embeddings.embed_documents(chunks)))
+                    if keep_exact_vectors:
+                        append_exact_vectors(doc_path, next_id, [vector for _, vector in text_embeddings])
+                    if vector_store is None:
+                        pending.append((doc.id, next_id, text_embeddings))
+                        if sum(len(batch) for _, _, batch in pending) >= FAISS_TRAINING_SAMPLE_SIZE:
+                            vector_store, index_params["factory"] = new_vector_store(doc_theme, doc_path, pending, base_embeddings)
+                            pending = []
+                    else:
+                        add_chunks(vector_store, text_embeddings, next_id, doc_id=doc.id)
+                    next_id += len(text_embeddings)
 
-def extract_text(file_path):
-    mime_type, _ = mimetypes.guess_type(file_path)
-    
-    if mime_type == 'application/pdf':
-        # Extract text from PDF
-        return extract_text_from_pdf(file_path)
-    elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':  # .docx MIME type
-        # Extract text from DOCX
-        return extract_text_from_docx(file_path)
-    elif mime_type.startswith('text'):  # Plain text files
-        # Extract text from plain text file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    else:
-        raise ValueError(f"Unsupported file type: {mime_type}")
-
-def extract_text_from_pdf(file_path):
-    with open(file_path, 'rb') as f:
-        reader = PdfReader(f)
-        text = ''
-        for page in reader.pages:
-            text += page.extract_text()
-        return text
-
-def extract_text_from_docx(file_path):
-    doc = DocxDocument(file_path)
-    text = ''
-    for para in doc.paragraphs:
-        text += para.text
-    return text
+                loaded_doc_ids.append(doc.id)
+                file_names.append(doc.file.name)
+
+            if progress is not None:
+                # Report how many documents were handled so far, e.g. to an indexing job
+                progress(handled, len(docs))
+    finally:
+        # Stop pending extractions when the run ends early
+        extracted.close()
+
+        # A theme smaller than the training sample is built from all its chunks
+        if pending:
+            vector_store, index_params["factory"] = new_vector_store(doc_theme, doc_path, pending, base_embeddings)
+
+        # Persist once per run, also keeping the progress made before an error,
+        # unless the caller no longer owns the theme (e.g. its indexing job was
+        # released as stale and another worker took over)
+        changed = bool(loaded_doc_ids or removed_ids)
+        discarded = changed and may_persist is not None and not may_persist()
+        if discarded:
+            print(f"Not saving {index_name}: the run no longer owns the theme")
+        elif changed:
+            if vector_store is not None:
+                factory = index_params.get("factory", "Flat")
+                if len(tombstones) > FAISS_COMPACT_THRESHOLD * vector_store.index.ntotal:
+                    tombstones = compact_vector_store(vector_store, doc_theme, doc_path, factory, tombstones)
+                save_vector_store(vector_store, doc_path)
+                write_tombstones(doc_path, tombstones)
+                write_index_params(doc_path, search_params(doc_theme, factory))
+                if FAISS_INDEX_MMAP:
+                    write_mmap_index(doc_path)
+                # Other processes notice the rewritten index files themselves
+                answer_cache.invalidate(index_name)
+
+                # Chunk texts go once the saved index no longer returns them
+                if removed_ids:
+                    vector_store.docstore.delete_many(removed_ids)
+                for doc_id, copy_ids in copies:
+                    vector_store.docstore.add_refs(doc_id, copy_ids)
+
+            if dedup is not None and dedup.duplicates:
+                print(f"Skipped {dedup.duplicates} duplicate chunks in {index_name}")
+
+            # Mark only the documents that made it into the index as loaded
+            Docs.objects.filter(id__in=loaded_doc_ids).update(faiss_loaded=True)
+
+    if discarded:
+        raise RuntimeError(f"Indexing of {index_name} was discarded: the run no longer owns the theme.")
+    return file_names
+
+def new_vector_store(doc_theme, doc_path, pending, base_embeddings):
+    # Index of the theme's type holding the pending (doc id, first vector id,
+    # chunk embeddings) batches, trained on a sample when the type needs it.
+    # Returns the vector store and its factory string.
+    from langchain_community.vectorstores import FAISS
+    from .faiss_io import add_chunks, build_index, new_docstore, training_sample, with_vector_ids
+
+    vectors = [vector for _, _, text_embeddings in pending for _, vector in text_embeddings]
+    training_vectors = training_sample(vectors, FAISS_TRAINING_SAMPLE_SIZE)
+    factory = theme_index_factory(doc_theme, len(vectors), len(vectors[0]), n_training=len(training_vectors))
+    index = with_vector_ids(build_index(factory, training_vectors))
+    print(f"Building {factory} index for {doc_theme.theme}")
+
+    vector_store = FAISS(base_embeddings, index, *new_docstore(doc_path))
+    for doc_id, first_id, text_embeddings in pending:
+        add_chunks(vector_store, text_embeddings, first_id, doc_id=doc_id)
+    return vector_store, factory
+
+def compact_vector_store(vector_store, doc_theme, doc_path, factory, tombstones):
+    # Rebuild the index without its tombstoned vectors, once too many of them
+    # are skipped at search time. Returns the remaining (no) tombstones.
+    from .faiss_io import read_exact_vectors, rebuild_index
+
+    index = vector_store.index
+    print(f"Compacting {doc_theme.theme}: {len(tombstones)} of {index.ntotal} vectors are removed")
+    exact_vectors = read_exact_vectors(doc_path, len(vector_store.index_to_docstore_id), index.d)
+    vector_store.index = rebuild_index(index, factory, FAISS_TRAINING_SAMPLE_SIZE, exact_vectors, exclude=tombstones)
+    vector_store.docstore.vacuum()
+    return tombstones[:0]
+
+def theme_index_factory(doc_theme, n_vectors, dim, n_training):
+    from .faiss_io import index_factory_string, storage_factory
+
+    storage = storage_factory(doc_theme.compression, dim, doc_theme.pq_m, n_training)
+    return index_factory_string(
+        doc_theme.index_type, n_vectors, doc_theme.nlist, doc_theme.hnsw_m, n_training=n_training, storage=storage
+    )
+
+def search_params(doc_theme, factory):
+    # Stored next to the index and applied whenever it is loaded. Re-ranking
+    # only applies to compressed vectors.
+    rerank_factor = 0 if factory.endswith("Flat") else doc_theme.rerank_factor
+    return {
+        "factory": factory,
+        "nprobe": doc_theme.nprobe,
+        "efSearch": doc_theme.ef_search,
+        "rerank_factor": rerank_factor,
+    }
+
+def cached_embeddings(base_embeddings):
+    return CachedEmbeddings(base_embeddings, embedding_model_name(base_embeddings), embedding_store)
+
+def split_into_chunks(content):
+    # Create document chunks
+    chunks = get_text_splitter().split_text(content)
+
+    # Clean and prepare chunks
+    return [text.replace("\n", " ").replace(".", "").replace("-", "") for text in chunks]
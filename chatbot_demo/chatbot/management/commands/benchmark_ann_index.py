@@ -0,0 +1,70 @@
+import json
+import os
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand
+from chatbot.benchmarks import clustered_vectors, run_ann_benchmark
+from chatbot.faiss_io import index_factory_string
+from chatbot_demo.settings import FAISS_TRAINING_SAMPLE_SIZE
+
+class Command(BaseCommand):
+    help = 'Measures recall@k and query latency of Flat, IVF and HNSW indexes to choose per-theme settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=50000, help='Vectors in the synthetic dataset (default: 50000)')
+        parser.add_argument('--dim', type=int, default=1536, help='Vector dimension (default: 1536)')
+        parser.add_argument('--index-path', type=str, default=None, help="Use the vectors of an existing theme index instead")
+        parser.add_argument('--queries', type=int, default=200, help='Queries per setting (default: 200)')
+        parser.add_argument('--k', type=int, default=5, help='Neighbours retrieved per query (default: 5, as in chat)')
+        parser.add_argument('--nlist', type=int, default=None, help='IVF lists (default: about 4*sqrt(vectors))')
+        parser.add_argument('--nprobe', type=str, default='1,4,8,16,64', help='IVF nprobe values to try')
+        parser.add_argument('--hnsw-m', type=int, default=32, help='HNSW neighbours per node (default: 32)')
+        parser.add_argument('--ef-search', type=str, default='16,32,64,128,256', help='HNSW efSearch values to try')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        k = kwargs['k']
+        if kwargs['index_path']:
+            index = faiss.read_index(os.path.join(kwargs['index_path'], 'index.faiss'))
+            vectors = index.reconstruct_n(0, index.ntotal)
+            # Queries near stored chunks, like questions about indexed text
+            rng = np.random.default_rng(1)
+            picks = vectors[rng.choice(len(vectors), kwargs['queries'])]
+            queries = picks + 0.1 * picks.std() * rng.standard_normal(picks.shape, dtype="float32")
+        else:
+            self.stdout.write(f"Generating {kwargs['vectors']} clustered vectors...")
+            vectors = clustered_vectors(kwargs['vectors'], kwargs['dim'])
+            queries = clustered_vectors(kwargs['queries'], kwargs['dim'], seed=1)
+
+        # Ground truth from an exact search
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(vectors)
+        _, true_ids = exact.search(queries, k)
+        true_ids = true_ids.tolist()
+
+        n_vectors = len(vectors)
+        settings = [
+            (index_factory_string('flat', n_vectors), [{}]),
+            (index_factory_string('ivf', n_vectors, kwargs['nlist'], n_training=min(n_vectors, FAISS_TRAINING_SAMPLE_SIZE)),
+             [{'nprobe': int(value)} for value in kwargs['nprobe'].split(',')]),
+            (index_factory_string('hnsw', n_vectors, hnsw_m=kwargs['hnsw_m']),
+             [{'efSearch': int(value)} for value in kwargs['ef_search'].split(',')]),
+        ]
+
+        results = []
+        for factory, sweep in settings:
+            self.stdout.write(f"Building {factory}...")
+            results.extend(run_ann_benchmark(vectors, queries, true_ids, k, factory, sweep, FAISS_TRAINING_SAMPLE_SIZE))
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for result in results:
+            params = ', '.join(f"{name}={value}" for name, value in result['params'].items()) or 'exact'
+            self.stdout.write(self.style.SUCCESS(f"{result['factory']} ({params})"))
+            self.stdout.write(
+                f"  recall@{k}: {result[f'recall_at_{k}']:.3f}  p50/p95: {result['p50_ms']:.3f} / {result['p95_ms']:.3f} ms"
+                f"  build: {result['build_s']:.1f} s  size: {result['index_mb']:.1f} MB"
+            )
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from chatbot import langchain_bot
+from chatbot.benchmarks import SlowFakeEmbeddings, benchmark_database, database_latency, percentile, write_synthetic_corpus
+from chatbot.embedding_cache import EmbeddingStore, QueryEmbeddingCache
+from chatbot.index_cache import FaissIndexCache
+from chatbot.models import ChatMessage, ChatSession, Docs, DocThemes, PartitonPypes
+
+class Command(BaseCommand):
+    help = ('Times the pre-LLM part of a chat request (session, history and retrieval) with artificial '
+            'database and embedding latency, run one step after another and overlapped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per path (default: 50)')
+        parser.add_argument('--db-latency', type=float, default=0.01, help='Seconds added to every query (default: 0.01)')
+        parser.add_argument('--embedding-latency', type=float, default=0.05,
+                            help='Seconds per fake embedding call (default: 0.05)')
+        parser.add_argument('--history', type=int, default=10, help='Messages in each chat session (default: 10)')
+        parser.add_argument('--docs', type=int, default=20, help='Documents in the synthetic theme (default: 20)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        with benchmark_database(), tempfile.TemporaryDirectory() as root:
+            with mock.patch.multiple(
+                langchain_bot, embeddings=SlowFakeEmbeddings(size=64), BASE_DIR=root,
+                FAISS_INDEX_FILE=os.path.join(root, 'db'), index_cache=FaissIndexCache(),
+                embedding_store=EmbeddingStore(os.path.join(root, 'embedding_cache.sqlite3')),
+                query_embedding_cache=QueryEmbeddingCache(),
+            ):
+                theme, questions = self.build_theme(root, kwargs['docs'])
+                sessions = self.create_sessions(kwargs['requests'], kwargs['history'])
+                # Load the index once, so the timings compare steady-state requests
+                langchain_bot.query_faiss_index(questions[0], theme)
+
+                langchain_bot.embeddings.latency = kwargs['embedding_latency']
+                with database_latency(kwargs['db_latency']):
+                    results = {
+                        path: self.run(path, prepare, theme, questions, sessions)
+                        for path, prepare in (('sequential', self.prepare_sequentially),
+                                              ('sync', langchain_bot.prepare_answer_context),
+                                              ('async', async_to_sync(langchain_bot.aprepare_answer_context)))
+                    }
+                for result in results.values():
+                    result['speedup'] = results['sequential']['p50_ms'] / result['p50_ms']
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for path, result in results.items():
+            self.stdout.write(self.style.SUCCESS(f"{path}: {result['requests']} requests"))
+            self.stdout.write(f"  p50/p95: {result['p50_ms']:.1f} / {result['p95_ms']:.1f} ms")
+            self.stdout.write(f"  p50 speedup over sequential: {result['speedup']:.2f}x")
+
+    def build_theme(self, root, n_docs):
+        partition = PartitonPypes.objects.create(type='benchmark')
+        theme = DocThemes.objects.create(theme='benchmark')
+        paths, questions = write_synthetic_corpus(os.path.join(root, 'faiss_data', 'docs', theme.theme), n_docs, 500)
+        Docs.objects.bulk_create([Docs(file=os.path.relpath(path, root), theme=theme, partition=partition) for path in paths])
+        langchain_bot.generate_faiss(theme.id, theme.theme)
+        return theme.theme, questions
+
+    def create_sessions(self, n_sessions, history):
+        user = User.objects.create(username='benchmark')
+        sessions = ChatSession.objects.bulk_create([ChatSession(user=user) for _ in range(n_sessions)])
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, message='benchmark question', response='benchmark answer')
+            for session in sessions for _ in range(history)
+        ])
+        return [session.id for session in sessions]
+
+    def prepare_sequentially(self, question, theme, session_id):
+        # The steps of prepare_answer_context one after another, as before they overlapped
+        session = ChatSession.objects.get(id=session_id)
+        list(langchain_bot.unsummarized_messages(session_id, 10))
+        langchain_bot.query_faiss_index(question, theme)
+        return session
+
+    def run(self, path, prepare, theme, questions, sessions):
+        latencies = []
+        for number, session_id in enumerate(sessions):
+            # A new question each time, so its embedding is never cached
+            question = f"{questions[number % len(questions)]} {path} {number}"
+            start = time.perf_counter()
+            prepare(question, theme, session_id)
+            latencies.append(time.perf_counter() - start)
+        return {
+            'requests': len(sessions),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+        }
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from chatbot import langchain_bot
+from chatbot.benchmarks import (
+    SlowFakeChatModel, SlowFakeEmbeddings, benchmark_database, build_synthetic_index, latency_summary
+)
+from chatbot.index_cache import FaissIndexCache
+from chatbot.models import ChatMessage, ChatSession
+
+THEME = 'benchmark'
+
+class Command(BaseCommand):
+    help = 'Compares chats in flight per worker for the sync (thread pool) and async chat pipelines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Concurrent chat requests to send (default: 200)')
+        parser.add_argument('--threads', type=int, default=4, help='Threads of one sync worker (default: 4)')
+        parser.add_argument('--llm-latency', type=float, default=1.0, help='Seconds the fake LLM takes to answer (default: 1.0)')
+        parser.add_argument('--embedding-latency', type=float, default=0.1, help='Seconds per fake embedding call (default: 0.1)')
+        parser.add_argument('--vectors', type=int, default=2000, help='Vectors in the synthetic theme index (default: 2000)')
+        parser.add_argument('--dim', type=int, default=64, help='Vector dimension (default: 64)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        with benchmark_database(), tempfile.TemporaryDirectory() as index_root:
+            build_synthetic_index(os.path.join(index_root, THEME), kwargs['vectors'], kwargs['dim'])
+            user = User.objects.create(username='benchmark')
+
+            results = {}
+            for mode in ('sync', 'async'):
+                sessions = [ChatSession.objects.create(user=user).id for _ in range(kwargs['requests'])]
+                llm = SlowFakeChatModel(latency=kwargs['llm_latency'])
+                embeddings = SlowFakeEmbeddings(size=kwargs['dim'], latency=kwargs['embedding_latency'])
+
+                with mock.patch.multiple(langchain_bot, llm=llm, embeddings=embeddings, FAISS_INDEX_FILE=index_root,
+                                         index_cache=FaissIndexCache()):
+                    if mode == 'sync':
+                        latencies, wall_s = self.run_sync(sessions, kwargs['threads'])
+                    else:
+                        latencies, wall_s = asyncio.run(self.run_async(sessions))
+
+                results[mode] = {
+                    **latency_summary(latencies, wall_s),
+                    'peak_llm_calls_in_flight': llm.tracker.peak,
+                    # Failed chats return a fallback answer without saving a message
+                    'errors': len(sessions) - ChatMessage.objects.filter(session_id__in=sessions).count(),
+                }
+            results['sync']['threads'] = kwargs['threads']
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for mode, result in results.items():
+            self.stdout.write(self.style.SUCCESS(mode))
+            self.stdout.write(f"  {result['requests']} chats in {result['wall_s']:.2f}s ({result['throughput_rps']:.1f} req/s)")
+            self.stdout.write(f"  latency p50/p95/p99: {result['p50_s']:.2f} / {result['p95_s']:.2f} / {result['p99_s']:.2f} s")
+            self.stdout.write(f"  peak LLM calls in flight: {result['peak_llm_calls_in_flight']}, errors: {result['errors']}")
+
+    # Every request is sent at the same moment, so latency includes queueing for a thread
+    def run_sync(self, sessions, threads):
+        def chat(session_id):
+            langchain_bot.get_answer_from_index_with_memory(f"benchmark question {session_id}", THEME, session_id)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(chat, sessions))
+        return latencies, time.perf_counter() - start
+
+    async def run_async(self, sessions):
+        async def chat(session_id):
+            await langchain_bot.aget_answer_from_index_with_memory(f"benchmark question {session_id}", THEME, session_id)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(chat(session_id) for session_id in sessions))
+        return list(latencies), time.perf_counter() - start
@@ -0,0 +1,126 @@
+import json
+import os
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.benchmarks import clustered_vectors, run_ann_benchmark
+from chatbot.chunk_store import chunk_store_path
+from chatbot.faiss_io import index_memory_bytes, read_exact_vectors, read_index_params, read_tombstones, vector_ids
+from chatbot.langchain_bot import get_embeddings, theme_index_factory
+from chatbot.models import DocThemes
+from chatbot_demo.settings import FAISS_INDEX_FILE, FAISS_TRAINING_SAMPLE_SIZE
+
+COMPRESSIONS = {'none': DocThemes.NO_COMPRESSION, 'fp16': DocThemes.FP16, 'sq8': DocThemes.SQ8, 'pq': DocThemes.PQ}
+
+def docstore_size(doc_path):
+    # On disk only for the chunk store; a pickled docstore is all loaded in memory
+    if os.path.exists(chunk_store_path(doc_path)):
+        return 0
+    return os.path.getsize(os.path.join(doc_path, 'index.pkl'))
+
+class Command(BaseCommand):
+    help = ("Reports each theme index's memory footprint now and with fp16, SQ8 or PQ compression, "
+            "and the recall@k of each option on a held-out question set")
+
+    def add_arguments(self, parser):
+        parser.add_argument('themes', nargs='*', help='Themes to report on (default: a synthetic dataset)')
+        parser.add_argument('--questions', type=str, default=None,
+                            help='Held-out questions, one per line, embedded with the configured embeddings')
+        parser.add_argument('--queries', type=int, default=200, help='Synthetic queries when no questions are given (default: 200)')
+        parser.add_argument('--vectors', type=int, default=50000, help='Vectors in the synthetic dataset (default: 50000)')
+        parser.add_argument('--dim', type=int, default=1536, help='Vector dimension of the synthetic dataset (default: 1536)')
+        parser.add_argument('--k', type=int, default=5, help='Neighbours retrieved per query (default: 5, as in chat)')
+        parser.add_argument('--compressions', type=str, default='none,fp16,sq8,pq', help='Options to compare')
+        parser.add_argument('--rerank', type=str, default='0,4', help='Re-rank factors to try on compressed options')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        questions = None
+        if kwargs['questions']:
+            with open(kwargs['questions'], encoding='utf-8') as f:
+                questions = [line.strip() for line in f if line.strip()]
+            questions = np.asarray(get_embeddings().embed_documents(questions), dtype='float32')
+
+        reports = []
+        if not kwargs['themes']:
+            vectors = clustered_vectors(kwargs['vectors'], kwargs['dim'])
+            queries = questions if questions is not None else clustered_vectors(kwargs['queries'], kwargs['dim'], seed=1)
+            reports.append(self.compare('synthetic', DocThemes(theme='synthetic'), vectors, queries, None, kwargs))
+
+        for name in kwargs['themes']:
+            doc_theme = DocThemes.objects.filter(theme=name).first()
+            doc_path = os.path.join(FAISS_INDEX_FILE, name)
+            if doc_theme is None or not os.path.exists(os.path.join(doc_path, 'index.faiss')):
+                raise CommandError(f"FAISS index for {name} does not exist.")
+
+            index = faiss.read_index(os.path.join(doc_path, 'index.faiss'))
+            ids = vector_ids(index)
+            ids = ids[~np.isin(ids, read_tombstones(doc_path))]
+            exact_vectors = read_exact_vectors(doc_path, int(ids.max()) + 1 if len(ids) else 0, index.d)
+            if exact_vectors is not None:
+                vectors = np.asarray(exact_vectors[ids])
+            else:
+                # Approximate when the index is already compressed
+                if faiss.try_extract_index_ivf(index) is not None:
+                    faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Hashtable)
+                vectors = index.reconstruct_batch(ids)
+
+            queries = questions
+            if queries is None:
+                # Queries near stored chunks, like questions about indexed text
+                rng = np.random.default_rng(1)
+                picks = vectors[rng.choice(len(vectors), kwargs['queries'])]
+                queries = picks + 0.1 * picks.std() * rng.standard_normal(picks.shape, dtype='float32')
+
+            current = {
+                'factory': read_index_params(doc_path).get('factory', 'Flat'),
+                'index_mb': index_memory_bytes(index) / 2**20,
+                'docstore_mb': docstore_size(doc_path) / 2**20,
+            }
+            reports.append(self.compare(name, doc_theme, vectors, queries, current, kwargs))
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+
+        k = kwargs['k']
+        for report in reports:
+            self.stdout.write(self.style.SUCCESS(f"{report['theme']} ({report['vectors']} vectors, {report['queries']} queries)"))
+            if report['current']:
+                current = report['current']
+                self.stdout.write(f"  now: {current['factory']}, index {current['index_mb']:.1f} MB + docstore {current['docstore_mb']:.1f} MB in memory")
+            for option in report['options']:
+                self.stdout.write(
+                    f"  {option['compression']:<5} {option['factory']:<16} rerank x{option['params'].get('rerank_factor', 0)}: "
+                    f"{option['index_mb']:.1f} MB ({option['ratio']:.1f}x smaller), recall@{k} {option[f'recall_at_{k}']:.3f}, "
+                    f"p50 {option['p50_ms']:.3f} ms"
+                )
+
+    def compare(self, name, doc_theme, vectors, queries, current, kwargs):
+        k = kwargs['k']
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(vectors)
+        _, true_ids = exact.search(queries, k)
+        true_ids = true_ids.tolist()
+
+        n_training = min(len(vectors), FAISS_TRAINING_SAMPLE_SIZE)
+        options = []
+        for label in kwargs['compressions'].split(','):
+            doc_theme.compression = COMPRESSIONS[label]
+            factory = theme_index_factory(doc_theme, len(vectors), vectors.shape[1], n_training)
+            rerank_factors = [int(value) for value in kwargs['rerank'].split(',')] if doc_theme.compression else [0]
+            sweep = [
+                {'nprobe': doc_theme.nprobe, 'efSearch': doc_theme.ef_search, 'rerank_factor': factor}
+                for factor in rerank_factors
+            ]
+            for option in run_ann_benchmark(vectors, queries, true_ids, k, factory, sweep, FAISS_TRAINING_SAMPLE_SIZE):
+                option['compression'] = label
+                options.append(option)
+
+        # Footprints relative to the raw float32 vectors
+        float32_mb = len(vectors) * vectors.shape[1] * 4 / 2**20
+        for option in options:
+            option['ratio'] = float32_mb / option['index_mb'] if option['index_mb'] else 0.0
+
+        return {'theme': name, 'vectors': len(vectors), 'queries': len(queries), 'current': current, 'options': options}
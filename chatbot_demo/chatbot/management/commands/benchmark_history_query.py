@@ -0,0 +1,90 @@
+import json
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from chatbot.benchmarks import benchmark_database, percentile
+from chatbot.langchain_bot import unsummarized_messages
+from chatbot.models import ChatMessage, ChatSession
+
+SEED_BATCH_SIZE = 10000
+
+class Command(BaseCommand):
+    help = 'Seeds a throwaway database with chat messages and times the recent-history query as it grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--steps',
+            type=str,
+            default='10000,100000,1000000,3000000',
+            help='Comma-separated message counts to measure at (default: 10000,100000,1000000,3000000)'
+        )
+        parser.add_argument('--sessions', type=int, default=10000, help='Chat sessions to spread messages over (default: 10000)')
+        parser.add_argument('--samples', type=int, default=500, help='Timed queries per step (default: 500)')
+        parser.add_argument('--max-context-messages', type=int, default=10, help='History size per query (default: 10)')
+        parser.add_argument('--without-index', action='store_true',
+                            help='Drop the (session, id) index and the session foreign key index to compare')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        steps = sorted(int(step) for step in kwargs['steps'].split(','))
+        max_context_messages = kwargs['max_context_messages']
+
+        with benchmark_database():
+            if kwargs['without_index']:
+                drop_session_indexes()
+
+            user = User.objects.create(username='benchmark')
+            ChatSession.objects.bulk_create([ChatSession(user=user) for _ in range(kwargs['sessions'])])
+            session_ids = list(ChatSession.objects.values_list('id', flat=True))
+
+            results = []
+            seeded = 0
+            for step in steps:
+                self.stdout.write(f"Seeding up to {step} messages...")
+                while seeded < step:
+                    batch = min(SEED_BATCH_SIZE, step - seeded)
+                    ChatMessage.objects.bulk_create([
+                        ChatMessage(session_id=random.choice(session_ids), message='benchmark question', response='benchmark answer')
+                        for _ in range(batch)
+                    ])
+                    seeded += batch
+
+                latencies = []
+                for session_id in random.choices(session_ids, k=kwargs['samples']):
+                    start = time.perf_counter()
+                    # Same query as the chat flow
+                    list(unsummarized_messages(session_id, max_context_messages))
+                    latencies.append(time.perf_counter() - start)
+
+                plan = unsummarized_messages(session_ids[0], max_context_messages).explain()
+                results.append({
+                    'messages': seeded,
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p95_ms': percentile(latencies, 95) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'plan': plan,
+                })
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for result in results:
+            self.stdout.write(self.style.SUCCESS(f"{result['messages']} messages"))
+            self.stdout.write(f"  recent history p50/p95/p99: {result['p50_ms']:.3f} / {result['p95_ms']:.3f} / {result['p99_ms']:.3f} ms")
+            self.stdout.write(f"  plan: {result['plan']}")
+
+
+def drop_session_indexes():
+    # Every index leading with session_id serves the history query: on SQLite
+    # the foreign key index also holds the rowid (the id), so it has to go too
+    table = ChatMessage._meta.db_table
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    with connection.schema_editor() as schema_editor:
+        for name, constraint in constraints.items():
+            if constraint['index'] and not constraint['primary_key'] and constraint['columns'][:1] == ['session_id']:
+                schema_editor.execute(schema_editor._delete_index_sql(ChatMessage, name))
@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+
+import faiss
+from django.core.management.base import BaseCommand
+from chatbot.benchmarks import build_synthetic_index, drop_file_cache, run_index_loading
+from chatbot.faiss_io import write_mmap_index
+
+class Command(BaseCommand):
+    help = 'Compares memory and first-query latency of load_local vs memory-mapped FAISS loading across workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of worker processes (default: 4)')
+        parser.add_argument('--vectors', type=int, default=50000, help='Vectors in the synthetic index (default: 50000)')
+        parser.add_argument('--dim', type=int, default=1536, help='Vector dimension (default: 1536)')
+        parser.add_argument('--index-path', type=str, default=None, help='Benchmark an existing theme index directory instead')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            doc_path = kwargs['index_path']
+            if doc_path is None:
+                doc_path = os.path.join(tmp_dir, 'synthetic')
+                self.stdout.write(f"Building synthetic index with {kwargs['vectors']} vectors...")
+                vectors = build_synthetic_index(doc_path, kwargs['vectors'], kwargs['dim'])
+                query = vectors[0].tolist()
+            else:
+                index = faiss.read_index(os.path.join(doc_path, 'index.faiss'))
+                query = index.reconstruct(0).tolist()
+
+            # Prepare the memory-mapped copy up front so workers only measure loading
+            mmap_available = write_mmap_index(doc_path)
+
+            results = {}
+            for mode in ('load_local', 'mmap'):
+                if mode == 'mmap' and not mmap_available:
+                    continue
+                drop_file_cache(doc_path)
+                results[mode] = run_index_loading(doc_path, mode == 'mmap', kwargs['workers'], query)
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for mode, result in results.items():
+            self.stdout.write(self.style.SUCCESS(f"{mode} ({result['workers']} workers)"))
+            self.stdout.write(f"  first query p50/max: {result['first_query_s_p50'] * 1000:.1f} / {result['first_query_s_max'] * 1000:.1f} ms")
+            self.stdout.write(f"  RSS per worker: {result['rss_mb_per_worker']:.1f} MB, RSS total: {result['rss_mb_total']:.1f} MB")
+            self.stdout.write(f"  PSS total: {result['pss_mb_total']:.1f} MB, private total: {result['private_mb_total']:.1f} MB")
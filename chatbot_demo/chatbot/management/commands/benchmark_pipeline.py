@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from chatbot import langchain_bot
+from chatbot.benchmarks import (
+    SlowFakeChatModel, SlowFakeEmbeddings, benchmark_database, compare_to_baseline, latency_summary, percentile,
+    write_synthetic_corpus
+)
+from chatbot.embedding_cache import EmbeddingStore, QueryEmbeddingCache
+from chatbot.index_cache import FaissIndexCache
+from chatbot.models import ChatMessage, ChatSession, Docs, DocThemes, PartitonPypes
+
+class Command(BaseCommand):
+    help = ('Benchmarks indexing, retrieval and the chat endpoint on synthetic themes, with fake embeddings '
+            'and a fake-latency LLM, and reports throughput and latency percentiles as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--themes', type=int, default=2, help='Synthetic themes to index (default: 2)')
+        parser.add_argument('--docs', type=int, default=50, help='Documents per theme (default: 50)')
+        parser.add_argument('--words', type=int, default=2000, help='Words per document (default: 2000)')
+        parser.add_argument('--queries', type=int, default=200, help='Timed retrieval queries (default: 200)')
+        parser.add_argument('--requests', type=int, default=100, help='Chat requests per concurrency level (default: 100)')
+        parser.add_argument('--concurrency', type=str, default='1,4,16',
+                            help='Comma-separated numbers of chats in flight (default: 1,4,16)')
+        parser.add_argument('--llm-latency', type=float, default=0.05, help='Seconds the fake LLM takes to answer (default: 0.05)')
+        parser.add_argument('--embedding-latency', type=float, default=0.0,
+                            help='Seconds per fake embedding call (default: 0.0)')
+        parser.add_argument('--dim', type=int, default=256, help='Embedding dimension (default: 256)')
+        parser.add_argument('--output', type=str, help='Also write the JSON results to this file')
+        parser.add_argument('--baseline', type=str, help='JSON results of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative slowdown over the baseline reported as a regression (default: 0.2)')
+
+    def handle(self, *args, **kwargs):
+        levels = [int(level) for level in kwargs['concurrency'].split(',')]
+        baseline = None
+        if kwargs['baseline']:
+            with open(kwargs['baseline']) as f:
+                baseline = json.load(f)
+
+        with benchmark_database(), tempfile.TemporaryDirectory() as root:
+            llm = SlowFakeChatModel(latency=kwargs['llm_latency'])
+            embeddings = SlowFakeEmbeddings(size=kwargs['dim'], latency=kwargs['embedding_latency'])
+            # Fresh caches, so nothing is read from or written to the project's
+            with mock.patch.multiple(
+                langchain_bot, llm=llm, embeddings=embeddings, BASE_DIR=root,
+                FAISS_INDEX_FILE=os.path.join(root, 'db'), index_cache=FaissIndexCache(),
+                embedding_store=EmbeddingStore(os.path.join(root, 'embedding_cache.sqlite3')),
+                query_embedding_cache=QueryEmbeddingCache(),
+            ):
+                themes, questions, indexing = self.run_indexing(root, kwargs)
+                retrieval = self.run_retrieval(questions, kwargs['queries'])
+                chat = {
+                    f'concurrency_{level}': self.run_chat(questions, kwargs['requests'], level)
+                    for level in levels
+                }
+
+        results = {
+            'config': {name: kwargs[name] for name in (
+                'themes', 'docs', 'words', 'queries', 'requests', 'concurrency', 'llm_latency', 'embedding_latency', 'dim'
+            )},
+            'indexing': indexing,
+            'retrieval': retrieval,
+            'chat': chat,
+        }
+        output = json.dumps(results, indent=2)
+        self.stdout.write(output)
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                f.write(output + '\n')
+
+        if baseline is not None:
+            regressions = compare_to_baseline(results, baseline, kwargs['tolerance'])
+            for name, before, after in regressions:
+                self.stderr.write(f"{name}: {before:.4g} -> {after:.4g}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} metrics regressed by more than {kwargs['tolerance']:.0%}.")
+            self.stderr.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def run_indexing(self, root, kwargs):
+        partition = PartitonPypes.objects.create(type='benchmark')
+        themes = []
+        questions = []
+        latencies = []
+        start = time.perf_counter()
+        for number in range(kwargs['themes']):
+            theme = DocThemes.objects.create(theme=f'benchmark{number}')
+            paths, theme_questions = write_synthetic_corpus(
+                os.path.join(root, 'faiss_data', 'docs', theme.theme), kwargs['docs'], kwargs['words'], seed=number
+            )
+            Docs.objects.bulk_create([
+                Docs(file=os.path.relpath(path, root), theme=theme, partition=partition) for path in paths
+            ])
+
+            theme_start = time.perf_counter()
+            langchain_bot.generate_faiss(theme.id, theme.theme)
+            latencies.append(time.perf_counter() - theme_start)
+            themes.append(theme.theme)
+            questions.extend((theme.theme, question) for question in theme_questions)
+        wall_s = time.perf_counter() - start
+
+        vectors = sum(langchain_bot.load_faiss_index(
+            os.path.join(langchain_bot.FAISS_INDEX_FILE, theme)
+        ).index.ntotal for theme in themes)
+        docs = kwargs['themes'] * kwargs['docs']
+        return themes, questions, {
+            'docs': docs,
+            'vectors': vectors,
+            'wall_s': wall_s,
+            'docs_per_s': docs / wall_s,
+            'vectors_per_s': vectors / wall_s,
+            'p50_theme_s': percentile(latencies, 50),
+        }
+
+    def run_retrieval(self, questions, queries):
+        # Distinct questions, so every query is embedded and searched
+        latencies = []
+        start = time.perf_counter()
+        for number in range(queries):
+            theme, question = questions[number % len(questions)]
+            query_start = time.perf_counter()
+            langchain_bot.query_faiss_index(f"{question} {number}", theme)
+            latencies.append(time.perf_counter() - query_start)
+        return latency_summary(latencies, time.perf_counter() - start)
+
+    def run_chat(self, questions, requests, concurrency):
+        user, _ = User.objects.get_or_create(username='benchmark')
+        sessions = [ChatSession.objects.create(user=user).id for _ in range(requests)]
+
+        def chat(number):
+            theme, question = questions[number % len(questions)]
+            query = urlencode({'session_id': sessions[number], 'doc_theme_name': theme, 'question': question})
+            request_start = time.perf_counter()
+            Client(HTTP_HOST='localhost').post(f'/api/chat/?{query}')
+            return time.perf_counter() - request_start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(chat, range(requests)))
+        return {
+            **latency_summary(latencies, time.perf_counter() - start),
+            # Failed chats return an error or a fallback answer without saving a message
+            'errors': requests - ChatMessage.objects.filter(session_id__in=sessions).count(),
+        }
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.benchmarks import STARTUP_MODULES, measure_startup, percentile
+
+class Command(BaseCommand):
+    help = 'Times Django setup plus the app imports in fresh interpreters and lists the slowest imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time (default: 5)')
+        parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to list (default: 10)')
+        parser.add_argument('--budget-ms', type=float, default=None, help='Fail when the median startup exceeds this')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **kwargs):
+        runs = [measure_startup() for _ in range(kwargs['runs'])]
+
+        # Per-import times from the median run
+        median_run = sorted(runs, key=lambda run: run['seconds'])[len(runs) // 2]
+        slowest = sorted(median_run['imports'].items(), key=lambda item: item[1], reverse=True)[:kwargs['top']]
+        results = {
+            'modules': list(STARTUP_MODULES),
+            'runs': len(runs),
+            'startup_ms_p50': percentile([run['seconds'] for run in runs], 50) * 1000,
+            'startup_ms_min': min(run['seconds'] for run in runs) * 1000,
+            'lazy_modules_loaded': median_run['lazy_modules_loaded'],
+            'slowest_imports_ms': {name: seconds * 1000 for name, seconds in slowest},
+        }
+
+        if kwargs['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Startup over {results['runs']} runs"))
+            self.stdout.write(f"  p50/min: {results['startup_ms_p50']:.1f} / {results['startup_ms_min']:.1f} ms")
+            for name, ms in results['slowest_imports_ms'].items():
+                self.stdout.write(f"  {ms:8.1f} ms  {name}")
+
+        # Usable as a regression guard, e.g. in CI
+        if results['lazy_modules_loaded']:
+            raise CommandError(f"Loaded at startup: {', '.join(results['lazy_modules_loaded'])}")
+        if kwargs['budget_ms'] is not None and results['startup_ms_p50'] > kwargs['budget_ms']:
+            raise CommandError(f"Startup p50 {results['startup_ms_p50']:.1f} ms exceeds {kwargs['budget_ms']:.1f} ms")
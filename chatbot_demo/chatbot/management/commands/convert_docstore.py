@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.chunk_store import CHUNK_STORE_FILE, chunk_store_path
+from chatbot.faiss_io import convert_docstore
+from chatbot.jobs import ThemeBusy, default_worker_name, hold_theme
+from chatbot.models import DocThemes
+from chatbot_demo.settings import FAISS_INDEX_FILE
+
+class Command(BaseCommand):
+    help = ("Converts theme indexes from the pickled docstore (index.pkl) to the SQLite chunk store. "
+            "Themes being indexed are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('themes', nargs='*', help='Themes to convert (default: every theme with an index.pkl)')
+        parser.add_argument('--keep-pickle', action='store_true', help='Keep index.pkl after converting')
+
+    def handle(self, *args, **kwargs):
+        names = kwargs['themes'] or list(DocThemes.objects.order_by('theme').values_list('theme', flat=True))
+        doc_themes = DocThemes.objects.in_bulk(names, field_name='theme')
+
+        for theme in names:
+            if theme not in doc_themes:
+                raise CommandError(f"Theme {theme} does not exist.")
+            doc_path = os.path.join(FAISS_INDEX_FILE, theme)
+            pickle_path = os.path.join(doc_path, 'index.pkl')
+            if os.path.exists(chunk_store_path(doc_path)):
+                self.stdout.write(f"{theme}: already uses {CHUNK_STORE_FILE}")
+                continue
+            if not os.path.exists(pickle_path):
+                if kwargs['themes']:
+                    raise CommandError(f"FAISS index for {theme} does not exist.")
+                continue
+
+            # Hold the theme like an indexing job, so no worker writes the index meanwhile
+            try:
+                with hold_theme(doc_themes[theme], f"{default_worker_name()} convert_docstore"):
+                    ntotal = convert_docstore(doc_path, keep_pickle=kwargs['keep_pickle'])
+            except ThemeBusy as e:
+                if kwargs['themes']:
+                    raise CommandError(str(e))
+                self.stderr.write(f"Skipping {theme}: {e}")
+                continue
+            self.stdout.write(self.style.SUCCESS(f"{theme}: converted {ntotal} chunks to {CHUNK_STORE_FILE}"))
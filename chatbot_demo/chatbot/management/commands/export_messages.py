@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from chatbot.export import EXPORT_CHUNK_SIZE, export_queryset, iter_ndjson
+
+class Command(BaseCommand):
+    help = 'Exports chat messages as newline-delimited JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Only messages of this user')
+        parser.add_argument('--session-id', type=int, help='Only messages of this chat session')
+        parser.add_argument('--since', type=str, help='Only messages created at or after this ISO datetime')
+        parser.add_argument('--until', type=str, help='Only messages created before this ISO datetime')
+        parser.add_argument('--output', type=str, default='-', help='File to write to (default: stdout)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help=f'Rows fetched from the database at a time (default: {EXPORT_CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **kwargs):
+        dates = {}
+        for name in ('since', 'until'):
+            if kwargs[name]:
+                dates[name] = parse_datetime(kwargs[name])
+                if dates[name] is None:
+                    raise CommandError(f'--{name} must be an ISO datetime, e.g. 2024-10-01T00:00:00Z')
+
+        messages = export_queryset(kwargs['user_id'], kwargs['session_id'], **dates)
+
+        output = sys.stdout if kwargs['output'] == '-' else open(kwargs['output'], 'w', encoding='utf-8')
+        try:
+            rows = 0
+            for line in iter_ndjson(messages, chunk_size=kwargs['chunk_size']):
+                output.write(line)
+                rows += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        self.stderr.write(self.style.SUCCESS(f'Exported {rows} messages.'))
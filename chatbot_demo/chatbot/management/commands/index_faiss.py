@@ -1,24 +1,43 @@
-from django.core.management.base import BaseCommand
-from chatbot.langchain_bot import generate_faiss_with_retry
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.jobs import claim_theme, default_worker_name, enqueue_indexing_job, run_indexing_job
+from chatbot.models import DocThemes
+from chatbot_demo.settings import INDEXING_EXTRACT_WORKERS
 
 class Command(BaseCommand):
-    help = 'Indexes documents using FAISS'
+    help = ("Queues a FAISS indexing job for a theme, run by index_worker. "
+            "With --run the job is run here, unless the theme is already being indexed.")
 
     def add_arguments(self, parser):
         # Add command-line arguments for index_id and index_name
         parser.add_argument('index_id', type=int, help='ID of the theme index')
         parser.add_argument('index_name', type=str, help='Name of the theme index')
+        parser.add_argument('--run', action='store_true', help='Run the job in this process instead of queueing it')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=INDEXING_EXTRACT_WORKERS,
+            help=f'Processes used to extract document text in parallel (default: {INDEXING_EXTRACT_WORKERS})'
+        )
 
     def handle(self, *args, **kwargs):
         # Retrieve command-line arguments
-        index_id = kwargs['index_id']
-        index_name = kwargs['index_name']
+        theme = DocThemes.objects.filter(id=kwargs['index_id'], theme=kwargs['index_name']).first()
+        if theme is None:
+            raise CommandError(f"Theme {kwargs['index_id']} ({kwargs['index_name']}) does not exist.")
 
-        self.stdout.write("Starting FAISS indexing...")
+        if not kwargs['run']:
+            job = enqueue_indexing_job(theme)
+            self.stdout.write(self.style.SUCCESS(f"Queued indexing job {job.id} for theme '{theme.theme}'."))
+            return
 
-        try:
-            # Call the generate_faiss function with the provided arguments
-            file_names = generate_faiss_with_retry(index_id, index_name)
-            self.stdout.write(self.style.SUCCESS(f'Successfully indexed documents: {file_names}'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Failed to index documents: {e}'))
+        # Same lock as the workers, so they never write the index at the same time
+        job = claim_theme(theme, default_worker_name())
+        if job is None:
+            raise CommandError(f"Theme {theme.theme} is being indexed; try again once its job has finished.")
+
+        self.stdout.write(f"Running indexing job {job.id} for theme '{theme.theme}'...")
+        job = run_indexing_job(job, workers=kwargs['workers'])
+        if job.status == job.DONE:
+            self.stdout.write(self.style.SUCCESS(f'Successfully indexed documents: {job.file_names}'))
+        else:
+            self.stdout.write(self.style.ERROR(f'Failed to index documents: {job.error}'))
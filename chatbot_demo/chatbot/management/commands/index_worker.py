@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from chatbot.jobs import claim_next_job, default_worker_name, fail_stale_jobs, run_indexing_job
+from chatbot_demo.settings import INDEXING_EXTRACT_WORKERS
+
+class Command(BaseCommand):
+    help = 'Claims and runs queued FAISS indexing jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no job is queued instead of polling')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between queue polls (default: 5)')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=INDEXING_EXTRACT_WORKERS,
+            help=f'Processes used to extract document text in parallel (default: {INDEXING_EXTRACT_WORKERS})'
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=1800,
+            help='Seconds without a heartbeat before a running job is marked failed (default: 1800)'
+        )
+        parser.add_argument('--name', type=str, default=None, help='Worker name recorded on claimed jobs')
+
+    def handle(self, *args, **kwargs):
+        worker_name = kwargs['name'] or default_worker_name()
+        self.stdout.write(f"Indexing worker {worker_name} started.")
+
+        while True:
+            # Drop connections the database may have closed while we slept
+            close_old_connections()
+
+            stale = fail_stale_jobs(kwargs['stale_after'])
+            if stale:
+                self.stdout.write(self.style.WARNING(f'Marked {stale} stale job(s) as failed.'))
+
+            job = claim_next_job(worker_name)
+            if job is None:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['poll_interval'])
+                continue
+
+            self.stdout.write(f"Running indexing job {job.id} for theme '{job.theme.theme}'...")
+            job = run_indexing_job(job, workers=kwargs['workers'])
+            if job.status == job.DONE:
+                self.stdout.write(self.style.SUCCESS(f'Job {job.id} indexed documents: {job.file_names}'))
+            else:
+                self.stdout.write(self.style.ERROR(f'Job {job.id} failed: {job.error}'))
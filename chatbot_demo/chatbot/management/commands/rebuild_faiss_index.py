@@ -0,0 +1,90 @@
+import os
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.faiss_io import (
+    append_exact_vectors, base_index, can_remove_vectors, convert_docstore, has_pickled_docstore,
+    read_exact_vectors, read_index_params, read_tombstones, rebuild_index, vector_ids, write_index_params,
+    write_mmap_index, write_tombstones
+)
+from chatbot.jobs import ThemeBusy, default_worker_name, hold_theme
+from chatbot.langchain_bot import search_params, theme_index_factory
+from chatbot.models import DocThemes
+from chatbot_demo.settings import FAISS_INDEX_FILE, FAISS_INDEX_MMAP, FAISS_TRAINING_SAMPLE_SIZE
+
+class Command(BaseCommand):
+    help = ("Rebuilds a theme's FAISS index with the theme's index type (Flat, IVF or HNSW) and "
+            "compression, without the vectors of removed documents, and updates its search parameters. "
+            "Refuses to run while the theme is being indexed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('theme', type=str, help='Name of the theme to rebuild')
+        parser.add_argument('--force', action='store_true', help='Rebuild even if the index already has the wanted layout')
+
+    def handle(self, *args, **kwargs):
+        doc_theme = DocThemes.objects.filter(theme=kwargs['theme']).first()
+        if doc_theme is None:
+            raise CommandError(f"Theme {kwargs['theme']} does not exist.")
+
+        # Hold the theme like an indexing job, so no worker writes the index meanwhile
+        try:
+            with hold_theme(doc_theme, f"{default_worker_name()} rebuild_faiss_index"):
+                self.rebuild(doc_theme, kwargs['force'])
+        except ThemeBusy as e:
+            raise CommandError(str(e))
+
+    def rebuild(self, doc_theme, force):
+        doc_path = os.path.join(FAISS_INDEX_FILE, doc_theme.theme)
+        index_path = os.path.join(doc_path, 'index.faiss')
+        if not os.path.exists(index_path):
+            raise CommandError(f"FAISS index for {doc_theme.theme} does not exist.")
+
+        index = faiss.read_index(index_path)
+        current = read_index_params(doc_path).get('factory', 'Flat')
+        factory = theme_index_factory(doc_theme, index.ntotal, index.d, min(index.ntotal, FAISS_TRAINING_SAMPLE_SIZE))
+        tombstones = read_tombstones(doc_path)
+        ids = vector_ids(index)
+        id_bound = int(ids.max()) + 1 if len(ids) else 0
+
+        exact_vectors = read_exact_vectors(doc_path, id_bound, index.d)
+        if exact_vectors is None and doc_theme.compression and doc_theme.rerank_factor:
+            if current.endswith('Flat'):
+                # Keep the exact vectors for re-ranking before they are compressed away
+                vectors = np.zeros((id_bound, index.d), dtype='float32')
+                vectors[ids] = base_index(index).reconstruct_n(0, index.ntotal)
+                append_exact_vectors(doc_path, 0, vectors)
+                exact_vectors = read_exact_vectors(doc_path, id_bound, index.d)
+            else:
+                self.stderr.write(f"{current} does not hold exact vectors; re-index {doc_theme.theme} to re-rank.")
+        if exact_vectors is None and not current.endswith('Flat') and factory != current:
+            self.stderr.write(f"Rebuilding from the approximate vectors of {current}.")
+
+        # Indexes written before vectors had ids of their own cannot remove documents
+        if factory != current or len(tombstones) or not can_remove_vectors(index) or force:
+            self.stdout.write(
+                f"Rebuilding {doc_theme.theme}: {current} -> {factory} "
+                f"({index.ntotal - len(tombstones)} vectors, {len(tombstones)} removed)..."
+            )
+            new_index = rebuild_index(index, factory, FAISS_TRAINING_SAMPLE_SIZE, exact_vectors, exclude=tombstones)
+
+            # Vectors keep their ids, so the chunk store stays valid as is. A
+            # pickled docstore is converted first: the rebuilt index has ids,
+            # which only the chunk store can hand out to new chunks.
+            if has_pickled_docstore(doc_path):
+                self.stdout.write(f"Converting the pickled docstore of {doc_theme.theme} to the chunk store...")
+                convert_docstore(doc_path)
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            faiss.write_index(new_index, tmp_path)
+            os.replace(tmp_path, index_path)
+            write_tombstones(doc_path, tombstones[:0])
+            if FAISS_INDEX_MMAP:
+                write_mmap_index(doc_path)
+
+        # Loaded indexes are reloaded with the new parameters on their next query
+        params = search_params(doc_theme, factory)
+        write_index_params(doc_path, params)
+        self.stdout.write(self.style.SUCCESS(
+            f"{doc_theme.theme}: {factory}, nprobe={params['nprobe']}, efSearch={params['efSearch']}, "
+            f"rerank_factor={params['rerank_factor']}"
+        ))
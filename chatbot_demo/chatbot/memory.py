@@ -0,0 +1,57 @@
+import threading
+
+# Token-budgeted conversation memory. The prompt gets the session's rolling
+# summary plus as many of the most recent turns as fit in the token budget;
+# older turns are folded into the summary instead of being sent verbatim.
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding(model_name):
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.encoding_for_model(model_name)
+                except Exception as e:
+                    # tiktoken downloads its BPE files on first use; without them
+                    # fall back to the usual ~4 characters per token estimate
+                    print(f"Using approximate token counts: {e}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text, model_name="gpt-3.5-turbo"):
+    encoding = _get_encoding(model_name)
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def format_turn(message):
+    return f"User: {message.message}\nAI: {message.response}"
+
+
+def select_context(messages, summary, max_messages, token_budget):
+    # messages are the unsummarized turns, newest first. Returns (recent, overflow):
+    # the turns to send verbatim in chronological order, and the older turns
+    # that did not fit, also in chronological order.
+    remaining = token_budget - (count_tokens(summary) if summary else 0)
+
+    recent = []
+    for index, message in enumerate(messages):
+        cost = count_tokens(format_turn(message))
+        if len(recent) >= max_messages or cost > remaining:
+            overflow = list(messages[index:])
+            break
+        recent.append(message)
+        remaining -= cost
+    else:
+        overflow = []
+
+    recent.reverse()
+    overflow.reverse()
+    return recent, overflow
@@ -0,0 +1,171 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Latency and usage metrics of the chat pipeline. Each stage is timed with
+# stage(name): the duration is added to the Server-Timing header of the
+# current request (ServerTimingMiddleware) and to a process-wide histogram
+# that the /metrics endpoint exports in the Prometheus text format. Metrics
+# are kept per worker process, so every worker is scraped on its own.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the request being handled, None outside a request
+request_timings = ContextVar("request_timings", default=None)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {count}")
+                count = series[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Time spent in each stage of the chat pipeline.")
+REQUEST_SECONDS = Histogram("chatbot_request_seconds", "Time to produce the response of each API view.")
+LLM_TOKENS = Counter("chatbot_llm_tokens_total", "Tokens sent to and received from the LLM, per chain.")
+COALESCED_CALLS = Counter("chatbot_coalesced_calls_total", "Calls that waited for an identical call already in flight.")
+
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, LLM_TOKENS, COALESCED_CALLS)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((name, duration))
+
+
+def server_timing(timings, total):
+    # Server-Timing header value in milliseconds, one entry per stage in the
+    # order stages first ran; stages that ran several times (or in parallel,
+    # like the search of several themes) are summed
+    durations = {}
+    for name, duration in timings:
+        durations[name] = durations.get(name, 0.0) + duration
+    durations["total"] = total
+    return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in durations.items())
+
+
+def cache_metric_lines(caches):
+    # Counters and hit ratio of the process caches, from their stats() dicts keyed by cache name
+    lines = []
+    for name, help_text, kind, key in (
+        ("chatbot_cache_hits_total", "Lookups answered from the cache.", "counter", "hits"),
+        ("chatbot_cache_misses_total", "Lookups that missed the cache.", "counter", "misses"),
+        ("chatbot_cache_hit_ratio", "Share of lookups answered from the cache.", "gauge", "hit_rate"),
+        ("chatbot_cache_entries", "Entries held by the cache.", "gauge", "size"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{cache="{cache}"}} {stats[key]}' for cache, stats in caches.items()]
+    return lines
+
+
+def render_metrics(extra_lines=()):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+class ServerTimingMiddleware:
+    # Times the stages of every request and returns them in a Server-Timing
+    # header. A streamed response gets the stages run before its first byte;
+    # the rest still go to the histograms.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = []
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = []
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        response["Server-Timing"] = server_timing(timings, total)
+        match = request.resolver_match
+        REQUEST_SECONDS.observe(total, view=match.view_name if match else "unmatched")
+        return response
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocThemes',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('theme', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PartitonPypes',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=20)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatSession',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('message', models.TextField()),
+                ('response', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chatbot.chatsession')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Docs',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('file', models.FileField(upload_to='faiss_data/docs/')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('author', models.CharField(blank=True, max_length=255, null=True)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('faiss_loaded', models.BooleanField(default=False)),
+                ('theme', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='chatbot.docthemes')),
+                ('partition', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='chatbot.partitonpypes')),
+            ],
+        ),
+    ]
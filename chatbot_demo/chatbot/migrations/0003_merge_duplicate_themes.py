@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:51
+
+from django.db import migrations
+
+
+def merge_duplicate_themes(apps, schema_editor):
+    # Themes with the same name already shared one index directory, so their
+    # documents and jobs are moved to the oldest theme before the name is unique
+    DocThemes = apps.get_model('chatbot', 'DocThemes')
+    Docs = apps.get_model('chatbot', 'Docs')
+    IndexingJob = apps.get_model('chatbot', 'IndexingJob')
+
+    kept = {}
+    for theme in DocThemes.objects.order_by('id'):
+        if theme.theme not in kept:
+            kept[theme.theme] = theme.id
+            continue
+        Docs.objects.filter(theme_id=theme.id).update(theme_id=kept[theme.theme])
+        IndexingJob.objects.filter(theme_id=theme.id).update(theme_id=kept[theme.theme])
+        theme.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_indexingjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_themes, migrations.RunPython.noop),
+    ]
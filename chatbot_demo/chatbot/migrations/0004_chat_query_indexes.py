@@ -0,0 +1,26 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_merge_duplicate_themes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='docthemes',
+            name='theme',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'created_at'], name='chatmessage_session_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='docs',
+            index=models.Index(condition=models.Q(('faiss_loaded', False)), fields=['theme'], name='docs_pending_theme_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='docthemes',
+            name='ef_search',
+            field=models.PositiveIntegerField(default=64, help_text='HNSW candidates explored per query'),
+        ),
+        migrations.AddField(
+            model_name='docthemes',
+            name='hnsw_m',
+            field=models.PositiveIntegerField(default=32, help_text='HNSW neighbours per node'),
+        ),
+        migrations.AddField(
+            model_name='docthemes',
+            name='index_type',
+            field=models.CharField(choices=[('flat', 'Flat (exact)'), ('ivf', 'IVF'), ('hnsw', 'HNSW')], default='flat', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='docthemes',
+            name='nlist',
+            field=models.PositiveIntegerField(blank=True, help_text='IVF lists; empty picks about 4*sqrt(vectors)', null=True),
+        ),
+        migrations.AddField(
+            model_name='docthemes',
+            name='nprobe',
+            field=models.PositiveIntegerField(default=8, help_text='IVF lists scanned per query'),
+        ),
+    ]
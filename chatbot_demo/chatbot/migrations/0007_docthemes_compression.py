@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_docthemes_index_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='docthemes',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'None (float32)'), ('sq8', 'SQ8 (1 byte per dimension)'), ('fp16', 'fp16 (2 bytes per dimension)'), ('pq', 'Product quantization')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='docthemes',
+            name='pq_m',
+            field=models.PositiveIntegerField(blank=True, help_text='PQ bytes per vector; empty picks dimension / 16', null=True),
+        ),
+        migrations.AddField(
+            model_name='docthemes',
+            name='rerank_factor',
+            field=models.PositiveIntegerField(default=0, help_text='Re-rank k * this many compressed candidates against exact vectors kept on disk; 0 disables'),
+        ),
+    ]
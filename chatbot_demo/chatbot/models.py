@@ -2,8 +2,38 @@ from django.contrib.auth.models import User
 from django.db import models
 
 class DocThemes(models.Model):
+    FLAT = 'flat'
+    IVF = 'ivf'
+    HNSW = 'hnsw'
+    INDEX_TYPE_CHOICES = [
+        (FLAT, 'Flat (exact)'),
+        (IVF, 'IVF'),
+        (HNSW, 'HNSW'),
+    ]
+    NO_COMPRESSION = ''
+    SQ8 = 'sq8'
+    FP16 = 'fp16'
+    PQ = 'pq'
+    COMPRESSION_CHOICES = [
+        (NO_COMPRESSION, 'None (float32)'),
+        (SQ8, 'SQ8 (1 byte per dimension)'),
+        (FP16, 'fp16 (2 bytes per dimension)'),
+        (PQ, 'Product quantization'),
+    ]
+
     id = models.AutoField(primary_key=True)
-    theme = models.CharField(max_length=255, null=False, blank=False)
+    theme = models.CharField(max_length=255, null=False, blank=False, unique=True)
+    # FAISS index built for the theme; a new type applies from the next rebuild
+    index_type = models.CharField(max_length=10, choices=INDEX_TYPE_CHOICES, default=FLAT)
+    nlist = models.PositiveIntegerField(null=True, blank=True, help_text='IVF lists; empty picks about 4*sqrt(vectors)')
+    nprobe = models.PositiveIntegerField(default=8, help_text='IVF lists scanned per query')
+    hnsw_m = models.PositiveIntegerField(default=32, help_text='HNSW neighbours per node')
+    ef_search = models.PositiveIntegerField(default=64, help_text='HNSW candidates explored per query')
+    compression = models.CharField(max_length=10, choices=COMPRESSION_CHOICES, default=NO_COMPRESSION, blank=True)
+    pq_m = models.PositiveIntegerField(null=True, blank=True, help_text='PQ bytes per vector; empty picks dimension / 16')
+    rerank_factor = models.PositiveIntegerField(
+        default=0, help_text='Re-rank k * this many compressed candidates against exact vectors kept on disk; 0 disables'
+    )
 
 class PartitonPypes(models.Model):
     id = models.AutoField(primary_key=True)
@@ -18,6 +48,12 @@ class Docs(models.Model):
     theme = models.ForeignKey(DocThemes, on_delete=models.PROTECT)
     partition = models.ForeignKey(PartitonPypes, on_delete=models.PROTECT) # TODO: In case of implement different partition ratios
     faiss_loaded = models.BooleanField(default=False, null=False, blank=False)
+
+    class Meta:
+        indexes = [
+            # Pending documents of a theme, read by every indexing run
+            models.Index(fields=['theme'], condition=models.Q(faiss_loaded=False), name='docs_pending_theme_idx'),
+        ]
     
     def __str__(self):
         return self.title or self.file.name
@@ -27,10 +63,48 @@ class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Rolling summary of the turns up to and including message summary_until
+    summary = models.TextField(blank=True, default='')
+    summary_until = models.IntegerField(default=0)
 
 class ChatMessage(models.Model):
     id = models.AutoField(primary_key=True)
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE)
     message = models.TextField()
     response = models.TextField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Recent history of a session, read by every chat request in id order
+            # (the order of the summary watermark)
+            models.Index(fields=['session', 'id'], name='chatmessage_session_id_idx'),
+        ]
+
+class IndexingJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    theme = models.ForeignKey(DocThemes, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    docs_total = models.IntegerField(default=0)
+    docs_done = models.IntegerField(default=0)
+    file_names = models.JSONField(default=list, blank=True)
+    error = models.TextField(null=True, blank=True)
+    worker = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Indexing job {self.id} ({self.status})"
@@ -0,0 +1,50 @@
+import base64
+import json
+
+# Keyset (cursor) pagination on id, which follows creation order. Each page is
+# a single range query on the primary key (or the (session, id) index of a
+# session's messages), however deep the client has paged, unlike OFFSET
+# pagination.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row.id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(position, list) or len(position) != 1 or not isinstance(position[0], int):
+        raise ValueError("Invalid cursor.")
+    return position[0]
+
+
+def parse_page_size(value):
+    if value in (None, ""):
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise ValueError("page_size must be an integer.")
+    if page_size < 1:
+        raise ValueError("page_size must be positive.")
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    # Return (rows, next_cursor); next_cursor is None on the last page
+    queryset = queryset.order_by('id')
+    if cursor:
+        queryset = queryset.filter(id__gt=decode_cursor(cursor))
+
+    # Fetch one extra row to know whether another page follows
+    rows = list(queryset[:page_size + 1])
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
@@ -1,14 +1,32 @@
 from rest_framework import serializers
-from .models import ChatMessage
+from chatbot_demo.settings import CHAT_MAX_THEMES
+from .models import ChatMessage, IndexingJob
 
 
 class ChatRequestSerializer(serializers.Serializer):
     session_id = serializers.IntegerField(required=True)
-    doc_theme_name = serializers.CharField(max_length=255, required=True)
-    max_context_messages = serializers.IntegerField(required=False)
+    doc_theme_name = serializers.ListField(
+        child=serializers.CharField(max_length=255), required=True, min_length=1, max_length=CHAT_MAX_THEMES
+    )
+    max_context_messages = serializers.IntegerField(required=False, default=10)
     question = serializers.CharField(required=True)
+    stream = serializers.BooleanField(required=False, default=False)
+
+class MessagesExportSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(required=False)
+    session_id = serializers.IntegerField(required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
 
 class ChatMessagesSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMessage
         fields = ['id', 'session', 'created_at', 'message', 'response']
+
+class IndexingJobSerializer(serializers.ModelSerializer):
+    theme = serializers.CharField(source='theme.theme', read_only=True)
+
+    class Meta:
+        model = IndexingJob
+        fields = ['id', 'theme', 'status', 'docs_total', 'docs_done', 'file_names', 'error',
+                  'worker', 'created_at', 'started_at', 'finished_at']
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, pre_save
+from django.dispatch import receiver
+
+from .jobs import enqueue_indexing_job
+from .models import DocThemes, Docs
+
+# A deleted or replaced document keeps its chunks in the theme index until the
+# next indexing run of the theme removes them (see generate_faiss), so a run is
+# queued as soon as the change is committed.
+
+
+def enqueue_after_commit(theme_id):
+    def enqueue():
+        theme = DocThemes.objects.filter(id=theme_id).first()
+        if theme is not None:
+            enqueue_indexing_job(theme)
+    transaction.on_commit(enqueue)
+
+
+@receiver(pre_save, sender=Docs)
+def reindex_replaced_doc(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    previous = Docs.objects.filter(pk=instance.pk).values('file', 'theme_id', 'faiss_loaded').first()
+    if previous is None or not previous['faiss_loaded']:
+        return
+    if previous['file'] != instance.file.name or previous['theme_id'] != instance.theme_id:
+        # The old chunks are replaced by those of the new file on the next run
+        instance.faiss_loaded = False
+        enqueue_after_commit(previous['theme_id'])
+        if previous['theme_id'] != instance.theme_id:
+            enqueue_after_commit(instance.theme_id)
+
+
+@receiver(post_delete, sender=Docs)
+def remove_deleted_doc(sender, instance, **kwargs):
+    enqueue_after_commit(instance.theme_id)
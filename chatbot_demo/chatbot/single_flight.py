@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from .metrics import COALESCED_CALLS
+
+
+class SingleFlight:
+    # Coalesces identical concurrent calls: the first caller of a key runs the
+    # call and every caller arriving while it is in flight waits for the same
+    # result (or exception) instead of starting its own. Nothing is kept once
+    # the call returns. Sync and async callers of a key share one call.
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        # (future of the call, True for the caller that has to run it)
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                COALESCED_CALLS.inc(call=self.name)
+                return future, False
+            future = self._calls[key] = Future()
+            # A running future cannot be cancelled by a waiter giving up
+            future.set_running_or_notify_cancel()
+            return future, True
+
+    def _forget(self, key):
+        with self._lock:
+            del self._calls[key]
+
+    def do(self, key, fn, *args):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result
+
+    async def ado(self, key, fn, *args):
+        future, leader = self._join(key)
+        if leader:
+            # The call runs in its own task, so the others still get its result
+            # when the request that started it is cancelled (client disconnect)
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks.add(task)
+            task.add_done_callback(lambda task: self._settle(key, future, task))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _settle(self, key, future, task):
+        self._tasks.discard(task)
+        self._forget(key)
+        if task.cancelled():
+            future.set_exception(RuntimeError(f"{self.name} call was cancelled"))
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
@@ -1,3 +1,1185 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import faiss
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from . import faiss_io, langchain_bot
+from .answer_cache import SemanticAnswerCache
+from .benchmarks import SlowFakeChatModel, SlowFakeEmbeddings, compare_to_baseline, measure_startup
+from .embedding_cache import EmbeddingStore, QueryEmbeddingCache
+from .faiss_io import RerankedIndex
+from .index_cache import FaissIndexCache
+from .jobs import (
+    ThemeBusy, claim_next_job, enqueue_indexing_job, fail_stale_jobs, hold_theme, run_indexing_job, touch_heartbeat
+)
+from .memory import select_context
+from .models import ChatMessage, ChatSession, Docs, DocThemes, IndexingJob, PartitonPypes
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    # Deterministic stand-in for OpenAIEmbeddings that records every text it embeds
+    embedded_texts: list = []
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.embedded_texts.append(text)
+        return super().embed_query(text)
+
+
+class BotPatchMixin:
+    def patch_bot(self, **values):
+        # Replace langchain_bot module attributes for the duration of the test
+        for name, value in values.items():
+            patcher = mock.patch.object(langchain_bot, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class FaissIndexCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.loads = []
+
+    def make_index_dir(self, name):
+        doc_path = os.path.join(self.tmp.name, name)
+        os.makedirs(doc_path)
+        for file_name in ("index.faiss", "index.pkl"):
+            with open(os.path.join(doc_path, file_name), "w") as f:
+                f.write(name)
+        return doc_path
+
+    def loader(self, doc_path):
+        self.loads.append(doc_path)
+        return object()
+
+    def test_hit_after_first_load(self):
+        cache = FaissIndexCache(max_size=2)
+        doc_path = self.make_index_dir("a")
+
+        first = cache.get("a", doc_path, self.loader)
+        second = cache.get("a", doc_path, self.loader)
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.loads), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_least_recently_used_theme_is_evicted(self):
+        cache = FaissIndexCache(max_size=2)
+        paths = {name: self.make_index_dir(name) for name in ("a", "b", "c")}
+
+        cache.get("a", paths["a"], self.loader)
+        cache.get("b", paths["b"], self.loader)
+        cache.get("a", paths["a"], self.loader)
+        cache.get("c", paths["c"], self.loader)
+        cache.get("b", paths["b"], self.loader)
+
+        self.assertEqual(self.loads, [paths["a"], paths["b"], paths["c"], paths["b"]])
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_stats_endpoints(self):
+        cache_stats = self.client.get("/api/cache-stats/").json()
+        index_cache_stats = self.client.get("/api/index-cache/").json()
+
+        self.assertEqual(set(cache_stats), {"index_cache", "query_embedding_cache", "answer_cache"})
+        self.assertEqual(set(index_cache_stats), set(cache_stats["index_cache"]))
+
+    def test_rewritten_index_is_reloaded(self):
+        cache = FaissIndexCache(max_size=2)
+        doc_path = self.make_index_dir("a")
+        cache.get("a", doc_path, self.loader)
+
+        index_file = os.path.join(doc_path, "index.faiss")
+        with open(index_file, "w") as f:
+            f.write("a rebuilt index")
+        stat = os.stat(index_file)
+        os.utime(index_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        cache.get("a", doc_path, self.loader)
+
+        self.assertEqual(len(self.loads), 2)
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+
+class QueryEmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.embeddings = CountingEmbeddings(size=8, embedded_texts=[])
+
+    def test_repeated_question_is_embedded_once(self):
+        cache = QueryEmbeddingCache(max_size=4, ttl=60)
+
+        first = cache.embed_query(self.embeddings, "What is the refund policy?")
+        second = cache.embed_query(self.embeddings, "  what is the   refund policy? ")
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.embeddings.embedded_texts, ["What is the refund policy?"])
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_expired_entries_are_embedded_again(self):
+        cache = QueryEmbeddingCache(max_size=4, ttl=60)
+        with mock.patch("chatbot.embedding_cache.time.monotonic", return_value=0):
+            cache.embed_query(self.embeddings, "hello")
+        with mock.patch("chatbot.embedding_cache.time.monotonic", return_value=61):
+            cache.embed_query(self.embeddings, "hello")
+
+        self.assertEqual(len(self.embeddings.embedded_texts), 2)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_django_cache_is_shared_between_workers(self):
+        worker_a = QueryEmbeddingCache(max_size=4, ttl=60, cache_alias="default")
+        worker_b = QueryEmbeddingCache(max_size=4, ttl=60, cache_alias="default")
+
+        vector = worker_a.embed_query(self.embeddings, "shared question")
+        shared = worker_b.embed_query(self.embeddings, "shared question")
+
+        self.assertEqual(len(self.embeddings.embedded_texts), 1)
+        self.assertEqual(len(shared), len(vector))
+
+
+class SingleFlightTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        user = User.objects.create(username="crowd")
+        self.sessions = [ChatSession.objects.create(user=user) for _ in range(3)]
+
+        async def no_docs(question, index_name):
+            return []
+
+        self.patch_bot(aquery_faiss_index=no_docs)
+
+    def test_concurrent_misses_share_one_embedding_call(self):
+        embeddings = SlowFakeEmbeddings(size=8, latency=0.2)
+        cache = QueryEmbeddingCache(max_size=4, ttl=60)
+
+        with mock.patch.object(SlowFakeEmbeddings, "embed_query", autospec=True,
+                               side_effect=SlowFakeEmbeddings.embed_query) as embed_query:
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                vectors = list(executor.map(
+                    lambda question: cache.embed_query(embeddings, question), ["Refunds?", "refunds?", "Refunds? "]
+                ))
+
+        self.assertEqual(embed_query.call_count, 1)
+        self.assertEqual(vectors[0], vectors[2])
+
+    async def test_identical_questions_share_one_completion(self):
+        llm = SlowFakeChatModel(latency=0.2, response="Refunds take five days.")
+        with mock.patch.object(langchain_bot, "llm", llm):
+            answers = await asyncio.gather(*[
+                langchain_bot.aget_answer_from_index_with_memory(question, "manuals", session.id)
+                for question, session in zip(["Refunds?", "refunds?", "Refunds?"], self.sessions)
+            ])
+
+        self.assertEqual(answers, ["Refunds take five days."] * 3)
+        self.assertEqual(llm.tracker.calls, 1)
+        # Every chat still records its own turn
+        self.assertEqual(await ChatMessage.objects.filter(session__in=self.sessions).acount(), 3)
+
+    async def test_coalescing_can_be_turned_off(self):
+        llm = SlowFakeChatModel(latency=0.05)
+        with mock.patch.object(langchain_bot, "llm", llm), \
+                mock.patch.object(langchain_bot, "CHAT_COALESCE_ANSWERS", False):
+            await asyncio.gather(*[
+                langchain_bot.aget_answer_from_index_with_memory("Refunds?", "manuals", session.id)
+                for session in self.sessions
+            ])
+
+        self.assertEqual(llm.tracker.calls, 3)
+
+
+class SemanticAnswerCacheTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        self.doc_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.doc_path)
+        self.doc_paths = [("manuals", self.doc_path)]
+        user = User.objects.create(username="newcomer")
+        self.sessions = [ChatSession.objects.create(user=user) for _ in range(3)]
+        self.llm = FakeListChatModel(responses=["Refunds take five days.", "Returns are free."])
+        # An index file for the theme to exist; its searches are replaced
+        os.makedirs(os.path.join(self.doc_path, "db", "manuals"))
+        open(os.path.join(self.doc_path, "db", "manuals", "index.faiss"), "wb").close()
+        self.search_themes = mock.Mock(return_value=[])
+        self.asearch_themes = mock.AsyncMock(return_value=[])
+        self.patch_bot(search_themes=self.search_themes, asearch_themes=self.asearch_themes, llm=self.llm,
+                       FAISS_INDEX_FILE=os.path.join(self.doc_path, "db"),
+                       embeddings=DeterministicFakeEmbedding(size=8),
+                       query_embedding_cache=QueryEmbeddingCache(),
+                       answer_cache=SemanticAnswerCache(threshold=0.95, ttl=60),
+                       SEMANTIC_ANSWER_CACHE=True)
+
+    def test_similar_question_is_answered_from_the_cache(self):
+        cache = SemanticAnswerCache(threshold=0.95, ttl=60)
+        cache.put(self.doc_paths, [1.0, 0.0, 0.1], "Refunds take five days.")
+
+        self.assertEqual(cache.get(self.doc_paths, [0.9, 0.0, 0.1]), "Refunds take five days.")
+        self.assertIsNone(cache.get(self.doc_paths, [0.0, 1.0, 0.0]))
+        self.assertIsNone(cache.get([("contracts", self.doc_path)], [1.0, 0.0, 0.1]))
+
+    def test_entries_expire_and_follow_the_index_on_disk(self):
+        cache = SemanticAnswerCache(threshold=0.95, ttl=60)
+        with mock.patch("chatbot.answer_cache.time.monotonic", return_value=0):
+            cache.put(self.doc_paths, [1.0, 0.0], "old")
+        with mock.patch("chatbot.answer_cache.time.monotonic", return_value=61):
+            self.assertIsNone(cache.get(self.doc_paths, [1.0, 0.0]))
+
+        cache.put(self.doc_paths, [1.0, 0.0], "current")
+        with open(os.path.join(self.doc_path, "index.faiss"), "wb") as f:
+            f.write(b"rebuilt")
+
+        self.assertIsNone(cache.get(self.doc_paths, [1.0, 0.0]))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+    def test_only_questions_without_context_use_the_cache(self):
+        first = langchain_bot.get_answer_from_index_with_memory("Refunds?", "manuals", self.sessions[0].id)
+        second = langchain_bot.get_answer_from_index_with_memory("  refunds? ", "manuals", self.sessions[1].id)
+        # The first session now has a turn, so its next question goes to the LLM
+        follow_up = langchain_bot.get_answer_from_index_with_memory("Refunds?", "manuals", self.sessions[0].id)
+
+        self.assertEqual([first, second, follow_up], ["Refunds take five days.", "Refunds take five days.", "Returns are free."])
+        self.assertEqual(ChatMessage.objects.filter(session__in=self.sessions).count(), 3)
+        # The hit skipped the search, and every question was embedded (or read) once
+        self.assertEqual(self.search_themes.call_count, 2)
+        self.assertEqual(langchain_bot.query_embedding_cache.stats()["hits"], 2)
+
+    async def test_async_hit_skips_the_search(self):
+        for session in self.sessions[:2]:
+            answer = await langchain_bot.aget_answer_from_index_with_memory("Refunds?", "manuals", session.id)
+
+        self.assertEqual(answer, "Refunds take five days.")
+        self.assertEqual(self.asearch_themes.await_count, 1)
+        self.assertEqual(langchain_bot.answer_cache.stats()["hits"], 1)
+
+    def test_invalidated_theme_is_answered_again(self):
+        langchain_bot.get_answer_from_index_with_memory("Refunds?", "manuals", self.sessions[0].id)
+        langchain_bot.answer_cache.invalidate("manuals")
+
+        answer = langchain_bot.get_answer_from_index_with_memory("Refunds?", "manuals", self.sessions[1].id)
+
+        self.assertEqual(answer, "Returns are free.")
+
+
+class GenerateFaissTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.index_root = os.path.join(self.tmp.name, "db")
+        os.makedirs(os.path.join(self.tmp.name, "faiss_data", "docs"))
+
+        self.embeddings = CountingEmbeddings(size=16, embedded_texts=[])
+        embedding_store = EmbeddingStore(os.path.join(self.tmp.name, "embedding_cache.sqlite3"))
+        self.patch_bot(BASE_DIR=self.tmp.name, FAISS_INDEX_FILE=self.index_root,
+                       embeddings=self.embeddings, embedding_store=embedding_store)
+
+        self.theme = DocThemes.objects.create(theme="manuals")
+        self.partition = PartitonPypes.objects.create(type="default")
+
+    def add_doc(self, file_name, content):
+        relative_path = f"faiss_data/docs/{file_name}"
+        with open(os.path.join(self.tmp.name, relative_path), "w", encoding="utf-8") as f:
+            f.write(content)
+        return Docs.objects.create(file=relative_path, theme=self.theme, partition=self.partition)
+
+    def index_size(self):
+        return faiss.read_index(os.path.join(self.index_root, "manuals", "index.faiss")).ntotal
+
+    def test_each_chunk_is_embedded_once_and_saved_once(self):
+        texts = {f"doc{i}.txt": " ".join(f"word{i}_{n}" for n in range(400)) for i in range(4)}
+        docs = [self.add_doc(name, text) for name, text in texts.items()]
+        expected_chunks = sum(len(langchain_bot.split_into_chunks(text)) for text in texts.values())
+
+        with mock.patch("chatbot.faiss_io.save_vector_store", wraps=faiss_io.save_vector_store) as save_vector_store:
+            file_names = langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        self.assertEqual(len(self.embeddings.embedded_texts), expected_chunks)
+        self.assertEqual(save_vector_store.call_count, 1)
+        self.assertEqual(self.index_size(), expected_chunks)
+        self.assertEqual(file_names, [doc.file.name for doc in docs])
+        self.assertFalse(Docs.objects.filter(faiss_loaded=False).exists())
+
+    def test_run_that_lost_its_theme_saves_nothing(self):
+        self.add_doc("doc.txt", "alpha " * 300)
+
+        with self.assertRaises(RuntimeError):
+            langchain_bot.generate_faiss(self.theme.id, self.theme.theme, may_persist=lambda: False)
+
+        self.assertFalse(os.path.exists(os.path.join(self.index_root, "manuals", "index.faiss")))
+        self.assertFalse(Docs.objects.filter(faiss_loaded=True).exists())
+
+    def test_new_documents_are_appended_to_existing_index(self):
+        self.add_doc("first.txt", "alpha " * 300)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        first_run_chunks = len(self.embeddings.embedded_texts)
+
+        self.add_doc("second.txt", "beta " * 300)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        second_run_texts = self.embeddings.embedded_texts[first_run_chunks:]
+        self.assertTrue(second_run_texts)
+        self.assertTrue(all("beta" in text for text in second_run_texts))
+        self.assertEqual(self.index_size(), len(self.embeddings.embedded_texts))
+
+    def test_unreadable_documents_stay_pending(self):
+        good = self.add_doc("good.txt", "gamma " * 50)
+        bad = self.add_doc("bad.unknownext", "not a supported type")
+
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertTrue(good.faiss_loaded)
+        self.assertFalse(bad.faiss_loaded)
+
+    def test_parallel_extraction_indexes_every_document(self):
+        docs = [self.add_doc(f"doc{i}.txt", f"epsilon{i} " * 200) for i in range(3)]
+        self.add_doc("bad.unknownext", "not a supported type")
+
+        file_names = langchain_bot.generate_faiss(self.theme.id, self.theme.theme, workers=2)
+
+        self.assertCountEqual(file_names, [doc.file.name for doc in docs])
+        self.assertEqual(self.index_size(), len(self.embeddings.embedded_texts))
+        self.assertEqual(Docs.objects.filter(faiss_loaded=False).count(), 1)
+
+    def test_cached_chunks_are_not_embedded_again(self):
+        self.add_doc("contract.txt", "delta " * 300)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        embedded = len(self.embeddings.embedded_texts)
+
+        # The same file filed under a second theme only reads the cache
+        other_theme = DocThemes.objects.create(theme="contracts")
+        Docs.objects.create(file="faiss_data/docs/contract.txt", theme=other_theme, partition=self.partition)
+        langchain_bot.generate_faiss(other_theme.id, other_theme.theme)
+
+        self.assertEqual(len(self.embeddings.embedded_texts), embedded)
+        other_index = faiss.read_index(os.path.join(self.index_root, "contracts", "index.faiss"))
+        self.assertEqual(other_index.ntotal, self.index_size())
+
+    def test_chunks_are_stored_by_vector_id_without_a_pickle(self):
+        self.add_doc("first.txt", "kappa " * 300)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        self.add_doc("second.txt", " ".join(f"lambda{n}" for n in range(300)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        doc_path = os.path.join(self.index_root, "manuals")
+        self.assertFalse(os.path.exists(os.path.join(doc_path, "index.pkl")))
+        chunk = self.embeddings.embedded_texts[-1]
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+
+    def test_pickled_docstore_is_converted(self):
+        texts = [f"legacy chunk {i}" for i in range(30)]
+        doc_path = os.path.join(self.index_root, "manuals")
+        FAISS.from_texts(texts, self.embeddings, metadatas=[{"page": i} for i in range(30)]).save_local(doc_path)
+        before = langchain_bot.query_faiss_index("legacy chunk 12", "manuals")
+
+        with mock.patch("chatbot.management.commands.convert_docstore.FAISS_INDEX_FILE", self.index_root):
+            call_command("convert_docstore", "manuals", stdout=io.StringIO())
+
+        self.assertFalse(os.path.exists(os.path.join(doc_path, "index.pkl")))
+        after = langchain_bot.query_faiss_index("legacy chunk 12", "manuals")
+        self.assertEqual([(doc.page_content, doc.metadata) for doc in after],
+                         [(doc.page_content, doc.metadata) for doc in before])
+
+    def test_rebuilt_pickled_theme_can_be_indexed_again(self):
+        texts = [f"legacy chunk {i}" for i in range(30)]
+        doc_path = os.path.join(self.index_root, "manuals")
+        FAISS.from_texts(texts, self.embeddings).save_local(doc_path)
+
+        # A legacy Flat index has no vector ids, so it is always rebuilt
+        with mock.patch("chatbot.management.commands.rebuild_faiss_index.FAISS_INDEX_FILE", self.index_root):
+            call_command("rebuild_faiss_index", "manuals", stdout=io.StringIO())
+        self.add_doc("new.txt", " ".join(f"omicron{n}" for n in range(300)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        self.assertFalse(os.path.exists(os.path.join(doc_path, "index.pkl")))
+        self.assertTrue(faiss_io.has_vector_ids(faiss.read_index(os.path.join(doc_path, "index.faiss"))))
+        chunk = self.embeddings.embedded_texts[-1]
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+        self.assertEqual(langchain_bot.query_faiss_index("legacy chunk 12", "manuals")[0].page_content,
+                         "legacy chunk 12")
+
+    def test_pickled_theme_with_vector_ids_can_be_indexed(self):
+        # As left by rebuild_faiss_index before it converted pickled docstores
+        texts = [f"legacy chunk {i}" for i in range(30)]
+        doc_path = os.path.join(self.index_root, "manuals")
+        FAISS.from_texts(texts, self.embeddings).save_local(doc_path)
+        index_path = os.path.join(doc_path, "index.faiss")
+        faiss.write_index(faiss_io.rebuild_index(faiss.read_index(index_path), "Flat", 100), index_path)
+
+        self.add_doc("new.txt", " ".join(f"pi{n}" for n in range(300)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        index = faiss.read_index(index_path)
+        self.assertEqual(sorted(faiss_io.vector_ids(index)), list(range(index.ntotal)))
+        chunk = self.embeddings.embedded_texts[-1]
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+        self.assertEqual(langchain_bot.query_faiss_index("legacy chunk 3", "manuals")[0].page_content,
+                         "legacy chunk 3")
+
+    def test_ivf_theme_is_trained_and_searched_with_its_nprobe(self):
+        DocThemes.objects.filter(id=self.theme.id).update(index_type=DocThemes.IVF, nprobe=3)
+        self.add_doc("first.txt", " ".join(f"zeta{n}" for n in range(6000)))
+        self.add_doc("second.txt", " ".join(f"eta{n}" for n in range(6000)))
+
+        # The index is trained once the sample is reached; later chunks are appended
+        with mock.patch.object(langchain_bot, "FAISS_TRAINING_SAMPLE_SIZE", 40):
+            langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        vector_store = langchain_bot.load_faiss_index(os.path.join(self.index_root, "manuals"))
+        ivf = faiss.extract_index_ivf(vector_store.index)
+        self.assertEqual(ivf.nprobe, 3)
+        self.assertEqual(vector_store.index.ntotal, len(self.embeddings.embedded_texts))
+
+    def test_compressed_theme_reranks_against_exact_vectors(self):
+        DocThemes.objects.filter(id=self.theme.id).update(compression=DocThemes.SQ8, rerank_factor=3)
+        self.add_doc("manual.txt", " ".join(f"iota{n}" for n in range(3000)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        chunk = self.embeddings.embedded_texts[4]
+
+        doc_path = os.path.join(self.index_root, "manuals")
+        self.assertIsInstance(faiss_io.base_index(faiss.read_index(os.path.join(doc_path, "index.faiss"))),
+                              faiss.IndexScalarQuantizer)
+        vector_store = langchain_bot.load_faiss_index(doc_path)
+        self.assertIsInstance(vector_store.index, RerankedIndex)
+        self.assertEqual(vector_store.index.exact_vectors.shape, (len(self.embeddings.embedded_texts), 16))
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+
+    def test_rebuild_switches_layout_and_keeps_results(self):
+        self.add_doc("manual.txt", " ".join(f"theta{n}" for n in range(3000)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        chunk = self.embeddings.embedded_texts[7]
+
+        DocThemes.objects.filter(id=self.theme.id).update(index_type=DocThemes.HNSW, ef_search=32)
+        with mock.patch("chatbot.management.commands.rebuild_faiss_index.FAISS_INDEX_FILE", self.index_root):
+            call_command("rebuild_faiss_index", "manuals", stdout=io.StringIO())
+
+        index = faiss.read_index(os.path.join(self.index_root, "manuals", "index.faiss"))
+        self.assertIsInstance(faiss_io.base_index(index), faiss.IndexHNSW)
+        self.assertEqual(index.ntotal, len(self.embeddings.embedded_texts))
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+
+    def test_deleted_document_is_removed_from_the_index(self):
+        kept = self.add_doc("kept.txt", " ".join(f"mu{n}" for n in range(300)))
+        deleted = self.add_doc("deleted.txt", " ".join(f"nu{n}" for n in range(300)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        deleted_chunks = [text for text in self.embeddings.embedded_texts if text.startswith("nu")]
+        total = self.index_size()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+        self.assertTrue(IndexingJob.objects.filter(theme=self.theme, status=IndexingJob.QUEUED).exists())
+        embedded = len(self.embeddings.embedded_texts)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        self.assertEqual(len(self.embeddings.embedded_texts), embedded)
+        self.assertEqual(self.index_size(), total - len(deleted_chunks))
+        docs = langchain_bot.query_faiss_index(deleted_chunks[0], "manuals", k=20)
+        self.assertFalse(any(doc.page_content.startswith("nu") for doc in docs))
+        chunk_store = faiss_io.ChunkStore(os.path.join(self.index_root, "manuals", "chunks.sqlite3"))
+        self.assertEqual(chunk_store.doc_ids(), [kept.id])
+
+    def test_replaced_document_only_embeds_its_own_chunks(self):
+        self.add_doc("kept.txt", " ".join(f"xi{n}" for n in range(300)))
+        replaced = self.add_doc("replaced.txt", " ".join(f"omicron{n}" for n in range(300)))
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        replaced_chunks = sum(text.startswith("omicron") for text in self.embeddings.embedded_texts)
+        total = self.index_size()
+        embedded = len(self.embeddings.embedded_texts)
+
+        new_file = self.add_doc("replacement.txt", " ".join(f"pi{n}" for n in range(300))).file
+        replaced.refresh_from_db()
+        replaced.file = new_file
+        replaced.save()
+        self.assertFalse(replaced.faiss_loaded)
+        Docs.objects.exclude(id=replaced.id).filter(file=new_file.name).delete()
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        new_texts = self.embeddings.embedded_texts[embedded:]
+        self.assertTrue(new_texts)
+        self.assertTrue(all(text.startswith("pi") for text in new_texts))
+        self.assertEqual(self.index_size(), total - replaced_chunks + len(new_texts))
+        docs = langchain_bot.query_faiss_index("omicron5", "manuals", k=20)
+        self.assertFalse(any(doc.page_content.startswith("omicron") for doc in docs))
+
+    def test_hnsw_removals_are_skipped_then_compacted(self):
+        DocThemes.objects.filter(id=self.theme.id).update(index_type=DocThemes.HNSW)
+        docs = [self.add_doc(f"doc{i}.txt", " ".join(f"rho{i}_{n}" for n in range(300))) for i in range(6)]
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        doc_path = os.path.join(self.index_root, "manuals")
+        total = self.index_size()
+
+        # One document of six stays below the compaction threshold
+        docs[0].delete()
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        tombstones = faiss_io.read_tombstones(doc_path)
+        self.assertTrue(len(tombstones))
+        self.assertEqual(self.index_size(), total)
+        docs_found = langchain_bot.query_faiss_index("rho0_5", "manuals", k=20)
+        self.assertFalse(any(doc.page_content.startswith("rho0_") for doc in docs_found))
+
+        docs[1].delete()
+        docs[2].delete()
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        self.assertEqual(len(faiss_io.read_tombstones(doc_path)), 0)
+        self.assertEqual(self.index_size(), total * 3 // 6)
+        chunk = [text for text in self.embeddings.embedded_texts if text.startswith("rho4_")][0]
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+
+    def test_duplicate_chunks_are_embedded_once_and_kept_while_referenced(self):
+        text = " ".join(f"sigma{n}" for n in range(300))
+        original = self.add_doc("contract_v1.txt", text)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        total = self.index_size()
+        embedded = len(self.embeddings.embedded_texts)
+
+        copy = self.add_doc("contract_v2.txt", text)
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        self.assertEqual(len(self.embeddings.embedded_texts), embedded)
+        self.assertEqual(self.index_size(), total)
+
+        # The chunks stay indexed for the copy when the original is deleted
+        chunk = self.embeddings.embedded_texts[0]
+        original.delete()
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        self.assertEqual(self.index_size(), total)
+        self.assertEqual(langchain_bot.query_faiss_index(chunk, "manuals")[0].page_content, chunk)
+
+        copy.delete()
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+        self.assertEqual(self.index_size(), 0)
+
+    def test_amended_chunk_is_embedded_by_default(self):
+        text = " ".join(f"clause{n}" for n in range(100))
+        self.add_doc("contract_v1.txt", text)
+        self.add_doc("contract_v2.txt", text.replace("clause60 ", "amended "))
+
+        langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        self.assertEqual(self.index_size(), 2)
+        self.assertTrue(any("amended" in text for text in self.embeddings.embedded_texts))
+
+    def test_near_duplicate_chunk_is_not_embedded_when_enabled(self):
+        text = " ".join(f"clause{n}" for n in range(100))
+        self.add_doc("contract_v1.txt", text)
+        self.add_doc("contract_v2.txt", text.replace("clause60 ", "amended "))
+        self.add_doc("other.txt", " ".join(f"term{n}" for n in range(100)))
+
+        with mock.patch.object(langchain_bot, "CHUNK_SIMHASH_DISTANCE", 3):
+            langchain_bot.generate_faiss(self.theme.id, self.theme.theme)
+
+        self.assertEqual(self.index_size(), 2)
+        self.assertFalse(any("amended" in text for text in self.embeddings.embedded_texts))
+
+
+class MultiThemeSearchTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.embeddings = CountingEmbeddings(size=16, embedded_texts=[])
+        self.texts = {
+            "manuals": [f"manual chunk {i}" for i in range(20)],
+            "contracts": [f"contract chunk {i}" for i in range(20)],
+        }
+        for theme, texts in self.texts.items():
+            FAISS.from_texts(texts, self.embeddings).save_local(os.path.join(tmp.name, theme))
+        self.embeddings.embedded_texts.clear()
+
+        self.patch_bot(FAISS_INDEX_FILE=tmp.name, embeddings=self.embeddings,
+                       index_cache=FaissIndexCache(max_size=4),
+                       query_embedding_cache=QueryEmbeddingCache(max_size=16))
+
+    def expected_top_k(self, query, k):
+        # Exact search over the union of both themes
+        vector_store = FAISS.from_texts(self.texts["manuals"] + self.texts["contracts"], self.embeddings)
+        return [doc.page_content for doc in vector_store.similarity_search(query, k=k)]
+
+    def test_themes_are_merged_into_one_top_k(self):
+        docs = langchain_bot.query_faiss_index("contract chunk 3", ["manuals", "contracts"], k=5)
+
+        self.assertEqual(self.embeddings.embedded_texts, ["contract chunk 3"])
+        self.assertEqual(docs[0].page_content, "contract chunk 3")
+        self.assertEqual([doc.page_content for doc in docs], self.expected_top_k("contract chunk 3", 5))
+
+    async def test_async_search_matches_sync_search(self):
+        docs = await langchain_bot.aquery_faiss_index("manual chunk 7", ["manuals", "contracts"])
+
+        self.assertEqual([doc.page_content for doc in docs], self.expected_top_k("manual chunk 7", 5))
+
+    def test_missing_theme_fails_before_searching(self):
+        with self.assertRaises(ValueError):
+            langchain_bot.query_faiss_index("manual chunk 1", ["manuals", "unknown"])
+
+        self.assertEqual(self.embeddings.embedded_texts, [])
+
+
+class MmapServingTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.doc_path = os.path.join(tmp.name, "manuals")
+        self.embeddings = CountingEmbeddings(size=16, embedded_texts=[])
+        FAISS.from_texts([f"manual chunk {i}" for i in range(30)], self.embeddings).save_local(self.doc_path)
+
+        self.patch_bot(FAISS_INDEX_FILE=tmp.name, embeddings=self.embeddings,
+                       index_cache=FaissIndexCache(max_size=4),
+                       query_embedding_cache=QueryEmbeddingCache(max_size=16),
+                       FAISS_INDEX_MMAP=True)
+
+    def search(self, vector_store, query):
+        vector = self.embeddings.embed_query(query)
+        return [(doc.page_content, score)
+                for doc, score in vector_store.similarity_search_with_score_by_vector(vector, k=5)]
+
+    def test_mmap_results_match_the_in_memory_index(self):
+        in_memory = faiss_io.read_faiss_index(self.doc_path, self.embeddings)
+        mapped = faiss_io.read_faiss_index(self.doc_path, self.embeddings, mmap=True)
+
+        self.assertTrue(os.path.exists(os.path.join(self.doc_path, faiss_io.MMAP_INDEX_FILE)))
+        self.assertIsNotNone(faiss.try_extract_index_ivf(mapped.index))
+        for query in ("manual chunk 4", "manual chunk 27", "something else"):
+            self.assertEqual(self.search(mapped, query), self.search(in_memory, query))
+
+    def test_served_results_match_the_in_memory_index(self):
+        docs = langchain_bot.query_faiss_index("manual chunk 12", "manuals", k=5)
+
+        in_memory = faiss_io.read_faiss_index(self.doc_path, self.embeddings)
+        self.assertEqual([doc.page_content for doc in docs],
+                         [content for content, _ in self.search(in_memory, "manual chunk 12")])
+
+    def test_rewritten_index_is_served_from_a_new_mmap_file(self):
+        langchain_bot.query_faiss_index("manual chunk 3", "manuals")
+        # Age the mmap copy so the rewrite is newer even on coarse-mtime filesystems
+        mmap_file = os.path.join(self.doc_path, faiss_io.MMAP_INDEX_FILE)
+        stat = os.stat(mmap_file)
+        os.utime(mmap_file, ns=(stat.st_atime_ns, stat.st_mtime_ns - 2_000_000_000))
+
+        FAISS.from_texts([f"contract chunk {i}" for i in range(30)], self.embeddings).save_local(self.doc_path)
+        docs = langchain_bot.query_faiss_index("contract chunk 3", "manuals")
+
+        self.assertEqual(docs[0].page_content, "contract chunk 3")
+        self.assertTrue(all(doc.page_content.startswith("contract") for doc in docs))
+        index_file = os.path.join(self.doc_path, "index.faiss")
+        self.assertGreaterEqual(os.path.getmtime(mmap_file), os.path.getmtime(index_file))
+
+    def test_only_flat_and_ivf_indexes_can_be_mapped(self):
+        index = faiss.IndexHNSWFlat(16, 8)
+        index.add(faiss.rand((5, 16)))
+
+        with self.assertRaises(ValueError):
+            faiss_io.to_mmap_layout(index)
+
+    def test_write_mmap_index_keeps_vector_ids(self):
+        self.assertTrue(faiss_io.write_mmap_index(self.doc_path))
+
+        index = faiss.read_index(os.path.join(self.doc_path, "index.faiss"))
+        mapped = faiss.read_index(os.path.join(self.doc_path, faiss_io.MMAP_INDEX_FILE), faiss_io.MMAP_IO_FLAGS)
+        query = index.reconstruct(17).reshape(1, -1)
+        self.assertEqual(mapped.search(query, 3)[1].tolist(), index.search(query, 3)[1].tolist())
+
+
+class ChatStreamTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        user = User.objects.create(username="reader")
+        self.session = ChatSession.objects.create(user=user)
+        self.patch_bot(query_faiss_index=lambda question, index_name: [],
+                       llm=FakeListChatModel(responses=["Refunds take five days."]))
+
+    def chat_url(self, session_id):
+        return (f"/api/chat/?session_id={session_id}&doc_theme_name=manuals"
+                "&question=How long do refunds take?&stream=1")
+
+    def test_tokens_are_streamed_and_message_is_saved(self):
+        response = self.client.post(self.chat_url(self.session.id))
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn("event: token", body)
+        self.assertIn('event: done\ndata: {"answer": "Refunds take five days."}', body)
+        message = ChatMessage.objects.get(session=self.session)
+        self.assertEqual(message.response, "Refunds take five days.")
+
+    def test_partial_answer_is_saved_when_client_disconnects(self):
+        response = self.client.post(self.chat_url(self.session.id))
+
+        next(iter(response.streaming_content))
+        response.close()
+
+        message = ChatMessage.objects.get(session=self.session)
+        self.assertTrue("Refunds take five days.".startswith(message.response))
+        self.assertNotEqual(message.response, "Refunds take five days.")
+
+    def test_repeated_theme_parameter_searches_every_theme(self):
+        with mock.patch.object(langchain_bot, "query_faiss_index", return_value=[]) as query_faiss_index:
+            response = self.client.post(
+                f"/api/chat/?session_id={self.session.id}&doc_theme_name=manuals&doc_theme_name=contracts&question=Refunds?"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        query_faiss_index.assert_called_once_with("Refunds?", ["manuals", "contracts"])
+
+    def test_unknown_session_is_not_found(self):
+        response = self.client.post(self.chat_url(self.session.id + 1))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ConversationMemoryTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        user = User.objects.create(username="talker")
+        self.session = ChatSession.objects.create(user=user)
+        for i in range(12):
+            ChatMessage.objects.create(session=self.session, message=f"question {i}", response=f"answer {i} " * 20)
+        self.patch_bot(query_faiss_index=lambda question, index_name: [])
+
+    def newest_first(self):
+        return list(ChatMessage.objects.filter(session=self.session).order_by('-created_at', '-id'))
+
+    def test_select_context_fits_the_token_budget(self):
+        recent, overflow = select_context(self.newest_first(), "", max_messages=10, token_budget=150)
+
+        self.assertEqual([m.message for m in recent], ["question 10", "question 11"])
+        self.assertEqual(len(overflow), 10)
+        self.assertEqual(overflow[0].message, "question 0")
+
+    def test_overflow_is_folded_into_the_session_summary_after_the_answer(self):
+        llm = FakeListChatModel(responses=["Ten answers so far.", "The user asked ten questions."])
+        summary_pool = mock.Mock()
+        with mock.patch.object(langchain_bot, "llm", llm), \
+                mock.patch.object(langchain_bot, "CHAT_HISTORY_TOKEN_BUDGET", 150), \
+                mock.patch.object(langchain_bot, "SUMMARY_FOLD_BATCH", 5), \
+                mock.patch.object(langchain_bot, "summary_pool", summary_pool):
+            answer = langchain_bot.get_answer_from_index_with_memory("And now?", "manuals", self.session.id)
+
+            # The answer is saved before the fold, which is left to the summary pool
+            self.assertEqual(answer, "Ten answers so far.")
+            self.assertEqual(self.session.chatmessage_set.count(), 13)
+            fold, *args = summary_pool.submit.call_args.args
+            with mock.patch.object(langchain_bot, "close_old_connections"):
+                fold(*args)
+
+            session, context_messages, _, _ = langchain_bot.prepare_answer_context(
+                "And then?", "manuals", self.session.id, max_context_messages=10
+            )
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "The user asked ten questions.")
+        self.assertEqual(self.session.summary_until, context_messages[0].id - 1)
+        self.assertEqual(session.summary, self.session.summary)
+
+        # The summary replaces the folded turns in the prompt
+        inputs = langchain_bot.answer_inputs("And now?", [], context_messages, session.summary)
+        self.assertTrue(inputs["message_context"].startswith("Summary of the earlier conversation: The user"))
+        self.assertNotIn("question 0", inputs["message_context"])
+
+        # Folded turns are not read again
+        self.assertEqual(len(langchain_bot.unsummarized_messages(self.session.id, 10)), 3)
+
+    def test_retrieval_overlaps_the_history_queries(self):
+        history_queried = threading.Event()
+
+        def retrieve(question, index_name):
+            # Only returns chunks if the history was read while retrieving
+            return ["chunk"] if history_queried.wait(timeout=5) else []
+
+        def record_query(execute, sql, params, many, context):
+            history_queried.set()
+            return execute(sql, params, many, context)
+
+        with mock.patch.object(langchain_bot, "query_faiss_index", retrieve), \
+                connection.execute_wrapper(record_query):
+            _, _, _, (retrieved_docs, _, _) = langchain_bot.prepare_answer_context("And now?", "manuals", self.session.id)
+
+        self.assertEqual(retrieved_docs, ["chunk"])
+
+    def test_turns_with_the_same_timestamp_follow_the_watermark_order(self):
+        ChatMessage.objects.filter(session=self.session).update(created_at=self.session.created_at)
+
+        ids = [message.id for message in langchain_bot.unsummarized_messages(self.session.id, 10)]
+
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_small_overflow_waits_for_a_full_batch(self):
+        summary_pool = mock.Mock()
+        with mock.patch.object(langchain_bot, "SUMMARY_FOLD_BATCH", 5), \
+                mock.patch.object(langchain_bot, "summary_pool", summary_pool):
+            session, context_messages, overflow, _ = langchain_bot.prepare_answer_context(
+                "And now?", "manuals", self.session.id, max_context_messages=10
+            )
+            langchain_bot.fold_later(session, overflow)
+
+        summary_pool.submit.assert_not_called()
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "")
+        self.assertEqual(self.session.summary_until, 0)
+        self.assertEqual(len(context_messages), 10)
+
+
+class AsyncChatTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        user = User.objects.create(username="reader")
+        self.session = ChatSession.objects.create(user=user)
+
+        async def no_docs(question, index_name):
+            return []
+
+        self.patch_bot(aquery_faiss_index=no_docs, llm=FakeListChatModel(responses=["Refunds take five days."]))
+
+    async def test_async_chat_answers_and_saves_message(self):
+        response = await self.async_client.post(
+            f"/api/chat/async/?session_id={self.session.id}&doc_theme_name=manuals&question=Refunds?"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"answer": "Refunds take five days."})
+        self.assertEqual(await ChatMessage.objects.filter(session=self.session).acount(), 1)
+
+
+class MetricsTests(BotPatchMixin, TestCase):
+    def setUp(self):
+        user = User.objects.create(username="reader")
+        self.session = ChatSession.objects.create(user=user)
+        self.patch_bot(query_faiss_index=lambda question, index_name: [],
+                       llm=FakeListChatModel(responses=["Refunds take five days."]))
+
+    def test_chat_response_has_stage_timings(self):
+        response = self.client.post(
+            f"/api/chat/?session_id={self.session.id}&doc_theme_name=manuals&question=Refunds?"
+        )
+
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertEqual(stages, ["history", "llm", "save", "total"])
+
+    def test_metrics_export_stage_histograms_tokens_and_caches(self):
+        self.client.post(f"/api/chat/?session_id={self.session.id}&doc_theme_name=manuals&question=Refunds?")
+
+        response = self.client.get("/metrics")
+
+        body = response.content.decode()
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('chatbot_stage_seconds_bucket{stage="llm",le="+Inf"}', body)
+        self.assertIn('chatbot_llm_tokens_total{chain="answer",kind="output"}', body)
+        self.assertIn('chatbot_request_seconds_count{view="chat"}', body)
+        self.assertIn('chatbot_cache_hit_ratio{cache="query_embedding"}', body)
+
+
+class IndexingJobTests(TestCase):
+    def setUp(self):
+        self.manuals = DocThemes.objects.create(theme="manuals")
+        self.contracts = DocThemes.objects.create(theme="contracts")
+
+    def test_api_only_enqueues(self):
+        with mock.patch.object(langchain_bot, "generate_faiss") as generate_faiss:
+            response = self.client.post(f"/api/index-jobs/?theme_id={self.manuals.id}")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], IndexingJob.QUEUED)
+        generate_faiss.assert_not_called()
+
+    def test_queued_job_is_reused(self):
+        first = enqueue_indexing_job(self.manuals)
+        second = enqueue_indexing_job(self.manuals)
+
+        self.assertEqual(first.id, second.id)
+
+    def test_theme_with_running_job_is_not_claimed(self):
+        enqueue_indexing_job(self.manuals)
+        running = claim_next_job("worker-a")
+        enqueue_indexing_job(self.manuals)
+        enqueue_indexing_job(self.contracts)
+
+        other = claim_next_job("worker-b")
+
+        self.assertEqual(running.theme, self.manuals)
+        self.assertEqual(other.theme, self.contracts)
+        self.assertIsNone(claim_next_job("worker-c"))
+
+    def test_run_records_progress_and_result(self):
+        def fake_generate_faiss(index_id, index_name, workers=1, progress=None, may_persist=None):
+            progress(1, 2)
+            progress(2, 2)
+            return ["faiss_data/docs/a.txt"]
+
+        enqueue_indexing_job(self.manuals)
+        job = claim_next_job("worker-a")
+        with mock.patch.object(langchain_bot, "generate_faiss", fake_generate_faiss):
+            job = run_indexing_job(job)
+
+        self.assertEqual(job.status, IndexingJob.DONE)
+        self.assertEqual((job.docs_done, job.docs_total), (2, 2))
+        self.assertEqual(job.file_names, ["faiss_data/docs/a.txt"])
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failed_run_releases_theme(self):
+        enqueue_indexing_job(self.manuals)
+        job = claim_next_job("worker-a")
+        with mock.patch.object(langchain_bot, "generate_faiss", side_effect=RuntimeError("boom")):
+            job = run_indexing_job(job)
+        enqueue_indexing_job(self.manuals)
+
+        self.assertEqual(job.status, IndexingJob.FAILED)
+        self.assertEqual(job.error, "boom")
+        self.assertIsNotNone(claim_next_job("worker-b"))
+
+    def test_released_job_stops_and_keeps_its_status(self):
+        persisted = []
+
+        def fake_generate_faiss(index_id, index_name, workers=1, progress=None, may_persist=None):
+            progress(1, 2)
+            # The job looks dead to fail_stale_jobs, which releases it mid-run
+            IndexingJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            fail_stale_jobs(stale_after=60)
+            persisted.append(may_persist())
+            progress(2, 2)
+            return ["faiss_data/docs/a.txt"]
+
+        enqueue_indexing_job(self.manuals)
+        job = claim_next_job("worker-a")
+        with mock.patch.object(langchain_bot, "generate_faiss", fake_generate_faiss):
+            job = run_indexing_job(job)
+
+        self.assertEqual(persisted, [False])
+        self.assertEqual(job.status, IndexingJob.FAILED)
+        self.assertEqual(job.error, "The worker stopped responding.")
+        self.assertEqual(job.docs_done, 1)
+        self.assertEqual(job.file_names, [])
+
+    def test_heartbeat_is_sent_while_a_document_is_indexed(self):
+        enqueue_indexing_job(self.manuals)
+        job = claim_next_job("worker-a")
+        beats = []
+
+        def fake_generate_faiss(index_id, index_name, workers=1, progress=None, may_persist=None):
+            # A single slow document: no progress is reported while it is embedded
+            deadline = time.monotonic() + 5
+            while len(beats) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return []
+
+        # The heartbeat thread's own connection cannot share the in-memory test database
+        with mock.patch.object(langchain_bot, "generate_faiss", fake_generate_faiss), \
+                mock.patch("chatbot.jobs.touch_heartbeat", side_effect=beats.append), \
+                mock.patch("chatbot.jobs.connection"):
+            job = run_indexing_job(job, heartbeat_interval=0.01)
+
+        self.assertEqual(beats[:2], [job.id, job.id])
+        self.assertEqual(job.status, IndexingJob.DONE)
+
+    def test_touch_heartbeat_skips_released_jobs(self):
+        enqueue_indexing_job(self.manuals)
+        job = claim_next_job("worker-a")
+        self.assertEqual(touch_heartbeat(job.id), 1)
+
+        IndexingJob.objects.filter(id=job.id).update(status=IndexingJob.FAILED)
+
+        self.assertEqual(touch_heartbeat(job.id), 0)
+
+    def test_index_faiss_queues_a_job(self):
+        with mock.patch.object(langchain_bot, "generate_faiss") as generate_faiss:
+            call_command("index_faiss", str(self.manuals.id), "manuals", stdout=io.StringIO())
+
+        generate_faiss.assert_not_called()
+        self.assertEqual(claim_next_job("worker-a").theme, self.manuals)
+
+    def test_index_faiss_runs_the_job_under_the_theme_lock(self):
+        enqueue_indexing_job(self.manuals)
+        running = claim_next_job("worker-a")
+
+        with mock.patch.object(langchain_bot, "generate_faiss", return_value=[]) as generate_faiss:
+            with self.assertRaises(CommandError):
+                call_command("index_faiss", str(self.manuals.id), "manuals", "--run", stdout=io.StringIO())
+            generate_faiss.assert_not_called()
+
+            IndexingJob.objects.filter(id=running.id).update(status=IndexingJob.DONE)
+            call_command("index_faiss", str(self.manuals.id), "manuals", "--run", stdout=io.StringIO())
+
+        generate_faiss.assert_called_once()
+        self.assertFalse(IndexingJob.objects.filter(status=IndexingJob.RUNNING).exists())
+
+    def test_held_theme_is_not_claimed_by_workers(self):
+        enqueue_indexing_job(self.manuals)
+
+        with hold_theme(self.manuals, "rebuild") as job:
+            self.assertIsNone(claim_next_job("worker-a"))
+            with self.assertRaises(ThemeBusy):
+                with hold_theme(self.manuals, "convert"):
+                    pass
+
+        self.assertEqual(IndexingJob.objects.get(id=job.id).status, IndexingJob.DONE)
+        self.assertEqual(claim_next_job("worker-a").theme, self.manuals)
+
+    def test_maintenance_commands_refuse_a_theme_being_indexed(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index_root = tmp.name
+        FAISS.from_texts(["legacy chunk"], DeterministicFakeEmbedding(size=8)).save_local(
+            os.path.join(self.index_root, "manuals")
+        )
+        enqueue_indexing_job(self.manuals)
+        claim_next_job("worker-a")
+
+        for command in ("rebuild_faiss_index", "convert_docstore"):
+            with self.assertRaises(CommandError), \
+                    mock.patch("chatbot.management.commands.rebuild_faiss_index.FAISS_INDEX_FILE", self.index_root), \
+                    mock.patch("chatbot.management.commands.convert_docstore.FAISS_INDEX_FILE", self.index_root):
+                call_command(command, "manuals", stdout=io.StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.index_root, "manuals", "index.pkl")))
+
+
+class PaginatedListingTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"user{i}") for i in range(3)]
+        self.sessions = [ChatSession.objects.create(user=user) for user in self.users]
+        self.messages = [
+            ChatMessage.objects.create(session=self.sessions[i % 3], message=f"q{i}", response=f"a{i}")
+            for i in range(7)
+        ]
+        # Several rows sharing a timestamp must still be paged without gaps or repeats
+        ChatMessage.objects.filter(id__in=[m.id for m in self.messages[2:5]]).update(
+            created_at=self.messages[2].created_at
+        )
+
+    def collect_messages(self, url):
+        items, cursor = [], None
+        while True:
+            page_url = f"{url}&cursor={cursor}" if cursor else url
+            response = self.client.get(page_url)
+            items.extend(response.json())
+            cursor = response.get("X-Next-Cursor")
+            if cursor is None:
+                return items
+
+    def test_messages_are_paged_in_order_without_repeats(self):
+        messages = self.collect_messages("/api/messages/?page_size=2")
+
+        self.assertEqual([m["id"] for m in messages], sorted(m.id for m in self.messages))
+
+    def test_messages_page_is_constant_queries(self):
+        session = self.sessions[0]
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/messages/?session_id={session.id}&page_size=2")
+
+        self.assertEqual(len(response.json()), 2)
+        self.assertIn("X-Next-Cursor", response)
+
+    def test_page_size_is_capped(self):
+        ChatMessage.objects.bulk_create(
+            [ChatMessage(session=self.sessions[0], message=f"bulk{i}") for i in range(250)]
+        )
+
+        response = self.client.get("/api/messages/?page_size=1000")
+
+        self.assertEqual(len(response.json()), 200)
+
+    def test_sessions_page_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/session/?page_size=10")
+
+        self.assertEqual([s["user"] for s in response.json()["themes"]], ["user0", "user1", "user2"])
+        self.assertIsNone(response.json()["next_cursor"])
+
+    def test_last_messages_page_has_no_cursor(self):
+        response = self.client.get(f"/api/messages/?session_id={self.sessions[1].id}")
+
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotIn("X-Next-Cursor", response)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/messages/?cursor=not-a-cursor")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_deep_pages_are_read_from_an_index_without_sorting(self):
+        for url in ("/api/messages/?page_size=2", f"/api/messages/?session_id={self.sessions[0].id}&page_size=1",
+                    "/api/session/?page_size=1"):
+            response = self.client.get(url)
+            cursor = response.get("X-Next-Cursor") or response.json().get("next_cursor")
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f"{url}&cursor={cursor}")
+
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {queries.captured_queries[-1]['sql']}")
+                plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+            self.assertNotIn("TEMP B-TREE", plan, url)
+
+
+class MessagesExportTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username="alice")
+        bob = User.objects.create(username="bob")
+        self.alice_session = ChatSession.objects.create(user=self.alice)
+        bob_session = ChatSession.objects.create(user=bob)
+        self.old = ChatMessage.objects.create(session=self.alice_session, message="old", response="a")
+        ChatMessage.objects.filter(id=self.old.id).update(created_at=self.old.created_at - timedelta(days=30))
+        self.recent = ChatMessage.objects.create(session=self.alice_session, message="recent", response="b")
+        ChatMessage.objects.create(session=bob_session, message="bob's", response="c")
+
+    def test_endpoint_streams_filtered_ndjson(self):
+        since = (self.recent.created_at - timedelta(days=1)).isoformat()
+        response = self.client.get("/api/messages/export/", {"user_id": self.alice.id, "since": since})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["message"], "recent")
+        self.assertEqual(rows[0]["user_id"], self.alice.id)
+        self.assertEqual(rows[0]["session_id"], self.alice_session.id)
+
+    def test_command_exports_session_in_order(self):
+        output = tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+
+        call_command("export_messages", session_id=self.alice_session.id, output=output.name,
+                     chunk_size=1, stderr=io.StringIO())
+
+        with open(output.name, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row["message"] for row in rows], ["old", "recent"])
+
+
+class StartupTests(TestCase):
+    def test_importing_the_app_does_not_load_heavy_modules(self):
+        startup = measure_startup()
+
+        self.assertEqual(startup["lazy_modules_loaded"], [])
+
+    def test_answer_chain_is_built_once_per_llm(self):
+        llm = FakeListChatModel(responses=["one", "two"])
+        with mock.patch.object(langchain_bot, "llm", llm):
+            with mock.patch.object(langchain_bot, "build_answer_chain", wraps=langchain_bot.build_answer_chain) as build:
+                self.assertEqual(langchain_bot.generate_answer("Hi?", [], []), "one")
+                self.assertEqual(langchain_bot.generate_answer("Hi?", [], []), "two")
+
+        self.assertEqual(build.call_count, 1)
+
+
+class BenchmarkBaselineTests(TestCase):
+    def test_slower_latency_and_lower_throughput_are_regressions(self):
+        baseline = {"retrieval": {"p95_s": 0.010, "throughput_rps": 100.0, "wall_s": 1.0},
+                    "indexing": {"docs_per_s": 50.0, "docs": 20}}
+        results = {"retrieval": {"p95_s": 0.011, "throughput_rps": 70.0, "wall_s": 3.0},
+                   "indexing": {"docs_per_s": 20.0, "docs": 20}}
+
+        regressions = compare_to_baseline(results, baseline, tolerance=0.2)
+
+        self.assertEqual([name for name, _, _ in regressions], ["retrieval.throughput_rps", "indexing.docs_per_s"])
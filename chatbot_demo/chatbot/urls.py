@@ -4,8 +4,13 @@ from .views import *
 urlpatterns = [    
     # Only get and post
     path('chat/', Chat.as_view(), name='chat'),
+    path('chat/async/', async_chat, name='chat-async'),
     path('messages/', Messages.as_view(), name='messages'),
+    path('messages/export/', MessagesExport.as_view(), name='messages-export'),
     path('session/', Session.as_view(), name='sessions'),
     path('themes/', Themes.as_view(), name='themes'),
     path('partitions/', Partitions.as_view(), name='partitions'),
+    path('index-jobs/', IndexJobs.as_view(), name='index-jobs'),
+    path('cache-stats/', CacheStats.as_view(), name='cache-stats'),
+    path('index-cache/', IndexCacheStats.as_view(), name='index-cache'),  # Before cache-stats/ existed
 ]
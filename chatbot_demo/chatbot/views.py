@@ -1,7 +1,18 @@
 # from django.contrib.auth.decorators import login_required
+import json
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .models import *
 from .serializers import *
-from .langchain_bot import get_answer_from_index_with_memory
+from .jobs import enqueue_indexing_job
+from .pagination import keyset_page, parse_page_size
+from .export import export_queryset, iter_ndjson
+from .metrics import cache_metric_lines, render_metrics
+from .langchain_bot import (
+    get_answer_from_index_with_memory, aget_answer_from_index_with_memory, stream_answer_from_index_with_memory,
+    answer_cache, index_cache, query_embedding_cache
+)
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -16,8 +27,10 @@ class Chat(APIView):
                 type=openapi.TYPE_INTEGER, required=True
             ),
             openapi.Parameter(
-                'doc_theme_name', openapi.IN_QUERY, description="Name of the theme user is consulting",
-                type=openapi.TYPE_STRING, required=True
+                'doc_theme_name', openapi.IN_QUERY,
+                description="Name of the theme user is consulting; repeat it to search several themes",
+                type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING),
+                collection_format='multi', required=True
             ),
             openapi.Parameter(
                 'max_context_messages', openapi.IN_QUERY, description="Maximum number of context messages to consider",
@@ -26,7 +39,11 @@ class Chat(APIView):
             openapi.Parameter(
                 'question', openapi.IN_QUERY, description="Question for chatbot",
                 type=openapi.TYPE_STRING, required=True
-            )            
+            ),
+            openapi.Parameter(
+                'stream', openapi.IN_QUERY, description="Stream the answer as Server-Sent Events",
+                type=openapi.TYPE_BOOLEAN, required=False
+            )
         ]
     )
 
@@ -34,13 +51,14 @@ class Chat(APIView):
         # Extract query parameters and pass them to the serializer
         data = {
             "session_id": request.query_params.get("session_id"),
-            "doc_theme_name": request.query_params.get("doc_theme_name"),
+            "doc_theme_name": request.query_params.getlist("doc_theme_name") or None,
             "max_context_messages": request.query_params.get("max_context_messages"),
-            "question": request.query_params.get("question")
+            "question": request.query_params.get("question"),
+            "stream": request.query_params.get("stream")
         }
 
-        # Use the serializer to validate and parse data
-        serializer = ChatRequestSerializer(data=data)
+        # Use the serializer to validate and parse data, leaving unset parameters to their defaults
+        serializer = ChatRequestSerializer(data={key: value for key, value in data.items() if value is not None})
 
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -51,6 +69,9 @@ class Chat(APIView):
         max_context_messages = serializer.validated_data.get("max_context_messages")
         question = serializer.validated_data.get("question")
 
+        if serializer.validated_data.get("stream"):
+            return self.stream(question, index_name, session_id, max_context_messages)
+
         try:
             # Get the answer using the provided parameters
             answer = get_answer_from_index_with_memory(question, index_name, session_id, max_context_messages)
@@ -58,6 +79,77 @@ class Chat(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def stream(self, question, index_name, session_id, max_context_messages):
+        try:
+            tokens = stream_answer_from_index_with_memory(question, index_name, session_id, max_context_messages)
+        except ChatSession.DoesNotExist:
+            return Response({"error": "Session not found."}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = StreamingHttpResponse(sse_events(tokens), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Don't let a proxy buffer the stream
+        return response
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_events(tokens):
+    answer_parts = []
+    try:
+        for token in tokens:
+            answer_parts.append(token)
+            yield sse_event("token", {"token": token})
+        yield sse_event("done", {"answer": "".join(answer_parts)})
+    except Exception as e:
+        print(f"An error occurred while streaming the answer: {e}")
+        yield sse_event("error", {"error": "I am unable to answer that question at the moment."})
+    finally:
+        # Closing the token stream saves the message when the client disconnects
+        tokens.close()
+
+@csrf_exempt
+@require_POST
+async def async_chat(request):
+    # Same contract as Chat.post, served by a native async view so an ASGI worker
+    # keeps many chats in flight while they wait on the embeddings API and the LLM
+    data = {
+        "session_id": request.GET.get("session_id"),
+        "doc_theme_name": request.GET.getlist("doc_theme_name") or None,
+        "max_context_messages": request.GET.get("max_context_messages"),
+        "question": request.GET.get("question")
+    }
+
+    serializer = ChatRequestSerializer(data={key: value for key, value in data.items() if value is not None})
+
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        answer = await aget_answer_from_index_with_memory(
+            serializer.validated_data.get("question"),
+            serializer.validated_data.get("doc_theme_name"),
+            serializer.validated_data.get("session_id"),
+            serializer.validated_data.get("max_context_messages"),
+        )
+        return JsonResponse({"answer": answer}, status=status.HTTP_200_OK)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# Query parameters shared by the keyset-paginated listings
+PAGINATION_PARAMETERS = [
+    openapi.Parameter(
+        'cursor', openapi.IN_QUERY,
+        description="Cursor returned by the previous page (next_cursor, or the X-Next-Cursor header of messages)",
+        type=openapi.TYPE_STRING, required=False
+    ),
+    openapi.Parameter(
+        'page_size', openapi.IN_QUERY, description="Number of items per page (max 200)",
+        type=openapi.TYPE_INTEGER, required=False
+    )
+]
+
 class Messages(APIView):
     @swagger_auto_schema(
         manual_parameters=[
@@ -69,7 +161,7 @@ class Messages(APIView):
                 'user_id', openapi.IN_QUERY, description="ID of the user",
                 type=openapi.TYPE_INTEGER, required=False
             )
-        ]
+        ] + PAGINATION_PARAMETERS
     )
 
     def get(self, request):
@@ -77,6 +169,11 @@ class Messages(APIView):
         session_id = request.query_params.get("session_id")
         user_id = request.query_params.get("user_id")
 
+        try:
+            page_size = parse_page_size(request.query_params.get("page_size"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         # Build the query filters dynamically
         filters = {}
 
@@ -84,10 +181,9 @@ class Messages(APIView):
         if session_id:
             try:
                 # Check if the session exists
-                ChatSession.objects.get(id=session_id)
+                if not ChatSession.objects.filter(id=session_id).exists():
+                    return Response({"error": "Chat session not found."}, status=status.HTTP_404_NOT_FOUND)
                 filters['session_id'] = session_id
-            except ChatSession.DoesNotExist:
-                return Response({"error": "Chat session not found."}, status=status.HTTP_404_NOT_FOUND)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -95,33 +191,82 @@ class Messages(APIView):
         if user_id:
             try:
                 # Check if the user exists
-                User.objects.get(id=user_id)
+                if not User.objects.filter(id=user_id).exists():
+                    return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
                 filters['session__user_id'] = user_id
-            except User.DoesNotExist:
-                return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         try:
-            # Apply filters directly to the queryset
-            messages = ChatMessage.objects.filter(**filters)
-
-            # Serialize and return the filtered messages
-            serializer = ChatMessagesSerializer(messages, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # Apply filters directly to the queryset and read one page of it
+            messages = ChatMessage.objects.filter(**filters).only('id', 'session_id', 'created_at', 'message', 'response')
+            messages, next_cursor = keyset_page(messages, request.query_params.get("cursor"), page_size)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             # Catch any other unexpected errors
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # Serialize and return the filtered messages. The body stays a list as
+        # before paging; the next page's cursor is sent in a header.
+        serializer = ChatMessagesSerializer(messages, many=True)
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            response["X-Next-Cursor"] = next_cursor
+        return response
+
+class MessagesExport(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'user_id', openapi.IN_QUERY, description="ID of the user",
+                type=openapi.TYPE_INTEGER, required=False
+            ),
+            openapi.Parameter(
+                'session_id', openapi.IN_QUERY, description="ID of the chat session",
+                type=openapi.TYPE_INTEGER, required=False
+            ),
+            openapi.Parameter(
+                'since', openapi.IN_QUERY, description="Only messages created at or after this ISO datetime",
+                type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME, required=False
+            ),
+            openapi.Parameter(
+                'until', openapi.IN_QUERY, description="Only messages created before this ISO datetime",
+                type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME, required=False
+            )
+        ]
+    )
+    def get(self, request):
+        serializer = MessagesExportSerializer(data=request.query_params)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Stream one JSON object per line instead of building the whole list in memory
+        messages = export_queryset(**serializer.validated_data)
+        response = StreamingHttpResponse(iter_ndjson(messages), content_type="application/x-ndjson")
+        response["Content-Disposition"] = 'attachment; filename="messages.ndjson"'
+        return response
+
 class Session(APIView):
     
+    @swagger_auto_schema(manual_parameters=PAGINATION_PARAMETERS)
     def get(self, request):
-        sessions = ChatSession.objects.all()
+        try:
+            page_size = parse_page_size(request.query_params.get("page_size"))
+            # Join the user in the same query instead of one query per session
+            sessions = ChatSession.objects.select_related('user').only(
+                'id', 'created_at', 'updated_at', 'user__username'
+            )
+            sessions, next_cursor = keyset_page(sessions, request.query_params.get("cursor"), page_size)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         sessions_list = [{"id": session.id,
                           "user": session.user.username,
                           "created_at": session.created_at,
                           "updated_at": session.updated_at,} for session in sessions]
-        return Response({"themes": sessions_list}, status=status.HTTP_200_OK)
+        return Response({"themes": sessions_list, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
     
     @swagger_auto_schema(
         manual_parameters=[
@@ -207,3 +352,80 @@ class Themes(APIView):
         
         # Return the created theme's details
         return Response({"id": new_theme.id, "theme": new_theme.theme}, status=status.HTTP_201_CREATED)
+
+class IndexJobs(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'job_id', openapi.IN_QUERY, description="ID of the indexing job",
+                type=openapi.TYPE_INTEGER, required=False
+            ),
+            openapi.Parameter(
+                'theme_id', openapi.IN_QUERY, description="ID of the theme",
+                type=openapi.TYPE_INTEGER, required=False
+            )
+        ]
+    )
+    def get(self, request):
+        job_id = request.query_params.get("job_id")
+        theme_id = request.query_params.get("theme_id")
+
+        jobs = IndexingJob.objects.select_related('theme').order_by('-created_at')
+        if job_id:
+            try:
+                return Response(IndexingJobSerializer(jobs.get(id=job_id)).data, status=status.HTTP_200_OK)
+            except IndexingJob.DoesNotExist:
+                return Response({"error": "Indexing job not found."}, status=status.HTTP_404_NOT_FOUND)
+        if theme_id:
+            jobs = jobs.filter(theme_id=theme_id)
+
+        # Most recent jobs first
+        serializer = IndexingJobSerializer(jobs[:50], many=True)
+        return Response({"jobs": serializer.data}, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'theme_id', openapi.IN_QUERY, description="ID of the theme to index",
+                type=openapi.TYPE_INTEGER, required=True
+            )
+        ],
+        responses={
+            202: "Indexing job queued",
+            400: "Invalid input or missing parameters",
+            404: "Theme not found"
+        }
+    )
+    def post(self, request):
+        theme_id = request.query_params.get("theme_id")
+
+        if not theme_id:
+            return Response({"error": "Theme id is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            theme = DocThemes.objects.get(id=theme_id)
+        except (DocThemes.DoesNotExist, ValueError):
+            return Response({"error": "Theme does not exist"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Only queue the job; the index_worker command does the indexing
+        job = enqueue_indexing_job(theme)
+        return Response(IndexingJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+class CacheStats(APIView):
+    def get(self, request):
+        # Hit/miss counters of the retrieval caches in this worker process
+        return Response({"index_cache": index_cache.stats(),
+                         "query_embedding_cache": query_embedding_cache.stats(),
+                         "answer_cache": answer_cache.stats()}, status=status.HTTP_200_OK)
+
+class IndexCacheStats(APIView):
+    def get(self, request):
+        # Hit/miss counters of the FAISS index cache alone, as served before cache-stats/
+        return Response(index_cache.stats(), status=status.HTTP_200_OK)
+
+def metrics(request):
+    # Prometheus scrape endpoint: stage and request latency histograms, LLM
+    # token counts and the retrieval cache counters of this worker process
+    lines = cache_metric_lines({"index": index_cache.stats(), "query_embedding": query_embedding_cache.stats(),
+                                "answer": answer_cache.stats()})
+    return HttpResponse(render_metrics(lines), content_type="text/plain; version=0.0.4; charset=utf-8")
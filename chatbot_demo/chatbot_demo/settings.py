@@ -34,6 +34,72 @@ FAISS_DATA_DIR = os.path.join(BASE_DIR, 'faiss_data')
 FAISS_DOCS_DIR = os.path.join(FAISS_DATA_DIR, 'docs')
 FAISS_INDEX_FILE = os.path.join(FAISS_DATA_DIR, 'db')
 
+# Maximum number of theme indexes kept loaded in memory per process
+FAISS_INDEX_CACHE_SIZE = int(os.getenv('FAISS_INDEX_CACHE_SIZE', 8))
+
+# Serve theme indexes read-only through memory-mapped files shared by all workers
+FAISS_INDEX_MMAP = os.getenv('FAISS_INDEX_MMAP', 'false').lower() in ('1', 'true', 'yes')
+
+# On-disk cache of chunk embeddings, so re-indexing does not call the API again
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(FAISS_DATA_DIR, 'embedding_cache.sqlite3'))
+
+# Themes a single chat question can search, and threads searching them in parallel
+CHAT_MAX_THEMES = int(os.getenv('CHAT_MAX_THEMES', 8))
+FAISS_SEARCH_THREADS = int(os.getenv('FAISS_SEARCH_THREADS', 8))
+
+# Threads retrieving chunks for chat questions while the request thread loads
+# the session history; bounds the retrievals in flight per worker process
+CHAT_RETRIEVAL_THREADS = int(os.getenv('CHAT_RETRIEVAL_THREADS', 16))
+
+# Threads folding old turns into session summaries after the answer is sent
+CHAT_SUMMARY_THREADS = int(os.getenv('CHAT_SUMMARY_THREADS', 2))
+
+# Identical questions asked concurrently (same normalized question, history and
+# retrieved chunks) share one LLM completion; each chat still saves its message
+CHAT_COALESCE_ANSWERS = os.getenv('CHAT_COALESCE_ANSWERS', 'true').lower() in ('1', 'true', 'yes')
+
+# Answers to questions asked without conversation context are reused for later
+# questions on the same themes whose embedding has at least this cosine
+# similarity, until they expire or the theme is re-indexed (opt-in)
+SEMANTIC_ANSWER_CACHE = os.getenv('SEMANTIC_ANSWER_CACHE', 'false').lower() in ('1', 'true', 'yes')
+SEMANTIC_ANSWER_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_ANSWER_CACHE_THRESHOLD', 0.95))
+SEMANTIC_ANSWER_CACHE_TTL = int(os.getenv('SEMANTIC_ANSWER_CACHE_TTL', 3600))
+SEMANTIC_ANSWER_CACHE_SIZE = int(os.getenv('SEMANTIC_ANSWER_CACHE_SIZE', 1000))
+
+# Vectors used to train IVF theme indexes; a new index is built once this many
+# chunks are embedded (or at the end of the run for smaller themes)
+FAISS_TRAINING_SAMPLE_SIZE = int(os.getenv('FAISS_TRAINING_SAMPLE_SIZE', 50000))
+
+# Share of removed vectors an HNSW theme index may still hold before the
+# indexing run rebuilds it without them
+FAISS_COMPACT_THRESHOLD = float(os.getenv('FAISS_COMPACT_THRESHOLD', 0.2))
+
+# Chunks already in a theme index, verbatim or with a SimHash at most
+# CHUNK_SIMHASH_DISTANCE bits away (0-3, 0 = exact only), are not embedded again.
+# A skipped near duplicate is not stored, so the text where it differs (e.g. the
+# amended amount in a new contract version) is not in the index.
+CHUNK_DEDUP = os.getenv('CHUNK_DEDUP', 'true').lower() in ('1', 'true', 'yes')
+CHUNK_SIMHASH_DISTANCE = int(os.getenv('CHUNK_SIMHASH_DISTANCE', 0))
+
+# Processes used to extract document text while indexing (1 = in-process)
+INDEXING_EXTRACT_WORKERS = int(os.getenv('INDEXING_EXTRACT_WORKERS', 1))
+
+# Seconds between heartbeats of a running indexing job; keep well below the
+# index_worker --stale-after limit
+INDEXING_HEARTBEAT_INTERVAL = int(os.getenv('INDEXING_HEARTBEAT_INTERVAL', 60))
+
+# In-process cache of question embeddings used by the chat retrieval path.
+# Set QUERY_EMBEDDING_CACHE_ALIAS to a CACHES alias to share it across workers.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 1024))
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv('QUERY_EMBEDDING_CACHE_TTL', 3600))
+QUERY_EMBEDDING_CACHE_ALIAS = os.getenv('QUERY_EMBEDDING_CACHE_ALIAS') or None
+
+# Token budget for the conversation history sent with each question (rolling
+# summary plus recent turns); older turns are folded into the summary in
+# batches of SUMMARY_FOLD_BATCH messages
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', 1500))
+SUMMARY_FOLD_BATCH = int(os.getenv('SUMMARY_FOLD_BATCH', 10))
+
 # Ensure the FAISS data directories exist
 os.makedirs(FAISS_DOCS_DIR, exist_ok=True)
 
@@ -55,6 +121,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the Server-Timing total covers the other middleware
+    'chatbot.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
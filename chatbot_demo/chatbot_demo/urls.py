@@ -19,6 +19,7 @@ from django.urls import path, include, re_path
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from chatbot.views import metrics
 
 # Configuración de Swagger
 schema_view = get_schema_view(
@@ -36,6 +37,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('chatbot.urls')),  # Routes API requests to the chatbot app
+    path('metrics', metrics, name='metrics'),  # Prometheus scrape endpoint
 
     # Swagger 
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),